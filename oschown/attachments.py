@@ -0,0 +1,90 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import collections
+
+
+class AttachmentIndex(object):
+    """Which instances and volumes are attached to each other.
+
+    This is filled in with one scan of the BDMs of a set of instances
+    and one of the attachments of a set of volumes (like everything
+    owned by a project), after which the attachments of any of those
+    are plain dict lookups instead of a query per page on each side.
+    Both directions are indexed, so an attachment found from either
+    side is seen from the other. Instances and volumes that were not
+    scanned are not covered, and must be looked up as usual.
+    """
+
+    def __init__(self):
+        self._volumes = collections.defaultdict(set)
+        self._instances = collections.defaultdict(set)
+        self._scanned_instances = set()
+        self._scanned_volumes = set()
+
+    def __len__(self):
+        return sum(len(volumes) for volumes in self._volumes.values())
+
+    def _link(self, instance_uuid, volume_id):
+        self._volumes[instance_uuid].add(volume_id)
+        self._instances[volume_id].add(instance_uuid)
+
+    def add_instances(self, rows):
+        """Add (instance_uuid, volume_id) rows from a scan of BDMs.
+
+        Every volume BDM of the scanned instances must be included, and
+        instances without any as (instance_uuid, None).
+        """
+        for instance_uuid, volume_id in rows:
+            self._scanned_instances.add(instance_uuid)
+            if volume_id:
+                self._link(instance_uuid, volume_id)
+
+    def add_volumes(self, rows):
+        """Add (volume_id, instance_uuid) rows from a scan of attachments.
+
+        Every attachment of the scanned volumes must be included, and
+        volumes without any as (volume_id, None).
+        """
+        for volume_id, instance_uuid in rows:
+            self._scanned_volumes.add(volume_id)
+            if instance_uuid:
+                self._link(instance_uuid, volume_id)
+
+    @staticmethod
+    def _lookup(scanned, links, ids):
+        found = {}
+        missing = []
+        for item_id in ids:
+            if item_id in scanned:
+                found[item_id] = sorted(links.get(item_id, ()))
+            else:
+                missing.append(item_id)
+        return found, missing
+
+    def volumes_by_instance(self, instance_uuids):
+        """Look up the volumes attached to @instance_uuids.
+
+        Returns a dict of instance_uuid: [volume_id] for the covered
+        instances, and a list of those that are not covered.
+        """
+        return self._lookup(self._scanned_instances, self._volumes,
+                            instance_uuids)
+
+    def instances_by_volume(self, volume_ids):
+        """Look up the instances attached to @volume_ids.
+
+        Returns a dict of volume_id: [instance_uuid] for the covered
+        volumes, and a list of those that are not covered.
+        """
+        return self._lookup(self._scanned_volumes, self._instances,
+                            volume_ids)
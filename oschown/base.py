@@ -9,16 +9,176 @@
 #  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #  License for the specific language governing permissions and limitations
 #  under the License.
+import logging
+import threading
+import time
+
+from oschown import exception
+from oschown import progress
+from oschown import stats
+from oschown import throttle
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CELL_TIMEOUT = 60
+LATENCY_SAMPLES = 3
+
+
+def version_stamp(value):
+    """Format a resource's updated_at (or similar) as a plan version."""
+    return value.isoformat() if value is not None else None
+
+
+def check_plan_versions(project_name, resources, planned):
+    """Check collected resources against the versions in a saved plan.
+
+    Collecting can find resources that are not in the plan, such as a
+    floating IP associated with a port after the plan was saved.
+
+    :raises: exception.PlanOutOfDate if any of them have changed, or
+             are not in the plan
+    """
+    added = [resource_id for resource_id in resources
+             if resource_id not in planned]
+    if added:
+        raise exception.PlanOutOfDate(
+            '%s resources %s have appeared since the plan was saved' % (
+                project_name, ','.join(sorted(added))))
+    changed = [resource_id for resource_id, resource in resources.items()
+               if resource.version != planned[resource_id][0]]
+    if changed:
+        raise exception.PlanOutOfDate(
+            '%s resources %s have changed since the plan was saved' % (
+                project_name, ','.join(sorted(changed))))
+
+
+def check_database(name, engine, tables):
+    """Check that a database is reachable and has the expected schema.
+
+    @tables is a dict of table name: [column name] that must exist.
+
+    :raises: exception.ProjectCheckFailed if not
+    """
+    import sqlalchemy
+
+    try:
+        with engine.connect() as conn:
+            conn.execute(sqlalchemy.text('SELECT 1'))
+            inspector = sqlalchemy.inspect(conn)
+            existing = set(inspector.get_table_names())
+            for table, columns in sorted(tables.items()):
+                if table not in existing:
+                    raise exception.ProjectCheckFailed(
+                        '%s database has no %s table' % (name, table))
+                found = set(column['name']
+                            for column in inspector.get_columns(table))
+                missing = set(columns) - found
+                if missing:
+                    raise exception.ProjectCheckFailed(
+                        '%s database table %s has no %s column' % (
+                            name, table, ','.join(sorted(missing))))
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        raise exception.ProjectCheckFailed(
+            'Unable to use %s database: %s' % (name, e))
+
+
+def count_pages(count, size):
+    """Return the number of pages of @size needed to hold @count items."""
+    return (count + size - 1) // size
+
+
+def watch_engines(engines):
+    """Throttle and count statements run by a dict of name: engine.
+
+    Engines that are already watched are skipped, so projects should
+    call this again for any engines they find after being loaded.
+    """
+    # NOTE: Throttle first, so that time spent waiting for the
+    # throttle is not counted as statement time.
+    throttle.THROTTLE.watch_engines(engines)
+    stats.STATS.watch_engines(engines)
+
+
+def measure_latency(engine, samples=LATENCY_SAMPLES):
+    """Return the shortest of @samples round trips to @engine, in seconds.
+
+    This is a lower bound for the time one statement will take.
+    """
+    import sqlalchemy
+
+    latencies = []
+    with engine.connect() as conn:
+        for i in range(samples):
+            start = time.time()
+            conn.execute(sqlalchemy.text('SELECT 1'))
+            latencies.append(time.time() - start)
+    return min(latencies)
+
+
+def verify_owner(query, model, key, ids, expected, batch_size,
+                 expect_all=False):
+    """Check that rows of @model have been chown'ed, with COUNT queries.
+
+    @query(model, *entities) returns a query of @entities against the
+    live rows of @model. The rows whose @key column is in @ids should
+    have the column values in the dict @expected. One grouped COUNT
+    query is run per @batch_size ids, and only if that finds rows with
+    other values (or missing rows, if @expect_all) are their ids looked
+    up.
+
+    Returns a sorted list of mismatched (or missing) ids.
+    """
+    import sqlalchemy
+
+    names = sorted(expected)
+    columns = [getattr(model, name) for name in names]
+    wanted = tuple(expected[name] for name in names)
+    key_column = getattr(model, key)
+    mismatched = set()
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        rows = query(model, *(columns + [sqlalchemy.func.count()])).filter(
+            key_column.in_(batch)).group_by(*columns).all()
+        if any(tuple(row[:-1]) != wanted for row in rows):
+            wrong = sqlalchemy.or_(*[sqlalchemy.or_(column != value,
+                                                    column.is_(None))
+                                     for column, value in zip(columns,
+                                                              wanted)])
+            mismatched.update(row[0] for row in query(model, key_column)
+                              .filter(key_column.in_(batch), wrong))
+        if expect_all and sum(row[-1] for row in rows) < len(batch):
+            found = set(row[0] for row in query(model, key_column).filter(
+                key_column.in_(batch)))
+            mismatched.update(set(batch) - found)
+    return sorted(mismatched)
 
 
 class ChownContext(object):
     """A context object for a given chown operation."""
 
     def __init__(self, target_user_id, target_project_id,
-                 dry_run=False):
+                 dry_run=False, page_size=DEFAULT_PAGE_SIZE,
+                 bulk=False, batch_size=DEFAULT_BATCH_SIZE,
+                 resolve_workers=1, chown_workers=1, max_db_writers=None,
+                 save_plan=None, cell_timeout=DEFAULT_CELL_TIMEOUT,
+                 verify=False, attachments=None, source_project_id=None):
         self.target_user_id = target_user_id
         self.target_project_id = target_project_id
         self.dry_run = dry_run
+        self.page_size = page_size
+        self.bulk = bulk
+        self.batch_size = batch_size
+        self.resolve_workers = resolve_workers
+        self.chown_workers = chown_workers
+        self.max_db_writers = max_db_writers or chown_workers
+        self.save_plan = save_plan
+        self.cell_timeout = cell_timeout
+        self.verify = verify
+        self.attachments = attachments
+        # Set when everything owned by this project is being moved
+        self.source_project_id = source_project_id
 
 
 class ChownableResource(object):
@@ -41,6 +201,16 @@ class ChownableResource(object):
 
         return []
 
+    @property
+    def version(self):
+        """Return a stamp which changes whenever the resource does.
+
+        This is used to check whether a saved plan still applies, and
+        may be None if the resource has nothing suitable.
+        """
+
+        return None
+
     def chown(self, context):
         """Actually change ownership of this resource."""
 
@@ -51,13 +221,15 @@ class ChownableProject(object):
     """Base class for a project that supports oschown.
 
     This represents a project that has some resources which may need
-    to be chown'd. When the query methods are called, the project
-    should collect resources based on ChownableResource in the
-    @resources field.
+    to be chown'd. When collect_resources_by_owner() is called, the
+    project should collect resources based on ChownableResource in the
+    @resources field. The by-id lookups return the resources to the
+    caller instead, so that they are not held after they are chown'd.
     """
 
     def __init__(self):
         self._resources = []
+        self._local = threading.local()
 
     @property
     def name(self):
@@ -69,13 +241,191 @@ class ChownableProject(object):
         """Return the list of resources collected by the project."""
         return self._resources
 
+    @property
+    def admin_context(self):
+        """An admin context for this project, reused within a thread."""
+        ctx = getattr(self._local, 'admin_context', None)
+        if ctx is None:
+            ctx = self._local.admin_context = self.get_admin_context()
+        return ctx
+
+    def get_admin_context(self):
+        """Create a new admin context for this project."""
+        return None
+
+    def get_engines(self):
+        """Return a dict of name: SQLAlchemy engine used by this project.
+
+        Projects that find more databases as they go (like nova cells)
+        should include them once found, and pass them to watch_engines().
+        """
+        return {}
+
+    def configure_databases(self, connections):
+        """Point this project at other databases.
+
+        @connections is a dict of database name (as in get_engines())
+        to SQLAlchemy URL. This must be called before the databases
+        are first used.
+        """
+        if connections:
+            raise NotImplementedError()
+
     def check(self, context):
+        """Check that this project can be used, before resolving anything.
+
+        This should be quick, and may be run in a separate thread.
+
+        :raises: exception.ProjectCheckFailed if not
+        """
         pass
 
     def collect_resources_by_owner(self, context, user_id, project_id):
         """Collect all resources owned by @user_id and @project_id."""
+        for page in self.iter_resource_ids_by_owner(context, project_id):
+            resources = self.collect_resources_by_ids(context, page)
+            self._resources.extend(resources.values())
+
+    def iter_resource_ids_by_owner(self, context, project_id):
+        """Generate pages of ids of resources owned by @project_id.
+
+        Each page is a list of at most context.page_size resource ids,
+        which are listed using a marker so that only one page needs to
+        be held at a time.
+        """
+        return iter([])
+
+    def scan_attachments(self, context, project_id, index):
+        """Add the attachments of everything owned by @project_id.
+
+        @index is an attachments.AttachmentIndex, which should be
+        filled in with one scan of each table involved. Projects with
+        no attachments leave it alone.
+        """
         pass
 
     def collect_resource_by_id(self, context, resource_id):
         """Collect a specific resource by id."""
         pass
+
+    def collect_resources_by_ids(self, context, resource_ids):
+        """Collect a set of resources by id.
+
+        Returns a dict of resource_id: ChownableResource. The default
+        implementation calls collect_resource_by_id() for each one, but
+        projects should override this to fetch the whole set in bulk.
+        Dependencies loaded along the way may be returned as well, so
+        that they do not have to be looked up again. Attachments should
+        be taken from context.attachments where it covers them.
+        """
+        return {resource_id: self.collect_resource_by_id(context,
+                                                         resource_id)
+                for resource_id in resource_ids}
+
+    def collect_planned_resources(self, context, planned):
+        """Collect resources from a saved plan, skipping discovery.
+
+        @planned is a dict of resource_id: (version, dependencies) as
+        saved in the plan. Returns a dict like collect_resources_by_ids().
+        Projects should override this to avoid looking up dependencies
+        again, since they are already known.
+
+        :raises: exception.PlanOutOfDate if any resource has changed
+        """
+        resources = self.collect_resources_by_ids(context, list(planned))
+        check_plan_versions(self.name, resources, planned)
+        return resources
+
+    def check_project(self, context, project_id):
+        """Check that everything owned by @project_id can be moved.
+
+        This is called before the first page of a project-wide move, so
+        that anything that would be refused partway through is refused
+        up front instead. It should only run aggregate queries.
+
+        :raises: exception.ResourceInUse or exception.ProjectCheckFailed
+                 if not
+        """
+        pass
+
+    def check_resources(self, context, resources):
+        """Check that @resources can be chown'ed as a set.
+
+        This is called for all of a collection's resources before any
+        of them are chown'ed, so that a resource which is shared with
+        others that are not moving can be refused rather than pulling
+        them all in.
+
+        :raises: exception.ResourceInUse if not
+        """
+        pass
+
+    def chown_resources(self, context, resources):
+        """Change ownership of a set of this project's resources.
+
+        Returns a dict of table: affected row count for any set-based
+        updates that were made. The default implementation chowns each
+        resource on its own, which is also what projects should do
+        unless context.bulk is set.
+        """
+        for resource in resources:
+            LOG.info('Chowning resource %s' % resource.identifier)
+            with stats.STATS.phase('chown_resource:%s' % self.name):
+                resource.chown(context)
+            progress.PROGRESS.add_done('chown', self.name)
+        return {}
+
+    def verify_resources(self, context, resources):
+        """Check that @resources now belong to the target project/user.
+
+        This should use a few set-based queries rather than looking at
+        each resource. Returns a dict of table: [mismatched id] for any
+        tables with rows that were not chown'ed.
+        """
+        return {}
+
+    def estimate(self, context, project_id):
+        """Count what moving everything owned by @project_id would touch.
+
+        This should only run aggregate queries, without building any
+        resources. Returns a dict of name: count.
+        """
+        return {}
+
+    def count_resources(self, counts):
+        """Return how many resources @counts from estimate() covers.
+
+        This is used to report progress on moving a whole project, and
+        may be None if the project does not know.
+        """
+        return None
+
+    def estimate_statements(self, context, counts):
+        """Return roughly how many statements moving @counts would take.
+
+        @counts is as returned by estimate(), and the estimate should
+        cover listing, resolving and chowning with the options in
+        @context. The default assumes one statement per row counted.
+        """
+        return sum(counts.values())
+
+    def quota_deltas(self, context, resources):
+        """Calculate the quota usage changes for chowning @resources.
+
+        Returns a dict of key: delta, where the keys are only meaningful
+        to apply_quota_deltas(). This is called before the resources are
+        chown'ed, and should leave out anything the project's own chown
+        path already accounts for.
+        """
+        return {}
+
+    def apply_quota_deltas(self, context, deltas):
+        """Apply the quota usage changes from quota_deltas().
+
+        @deltas are those of all resources chown'ed in the move added up,
+        and should be applied in a single transaction. Returns the
+        number of usage rows changed.
+        """
+        if deltas:
+            raise NotImplementedError()
+        return 0
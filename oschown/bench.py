@@ -0,0 +1,354 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+"""Offline benchmarks for resolution and chown.
+
+This fills local SQLite stand-ins for the nova, nova_api and cinder
+databases with synthetic tenants of different sizes, points the real
+NovaProject and CinderProject at them, and times resolving and
+chowning each tenant. For example:
+
+    python -m oschown.bench --scales 10,100,1000 --actions-per-instance 50
+
+With --startup, it also compares the time to start up and load only
+the project a job needs (as oschown does) with loading every project
+up front (as it did before projects were loaded lazily).
+
+Since accepting a volume transfer needs a running cinder-volume
+service, cinder resources are always chowned in bulk mode here.
+"""
+
+import argparse
+import collections
+import copy
+import datetime
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from oschown import base
+from oschown import projects
+from oschown import stats
+from oschown import workflows
+
+LOG = logging.getLogger(__name__)
+
+# NOTE: Run in a fresh interpreter, so that nothing is already imported.
+STARTUP_SCRIPT = '\n'.join([
+    'import sys, time',
+    'start = time.time()',
+    'from oschown import projects, workflows',
+    'for name in sys.argv[1:]: projects.PROJECTS[name]',
+    'print(time.time() - start)',
+])
+
+# NOTE: Only these have stand-in databases, so the others are left
+# out of listing and indexing rather than loaded and queried.
+BENCH_PROJECTS = ('nova', 'cinder')
+
+DATABASES = {
+    'nova': ('nova', 'nova.sqlite'),
+    'nova_api': ('nova', 'nova_api.sqlite'),
+    'cinder': ('cinder', 'cinder.sqlite'),
+}
+
+
+def _get_arg_parser():
+    parser = argparse.ArgumentParser(prog='python -m oschown.bench')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        default=False,
+                        help='Enable verbose output')
+    parser.add_argument('--scales', default='10,100,1000',
+                        help='Comma-separated numbers of instances for '
+                        'each synthetic tenant')
+    parser.add_argument('--volumes-per-instance', type=int, default=1,
+                        metavar='N',
+                        help='Attached volumes (and BDMs) per instance')
+    parser.add_argument('--snapshots-per-volume', type=int, default=0,
+                        metavar='N',
+                        help='Snapshots per volume')
+    parser.add_argument('--actions-per-instance', type=int, default=10,
+                        metavar='N',
+                        help='Instance actions (each with one event) per '
+                        'instance')
+    parser.add_argument('--bulk', action='store_true', default=False,
+                        help='Also chown nova resources in bulk mode')
+    parser.add_argument('--batch-size', type=int, metavar='N',
+                        default=base.DEFAULT_BATCH_SIZE,
+                        help='Number of resources to update per transaction '
+                        'in bulk mode')
+    parser.add_argument('--page-size', type=int, metavar='N',
+                        default=base.DEFAULT_PAGE_SIZE,
+                        help='Number of instances to list at a time')
+    parser.add_argument('--db-dir', metavar='DIR',
+                        help='Create the databases in this (empty) directory '
+                        'and keep them afterwards')
+    parser.add_argument('--startup', action='store_true', default=False,
+                        help='Also compare the startup time of loading one '
+                        'project with loading all of them')
+    parser.add_argument('--startup-runs', type=int, default=3, metavar='N',
+                        help='Number of times to start up for each '
+                        'measurement, of which the fastest is kept')
+    return parser
+
+
+def _create_databases(db_dir):
+    """Point the projects at empty databases in @db_dir.
+
+    Returns a dict of database name: engine.
+    """
+
+    connections = {}
+    for name, (project_name, filename) in DATABASES.items():
+        connections.setdefault(project_name, {})[name] = (
+            'sqlite:///%s' % os.path.join(db_dir, filename))
+
+    engines = {}
+    for project_name, project_connections in connections.items():
+        projects.PROJECTS.configure_databases(project_name,
+                                              project_connections)
+        engines.update(projects.PROJECTS[project_name].get_engines())
+
+    from oschown import chown_cinder
+    from oschown import chown_nova
+
+    chown_nova.nova_db_models.BASE.metadata.create_all(engines['nova'])
+    chown_nova.nova_api_models.API_BASE.metadata.create_all(
+        engines['nova_api'])
+    chown_cinder.cinder_db_models.BASE.metadata.create_all(engines['cinder'])
+    return engines
+
+
+def _insert(engine, model, rows):
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(model.__table__.insert(), rows)
+
+
+def _populate_tenant(engines, args, project_id, num_instances):
+    """Create a synthetic tenant with @num_instances instances.
+
+    Each instance has args.volumes_per_instance attached volumes (with
+    BDMs and attachments) plus a local root disk BDM, and
+    args.actions_per_instance actions. Each volume has
+    args.snapshots_per_volume snapshots.
+    """
+
+    from oschown import chown_cinder
+    from oschown import chown_nova
+
+    nova_models = chown_nova.nova_db_models
+    api_models = chown_nova.nova_api_models
+    cinder_models = chown_cinder.cinder_db_models
+
+    now = datetime.datetime.utcnow()
+    user_id = '%s-user' % project_id
+    owner = {'project_id': project_id, 'user_id': user_id}
+    rows = {model: [] for model in (
+        nova_models.Instance, nova_models.InstanceInfoCache,
+        nova_models.BlockDeviceMapping, nova_models.InstanceAction,
+        api_models.InstanceMapping, cinder_models.Volume,
+        cinder_models.VolumeAttachment, cinder_models.Snapshot)}
+
+    for i in range(num_instances):
+        inst_uuid = str(uuid.uuid4())
+        created_at = now + datetime.timedelta(seconds=i)
+        rows[nova_models.Instance].append(dict(
+            owner, uuid=inst_uuid, created_at=created_at,
+            display_name='bench-%i' % i, vm_state='active', deleted=0))
+        rows[nova_models.InstanceInfoCache].append(dict(
+            instance_uuid=inst_uuid, network_info='[]', deleted=0))
+        rows[api_models.InstanceMapping].append(dict(
+            instance_uuid=inst_uuid, project_id=project_id))
+        rows[nova_models.BlockDeviceMapping].append(dict(
+            instance_uuid=inst_uuid, uuid=str(uuid.uuid4()),
+            source_type='image', destination_type='local', boot_index=0,
+            device_name='/dev/vda', deleted=0))
+        for j in range(args.actions_per_instance):
+            rows[nova_models.InstanceAction].append(dict(
+                owner, instance_uuid=inst_uuid, action='reboot',
+                request_id='req-%s' % uuid.uuid4(), start_time=now,
+                deleted=0))
+
+        for j in range(args.volumes_per_instance):
+            vol_id = str(uuid.uuid4())
+            rows[nova_models.BlockDeviceMapping].append(dict(
+                instance_uuid=inst_uuid, uuid=str(uuid.uuid4()),
+                source_type='volume', destination_type='volume',
+                volume_id=vol_id, device_name='/dev/vd%s' % chr(98 + j),
+                deleted=0))
+            rows[cinder_models.Volume].append(dict(
+                owner, id=vol_id, size=1, status='in-use',
+                attach_status='attached', created_at=created_at,
+                deleted=False))
+            rows[cinder_models.VolumeAttachment].append(dict(
+                id=str(uuid.uuid4()), volume_id=vol_id,
+                instance_uuid=inst_uuid, attach_status='attached',
+                deleted=False))
+            for k in range(args.snapshots_per_volume):
+                rows[cinder_models.Snapshot].append(dict(
+                    owner, id=str(uuid.uuid4()), volume_id=vol_id,
+                    volume_size=1, status='available', created_at=now,
+                    deleted=False))
+
+    for model, model_rows in rows.items():
+        if model.__table__.name == 'instance_mappings':
+            engine = engines['nova_api']
+        elif model.__module__.startswith('cinder'):
+            engine = engines['cinder']
+        else:
+            engine = engines['nova']
+        _insert(engine, model, model_rows)
+
+    action_ids = [r[0] for r in engines['nova'].execute(
+        nova_models.InstanceAction.__table__.select().with_only_columns(
+            [nova_models.InstanceAction.id]).where(
+                nova_models.InstanceAction.project_id == project_id))]
+    _insert(engines['nova'], nova_models.InstanceActionEvent,
+            [dict(action_id=action_id, event='compute_reboot_instance',
+                  start_time=now, deleted=0) for action_id in action_ids])
+
+
+def _bench_tenant(args, project_id, bulk):
+    context = base.ChownContext('bench-target-user', 'bench-target',
+                                page_size=args.page_size, bulk=bulk,
+                                batch_size=args.batch_size)
+    result = {'tenant': project_id, 'bulk': bulk}
+
+    stats.STATS.reset()
+    start = time.time()
+    context.attachments = workflows.build_attachment_index(
+        context, project_id, project_names=BENCH_PROJECTS)
+    collection = workflows.ResourceCollection(context)
+    for page in workflows.iter_project_pages(context, project_id,
+                                             project_names=BENCH_PROJECTS):
+        for resource_id in page:
+            collection.need_resource(resource_id)
+    collection.resolve_missing_resources()
+    result['resolve_time'] = time.time() - start
+    result['resources'] = len(collection.resolved_resources)
+    result['resolve_queries'] = stats.STATS.summary()['queries']
+
+    # NOTE: Transfers through the cinder API need a cinder-volume
+    # service to accept them, so cinder is always chowned in bulk.
+    bulk_context = copy.copy(context)
+    bulk_context.bulk = True
+    by_project = collections.defaultdict(list)
+    for resource in collection.resolved_resources:
+        project_name, _local_id = workflows.parse_resource_id(
+            resource.identifier)
+        by_project[project_name].append(resource)
+
+    stats.STATS.reset()
+    start = time.time()
+    for project_name, resources in by_project.items():
+        project = projects.PROJECTS[project_name]
+        project_context = bulk_context if project_name == 'cinder' else context
+        deltas = project.quota_deltas(project_context, resources)
+        project.chown_resources(project_context, resources)
+        project.apply_quota_deltas(project_context, deltas)
+    result['chown_time'] = time.time() - start
+    result['chown_queries'] = stats.STATS.summary()['queries']
+    return result
+
+
+def _time_startup(names, runs):
+    """Time starting up and loading the projects in @names.
+
+    Returns the fastest of @runs fresh interpreters, in seconds, or
+    None if any of the projects could not be loaded.
+    """
+
+    times = []
+    for _i in range(runs):
+        try:
+            output = subprocess.check_output(
+                [sys.executable, '-c', STARTUP_SCRIPT] + list(names),
+                stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            LOG.warning('Unable to load %s: %s' % (
+                ','.join(names), e.output.decode().strip().splitlines()[-1]))
+            return None
+        times.append(float(output.decode().strip().splitlines()[-1]))
+    return min(times)
+
+
+def run_startup(args):
+    """Compare loading each project on its own with loading all of them.
+
+    Returns a dict of 'lazy:<name>' and 'eager': seconds.
+    """
+
+    names = projects.PROJECTS.names
+    results = {}
+    for name in names:
+        results['lazy:%s' % name] = _time_startup([name], args.startup_runs)
+    results['eager'] = _time_startup(names, args.startup_runs)
+    for name, elapsed in sorted(results.items()):
+        if elapsed is not None:
+            LOG.info('Startup %s: %.2fs' % (name, elapsed))
+    return results
+
+
+def run(args):
+    """Run the benchmarks described by @args, returning the results."""
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix='oschown-bench-')
+    try:
+        stats.STATS.enabled = True
+        engines = _create_databases(db_dir)
+        stats.STATS.watch_engines(engines)
+
+        results = []
+        modes = [False, True] if args.bulk else [False]
+        for scale in scales:
+            for bulk in modes:
+                project_id = 'bench-%i%s' % (scale, bulk and '-bulk' or '')
+                LOG.info('Creating tenant %s' % project_id)
+                _populate_tenant(engines, args, project_id, scale)
+                result = _bench_tenant(args, project_id, bulk)
+                result['instances'] = scale
+                LOG.info('Tenant %s: resolved %i resources in %.2fs, '
+                         'chowned in %.2fs' % (
+                             project_id, result['resources'],
+                             result['resolve_time'], result['chown_time']))
+                results.append(result)
+        return results
+    finally:
+        if not args.db_dir:
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+
+def main():
+    logging.basicConfig(format='%(levelname)s:%(message)s',
+                        level=logging.WARNING)
+    args = _get_arg_parser().parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    output = {'time': time.time(), 'args': vars(args)}
+    if args.startup:
+        output['startup'] = run_startup(args)
+    output['results'] = run(args)
+    json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,19 +10,23 @@
 #  License for the specific language governing permissions and limitations
 #  under the License.
 
+import collections
 import logging
 
 from cinder import context as cinder_context
-import cinder.exception
 from cinder import objects
 objects.register_all()
 from cinder.db.sqlalchemy import api as cinder_db
+from cinder.db.sqlalchemy import models as cinder_db_models
+from cinder import quota
 from cinder import rpc
 from cinder.transfer import api as transfer_api
 from oslo_config import cfg
+import sqlalchemy as sa
 
 from oschown import base
 from oschown import exception
+from oschown import progress
 
 # Not sure why but this has to happen at import time where our config
 # is set properly
@@ -30,23 +34,61 @@ cfg.CONF([], project='cinder')
 CONF = cfg.CONF
 rpc.init(CONF)
 TRANSFER_API = transfer_api.API()
+QUOTAS = quota.QUOTAS
 
 LOG = logging.getLogger(__name__)
 
+# The tables and columns we need in the database
+CINDER_TABLES = {
+    'volumes': ['id', 'project_id', 'user_id', 'size', 'volume_type_id'],
+    'snapshots': ['id', 'volume_id', 'project_id', 'user_id'],
+    'backups': ['id', 'volume_id', 'project_id', 'user_id', 'size'],
+    'volume_attachment': ['volume_id', 'instance_uuid'],
+    'quota_usages': ['project_id', 'resource', 'in_use'],
+}
+
+# Roughly how many statements it takes to resolve a page of volumes or
+# backups (with their attachments, snapshots and backups), to transfer
+# one volume, and to chown one backup with its quota reservation
+RESOLVE_STATEMENTS = 4
+TRANSFER_STATEMENTS = 20
+BACKUP_STATEMENTS = 10
+
 
 class CinderResource(base.ChownableResource):
-    def __init__(self, volume):
+    def __init__(self, volume, instance_uuids=None, snapshots=(),
+                 backups=(), admin_ctx=None, deps=None):
+        """A cinder volume.
+
+        If the attached @instance_uuids are not provided, they will be
+        loaded from the volume itself, unless the dependencies are
+        already known and passed as @deps. The volume also depends on
+        its @snapshots and @backups.
+        """
         self._volume = volume
-        self._admin_ctx = cinder_context.get_admin_context()
+        self._admin_ctx = admin_ctx or cinder_context.get_admin_context()
         self._deps = []
-        self._collect_instances()
+        if deps is not None:
+            self._deps.extend(deps)
+            return
+        if instance_uuids is None:
+            instance_uuids = [attachment.instance_uuid for attachment in
+                              self._volume.volume_attachment or []]
+        self._collect_instances(instance_uuids)
+        self._collect_children('snapshot', snapshots)
+        self._collect_children('backup', backups)
 
-    def _collect_instances(self):
-        if self._volume.volume_attachment:
-            for attachment in self._volume.volume_attachment:
-                LOG.info('Cinder volume %s requires attached instance %s' % (
-                    self._volume.id, attachment.instance_uuid))
-                self._deps.append('nova:%s' % attachment.instance_uuid)
+    def _collect_instances(self, instance_uuids):
+        for instance_uuid in instance_uuids:
+            LOG.info('Cinder volume %s requires attached instance %s' % (
+                self._volume.id, instance_uuid))
+            self._deps.append('nova:%s' % instance_uuid)
+
+    def _collect_children(self, kind, children):
+        for child in children:
+            LOG.info('Cinder volume %s requires %s %s' % (
+                self._volume.id, kind, child.id))
+            self._deps.append('cinder:%s:%s' % (kind, child.id))
 
     @property
     def dependencies(self):
@@ -56,6 +98,14 @@ class CinderResource(base.ChownableResource):
     def identifier(self):
         return 'cinder:%s' % self._volume['id']
 
+    @property
+    def volume(self):
+        return self._volume
+
+    @property
+    def version(self):
+        return base.version_stamp(self._volume.updated_at)
+
     def _set_vol_state(self, state):
         cinder_db.volume_update(self._admin_ctx, self._volume['id'],
                                 {'status': 'available'})
@@ -85,21 +135,555 @@ class CinderResource(base.ChownableResource):
             self._set_vol_state(orig_state)
 
 
+def _chown_with_quota(ctx, context, source_project_id, reserve_opts,
+                      update):
+    """Call @update() with quota usage moving to the target project.
+
+    @reserve_opts is a dict of quota resource: amount, which is
+    reserved away from @source_project_id and for the target first,
+    and only committed if @update() succeeds.
+    """
+    source_reservations = QUOTAS.reserve(
+        ctx, project_id=source_project_id,
+        **{resource: -amount for resource, amount in reserve_opts.items()})
+    try:
+        reservations = QUOTAS.reserve(
+            ctx, project_id=context.target_project_id, **reserve_opts)
+    except Exception:
+        QUOTAS.rollback(ctx, source_reservations,
+                        project_id=source_project_id)
+        raise
+    try:
+        update()
+    except Exception:
+        QUOTAS.rollback(ctx, reservations,
+                        project_id=context.target_project_id)
+        QUOTAS.rollback(ctx, source_reservations,
+                        project_id=source_project_id)
+        raise
+    QUOTAS.commit(ctx, reservations, project_id=context.target_project_id)
+    QUOTAS.commit(ctx, source_reservations, project_id=source_project_id)
+
+
+class CinderSnapshotResource(base.ChownableResource):
+    def __init__(self, snapshot, admin_ctx=None):
+        """A cinder snapshot, which depends on its volume."""
+        self._snapshot = snapshot
+        self._admin_ctx = admin_ctx or cinder_context.get_admin_context()
+
+    @property
+    def dependencies(self):
+        return ['cinder:%s' % self._snapshot.volume_id]
+
+    @property
+    def identifier(self):
+        return 'cinder:snapshot:%s' % self._snapshot.id
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return base.version_stamp(self._snapshot.updated_at)
+
+    def chown(self, context):
+        # NOTE: Transferring the volume moves its snapshots (and their
+        # quota usage) with it, so there is normally nothing left to do.
+        snapshot = cinder_db.snapshot_get(self._admin_ctx, self._snapshot.id)
+        if snapshot.project_id == context.target_project_id:
+            LOG.info('Cinder snapshot %s was moved with its volume' % (
+                snapshot.id))
+            return
+        ctx = self._admin_ctx
+        reserve_opts = {'snapshots': 1}
+        if not CONF.no_snapshot_gb_quota:
+            reserve_opts['gigabytes'] = snapshot.volume_size
+        QUOTAS.add_volume_type_opts(ctx, reserve_opts,
+                                    snapshot.volume_type_id)
+        _chown_with_quota(
+            ctx, context, snapshot.project_id, reserve_opts,
+            lambda: cinder_db.snapshot_update(
+                ctx, snapshot.id,
+                {'project_id': context.target_project_id,
+                 'user_id': context.target_user_id}))
+
+
+class CinderBackupResource(base.ChownableResource):
+    def __init__(self, backup, admin_ctx=None):
+        """A cinder backup.
+
+        Backups may outlive their volume, so they have no dependencies
+        of their own.
+        """
+        self._backup = backup
+        self._admin_ctx = admin_ctx or cinder_context.get_admin_context()
+
+    @property
+    def dependencies(self):
+        return []
+
+    @property
+    def identifier(self):
+        return 'cinder:backup:%s' % self._backup.id
+
+    @property
+    def backup(self):
+        return self._backup
+
+    @property
+    def version(self):
+        return base.version_stamp(self._backup.updated_at)
+
+    def chown(self, context):
+        ctx = self._admin_ctx
+        size = self._backup.size or 0
+        _chown_with_quota(
+            ctx, context, self._backup.project_id,
+            {'backups': 1, 'backup_gigabytes': size},
+            lambda: cinder_db.backup_update(
+                ctx, self._backup.id,
+                {'project_id': context.target_project_id,
+                 'user_id': context.target_user_id}))
+
+
 class CinderProject(base.ChownableProject):
     def __init__(self):
         super(CinderProject, self).__init__()
+        self.conf = CONF
 
     @property
     def name(self):
         return 'cinder'
 
+    def get_admin_context(self):
+        return cinder_context.get_admin_context()
+
+    def get_engines(self):
+        return {'cinder': cinder_db.get_engine()}
+
+    def configure_databases(self, connections):
+        if 'cinder' in connections:
+            self.conf.set_override('connection', connections['cinder'],
+                                   group='database')
+        cinder_db.configure(self.conf)
+
+    def check(self, context):
+        base.check_database('cinder', cinder_db.get_engine(), CINDER_TABLES)
+
     def collect_resource_by_id(self, context, resource_id):
-        ctx = cinder_context.get_admin_context()
-        try:
-            vol = objects.Volume.get_by_id(ctx, resource_id)
-        except cinder.exception.VolumeNotFound:
+        return self.collect_resources_by_ids(context,
+                                             [resource_id])[resource_id]
+
+    @staticmethod
+    def _get_attached_instances(ctx, volume_ids, index=None):
+        """Return a dict of volume id: [attached instance uuid].
+
+        Volumes covered by the attachments.AttachmentIndex @index are
+        looked up there, and the attachments of the rest in one query.
+        """
+        instance_uuids = collections.defaultdict(list)
+        missing = volume_ids
+        if index is not None:
+            found, missing = index.instances_by_volume(volume_ids)
+            instance_uuids.update(found)
+        if missing:
+            query = cinder_db.model_query(
+                ctx, cinder_db_models.VolumeAttachment, read_deleted='no')
+            query = query.filter(
+                cinder_db_models.VolumeAttachment.volume_id.in_(missing))
+            for attachment in query.all():
+                instance_uuids[attachment.volume_id].append(
+                    attachment.instance_uuid)
+        return instance_uuids
+
+    def scan_attachments(self, context, project_id, index):
+        volume = cinder_db_models.Volume
+        attachment = cinder_db_models.VolumeAttachment
+        session = cinder_db.get_session()
+        with session.begin():
+            query = session.query(volume.id, attachment.instance_uuid)
+            query = query.outerjoin(attachment, sa.and_(
+                attachment.volume_id == volume.id,
+                attachment.deleted == sa.false()))
+            index.add_volumes(query.filter(volume.deleted == sa.false(),
+                                           volume.project_id == project_id))
+
+    def _get_volumes(self, ctx, context, volume_ids):
+        vols = objects.VolumeList.get_all(ctx, filters={'id': volume_ids})
+        vols = {vol.id: vol for vol in vols}
+        missing = set(volume_ids) - set(vols)
+        if missing:
+            raise exception.UnableToResolveResources(
+                'Cinder volume %s not found' % ','.join(sorted(missing)))
+
+        encrypted = [vol.id for vol in vols.values()
+                     if vol.encryption_key_id]
+        if context.bulk and encrypted:
+            # NOTE: The transfer API has to deal with the key manager
+            # for these, which we cannot do from here.
+            raise exception.ProjectCheckFailed(
+                'Encrypted cinder volume %s cannot be transferred in bulk' %
+                ','.join(sorted(encrypted)))
+        return vols
+
+    @staticmethod
+    def _split_ids(resource_ids):
+        """Split local ids into volume, snapshot and backup ids."""
+        ids = {'volume': [], 'snapshot': [], 'backup': []}
+        for resource_id in resource_ids:
+            kind, _sep, local_id = resource_id.rpartition(':')
+            if kind not in ('snapshot', 'backup'):
+                kind = 'volume'
+            ids[kind].append(local_id)
+        return ids
+
+    @staticmethod
+    def _get_children(ctx, model, volume_ids=None, ids=None):
+        """Fetch the snapshots or backups of a set of volumes, or by id."""
+        query = cinder_db.model_query(ctx, model, read_deleted='no')
+        if volume_ids is not None:
+            query = query.filter(model.volume_id.in_(volume_ids))
+        else:
+            query = query.filter(model.id.in_(ids))
+        return query.all()
+
+    @staticmethod
+    def _check_found(kind, ids, found):
+        missing = set(ids) - set(item.id for item in found)
+        if missing:
             raise exception.UnableToResolveResources(
-                'Cinder volume %s not found' % resource_id)
-        resource = CinderResource(vol)
-        self._resources.append(resource)
-        return resource
+                'Cinder %s %s not found' % (kind, ','.join(sorted(missing))))
+
+    @staticmethod
+    def _check_backups(context, backups):
+        encrypted = [backup.id for backup in backups
+                     if backup.encryption_key_id]
+        if context.bulk and encrypted:
+            raise exception.ProjectCheckFailed(
+                'Encrypted cinder backup %s cannot be transferred in bulk' %
+                ','.join(sorted(encrypted)))
+
+    def collect_resources_by_ids(self, context, resource_ids):
+        """Collect volumes, snapshots and backups in bulk.
+
+        The snapshots and backups of the requested volumes are fetched
+        with one query each and returned along with them, so that they
+        do not need to be looked up again.
+        """
+        ctx = self.admin_context
+        ids = self._split_ids(set(resource_ids))
+        resources = {}
+
+        if ids['volume']:
+            vols = self._get_volumes(ctx, context, ids['volume'])
+            instance_uuids = self._get_attached_instances(
+                ctx, ids['volume'], context.attachments)
+            snapshots = collections.defaultdict(list)
+            for snap in self._get_children(ctx, cinder_db_models.Snapshot,
+                                           volume_ids=ids['volume']):
+                snapshots[snap.volume_id].append(snap)
+                resources['snapshot:%s' % snap.id] = CinderSnapshotResource(
+                    snap, admin_ctx=ctx)
+            backups = collections.defaultdict(list)
+            volume_backups = self._get_children(
+                ctx, cinder_db_models.Backup, volume_ids=ids['volume'])
+            self._check_backups(context, volume_backups)
+            for backup in volume_backups:
+                backups[backup.volume_id].append(backup)
+                resources['backup:%s' % backup.id] = CinderBackupResource(
+                    backup, admin_ctx=ctx)
+            for volume_id, vol in vols.items():
+                resources[volume_id] = CinderResource(
+                    vol, instance_uuids=instance_uuids[volume_id],
+                    snapshots=snapshots[volume_id],
+                    backups=backups[volume_id], admin_ctx=ctx)
+
+        snapshot_ids = [snapshot_id for snapshot_id in ids['snapshot']
+                        if 'snapshot:%s' % snapshot_id not in resources]
+        if snapshot_ids:
+            snaps = self._get_children(ctx, cinder_db_models.Snapshot,
+                                       ids=snapshot_ids)
+            self._check_found('snapshot', snapshot_ids, snaps)
+            for snap in snaps:
+                resources['snapshot:%s' % snap.id] = CinderSnapshotResource(
+                    snap, admin_ctx=ctx)
+
+        backup_ids = [backup_id for backup_id in ids['backup']
+                      if 'backup:%s' % backup_id not in resources]
+        if backup_ids:
+            backups = self._get_children(ctx, cinder_db_models.Backup,
+                                         ids=backup_ids)
+            self._check_found('backup', backup_ids, backups)
+            self._check_backups(context, backups)
+            for backup in backups:
+                resources['backup:%s' % backup.id] = CinderBackupResource(
+                    backup, admin_ctx=ctx)
+
+        return resources
+
+    def collect_planned_resources(self, context, planned):
+        ctx = self.admin_context
+        ids = self._split_ids(planned)
+        resources = {}
+        if ids['volume']:
+            vols = self._get_volumes(ctx, context, ids['volume'])
+            resources.update(
+                (volume_id, CinderResource(vol, admin_ctx=ctx,
+                                           deps=planned[volume_id][1]))
+                for volume_id, vol in vols.items())
+        if ids['snapshot']:
+            snaps = self._get_children(ctx, cinder_db_models.Snapshot,
+                                       ids=ids['snapshot'])
+            self._check_found('snapshot', ids['snapshot'], snaps)
+            resources.update(
+                ('snapshot:%s' % snap.id,
+                 CinderSnapshotResource(snap, admin_ctx=ctx))
+                for snap in snaps)
+        if ids['backup']:
+            backups = self._get_children(ctx, cinder_db_models.Backup,
+                                         ids=ids['backup'])
+            self._check_found('backup', ids['backup'], backups)
+            self._check_backups(context, backups)
+            resources.update(
+                ('backup:%s' % backup.id,
+                 CinderBackupResource(backup, admin_ctx=ctx))
+                for backup in backups)
+        base.check_plan_versions(self.name, resources, planned)
+        return resources
+
+    @staticmethod
+    def _quota_deltas(volumes, snapshots, backups, target_project_id):
+        """Calculate the quota usage changes for moving resources.
+
+        Returns a dict of (project_id, resource): delta for the volumes,
+        snapshots and backups being moved to @target_project_id.
+        """
+        deltas = collections.Counter()
+        type_names = {}
+
+        def _move(project_id, kind, size, type_name,
+                  gigabytes='gigabytes'):
+            resources = [(kind, 1)]
+            if size is not None:
+                resources.append((gigabytes, size))
+            if type_name:
+                resources += [('%s_%s' % (resource, type_name), delta)
+                              for resource, delta in resources]
+            for resource, delta in resources:
+                deltas[(project_id, resource)] -= delta
+                deltas[(target_project_id, resource)] += delta
+
+        for vol in volumes:
+            type_name = vol.volume_type and vol.volume_type.name or None
+            type_names[vol.id] = type_name
+            _move(vol.project_id, 'volumes', vol.size, type_name)
+        for snap in snapshots:
+            size = None if CONF.no_snapshot_gb_quota else snap.volume_size
+            _move(snap.project_id, 'snapshots', size,
+                  type_names.get(snap.volume_id))
+        for backup in backups:
+            _move(backup.project_id, 'backups', backup.size or 0, None,
+                  gigabytes='backup_gigabytes')
+
+        return {key: delta for key, delta in deltas.items() if delta}
+
+    @staticmethod
+    def _apply_quota_delta(ctx, session, project_id, resource, delta):
+        query = cinder_db.model_query(ctx, cinder_db_models.QuotaUsage,
+                                      session=session, read_deleted='no')
+        query = query.filter_by(project_id=project_id, resource=resource)
+        count = query.update(
+            {'in_use': cinder_db_models.QuotaUsage.in_use + delta},
+            synchronize_session=False)
+        if not count and delta > 0:
+            usage = cinder_db_models.QuotaUsage(project_id=project_id,
+                                                resource=resource,
+                                                in_use=delta, reserved=0)
+            session.add(usage)
+            count = 1
+        return count
+
+    @staticmethod
+    def _bulk_update(ctx, session, context, model, ids, values):
+        count = 0
+        for i in range(0, len(ids), context.batch_size):
+            query = cinder_db.model_query(ctx, model, session=session,
+                                          read_deleted='no')
+            query = query.filter(
+                model.id.in_(ids[i:i + context.batch_size]))
+            count += query.update(values, synchronize_session=False)
+        return count
+
+    def _bulk_chown_db(self, ctx, context, volumes, snapshots, backups):
+        # NOTE: Attachments have no ownership of their own, so they
+        # follow their volumes without needing an update.
+        values = {'project_id': context.target_project_id,
+                  'user_id': context.target_user_id}
+        counts = collections.Counter()
+        session = cinder_db.get_session()
+        with session.begin():
+            for model, items in ((cinder_db_models.Snapshot, snapshots),
+                                 (cinder_db_models.Backup, backups),
+                                 (cinder_db_models.Volume, volumes)):
+                counts[model.__tablename__] += self._bulk_update(
+                    ctx, session, context, model,
+                    [item.id for item in items], values)
+        return dict(counts)
+
+    def verify_resources(self, context, resources):
+        session = cinder_db.get_session()
+
+        def _query(model, *entities):
+            return session.query(*entities).filter(
+                model.deleted == sa.false())
+
+        volumes, snapshots, backups = self._split_resources(resources)
+        expected = {'project_id': context.target_project_id,
+                    'user_id': context.target_user_id}
+        mismatched = {}
+        with session.begin():
+            for model, ids in (
+                    (cinder_db_models.Volume,
+                     [res.volume.id for res in volumes]),
+                    (cinder_db_models.Snapshot,
+                     [res.snapshot.id for res in snapshots]),
+                    (cinder_db_models.Backup,
+                     [res.backup.id for res in backups])):
+                ids = base.verify_owner(_query, model, 'id', ids, expected,
+                                        context.batch_size, expect_all=True)
+                if ids:
+                    mismatched[model.__tablename__] = ids
+        return mismatched
+
+    def estimate(self, context, project_id):
+        session = cinder_db.get_session()
+
+        def _count(model, *criteria):
+            return session.query(sa.func.count(model.id)).filter(
+                model.deleted == sa.false(), *criteria).scalar()
+
+        volume = cinder_db_models.Volume
+        backup = cinder_db_models.Backup
+        with session.begin():
+            volume_ids = session.query(volume.id).filter(
+                volume.deleted == sa.false(),
+                volume.project_id == project_id).subquery()
+            return {
+                'volumes': _count(volume, volume.project_id == project_id),
+                'volume_attachments': _count(
+                    cinder_db_models.VolumeAttachment,
+                    cinder_db_models.VolumeAttachment.volume_id.in_(
+                        volume_ids)),
+                'snapshots': _count(
+                    cinder_db_models.Snapshot,
+                    cinder_db_models.Snapshot.volume_id.in_(volume_ids)),
+                'backups': _count(backup, sa.or_(
+                    backup.project_id == project_id,
+                    backup.volume_id.in_(volume_ids))),
+            }
+
+    def count_resources(self, counts):
+        return sum(counts.get(kind, 0)
+                   for kind in ('volumes', 'snapshots', 'backups'))
+
+    def estimate_statements(self, context, counts):
+        volumes = counts.get('volumes', 0)
+        backups = counts.get('backups', 0)
+        pages = (base.count_pages(volumes, context.page_size) +
+                 base.count_pages(backups, context.page_size))
+        # NOTE: Listing ends with a short page of volumes and backups.
+        statements = pages + 2 + pages * RESOLVE_STATEMENTS
+        if context.bulk:
+            # One update per batch of each kind, and one per move for
+            # the volumes, snapshots, backups and gigabytes quota usage
+            # of both projects
+            for kind in ('volumes', 'snapshots', 'backups'):
+                statements += base.count_pages(
+                    counts.get(kind, 0),
+                    min(context.page_size, context.batch_size))
+            statements += 4 * 2
+        else:
+            statements += (volumes * TRANSFER_STATEMENTS +
+                           backups * BACKUP_STATEMENTS)
+        return statements
+
+    def quota_deltas(self, context, resources):
+        # NOTE: Outside of bulk mode, the transfer API and backup chown
+        # make their own quota reservations.
+        if not context.bulk:
+            return {}
+        volumes, snapshots, backups = self._split_resources(resources)
+        return self._quota_deltas(
+            [resource.volume for resource in volumes],
+            [resource.snapshot for resource in snapshots],
+            [resource.backup for resource in backups],
+            context.target_project_id)
+
+    def apply_quota_deltas(self, context, deltas):
+        ctx = self.admin_context
+        count = 0
+        session = cinder_db.get_session()
+        with session.begin():
+            for (project_id, resource), delta in sorted(deltas.items()):
+                count += self._apply_quota_delta(ctx, session, project_id,
+                                                 resource, delta)
+        return count
+
+    @staticmethod
+    def _split_resources(resources):
+        """Split resources into volumes, snapshots and backups."""
+        volumes = [resource for resource in resources
+                   if isinstance(resource, CinderResource)]
+        snapshots = [resource for resource in resources
+                     if isinstance(resource, CinderSnapshotResource)]
+        backups = [resource for resource in resources
+                   if isinstance(resource, CinderBackupResource)]
+        return volumes, snapshots, backups
+
+    def chown_resources(self, context, resources):
+        volumes, snapshots, backups = self._split_resources(resources)
+        if not context.bulk:
+            # NOTE: Volumes go first so that their transfers move the
+            # snapshots along with them.
+            return super(CinderProject, self).chown_resources(
+                context, volumes + snapshots + backups)
+
+        ctx = self.admin_context
+        LOG.info('Bulk chowning %i cinder volumes, %i snapshots and '
+                 '%i backups' % (len(volumes), len(snapshots), len(backups)))
+        counts = self._bulk_chown_db(
+            ctx, context,
+            [resource.volume for resource in volumes],
+            [resource.snapshot for resource in snapshots],
+            [resource.backup for resource in backups])
+        progress.PROGRESS.add_done('chown', self.name, len(resources))
+        return counts
+
+    def iter_resource_ids_by_owner(self, context, project_id):
+        ctx = self.admin_context
+        marker = None
+        while True:
+            vols = objects.VolumeList.get_all(
+                ctx, marker=marker, limit=context.page_size,
+                sort_keys=['created_at', 'id'], sort_dirs=['asc', 'asc'],
+                filters={'project_id': project_id})
+            if vols:
+                yield [vol.id for vol in vols]
+            if len(vols) < context.page_size:
+                break
+            marker = vols[-1].id
+
+        # NOTE: Backups of volumes that still exist are found through
+        # those, but backups can outlive their volumes.
+        marker = None
+        while True:
+            backups = objects.BackupList.get_all(
+                ctx, marker=marker, limit=context.page_size,
+                sort_keys=['created_at', 'id'], sort_dirs=['asc', 'asc'],
+                filters={'project_id': project_id})
+            if backups:
+                yield ['backup:%s' % backup.id for backup in backups]
+            if len(backups) < context.page_size:
+                break
+            marker = backups[-1].id
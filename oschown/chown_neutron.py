@@ -10,16 +10,626 @@
 #  License for the specific language governing permissions and limitations
 #  under the License.
 
+import collections
+import logging
+
+from neutron.common import config as neutron_config
+from neutron.db import api as neutron_db
+from neutron.db.models import l3 as l3_models
+from neutron.db.models import securitygroup as sg_models
+from neutron.db import models_v2
+from neutron.db.quota import models as quota_models
+from neutron.db import rbac_db_models
+from neutron_lib import constants
+from neutron_lib import context as neutron_context
+from oslo_config import cfg
+import sqlalchemy as sa
+
 from oschown import base
 from oschown import exception
+from oschown import progress
+
+neutron_config.init([])
+CONF = cfg.CONF
+
+LOG = logging.getLogger(__name__)
+
+# The tables and columns we need in the database
+NEUTRON_TABLES = {
+    'ports': ['id', 'project_id', 'device_id', 'device_owner', 'network_id'],
+    'networks': ['id', 'project_id'],
+    'networkrbacs': ['object_id', 'action', 'target_tenant'],
+    'securitygroups': ['id', 'project_id'],
+    'securitygrouprules': ['security_group_id', 'project_id'],
+    'securitygroupportbindings': ['port_id', 'security_group_id'],
+    'default_security_group': ['project_id', 'security_group_id'],
+    'floatingips': ['id', 'project_id', 'fixed_port_id'],
+    'quotausages': ['project_id', 'resource', 'dirty'],
+}
+
+# Roughly how many statements it takes to resolve a page of resources,
+# and to chown it (with its quota usage) in one transaction
+RESOLVE_STATEMENTS = 5
+CHOWN_STATEMENTS = 8
+
+
+class NeutronPortResource(base.ChownableResource):
+    def __init__(self, port, security_groups=(), default_groups=(),
+                 floating_ips=(), admin_ctx=None):
+        """A neutron port.
+
+        The port depends on the instance it is bound to, its
+        @floating_ips and any of its @security_groups which are not in
+        @default_groups. Bindings to a default group are moved to the
+        target project's default group instead.
+        """
+        self._port = port
+        self._admin_ctx = admin_ctx or neutron_context.get_admin_context()
+        self._default_groups = [sg_id for sg_id in security_groups
+                                if sg_id in default_groups]
+        self._deps = []
+        if port.device_owner.startswith(constants.DEVICE_OWNER_COMPUTE_PREFIX):
+            self._deps.append('nova:%s' % port.device_id)
+        for sg_id in security_groups:
+            if sg_id not in default_groups:
+                LOG.info('Neutron port %s requires security group %s' % (
+                    port.id, sg_id))
+                self._deps.append('neutron:security-group:%s' % sg_id)
+        for fip in floating_ips:
+            LOG.info('Neutron port %s requires floating IP %s' % (
+                port.id, fip.id))
+            self._deps.append('neutron:floatingip:%s' % fip.id)
+
+    @property
+    def dependencies(self):
+        return self._deps
+
+    @property
+    def identifier(self):
+        return 'neutron:%s' % self._port.id
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def default_groups(self):
+        return self._default_groups
+
+    @property
+    def version(self):
+        return base.version_stamp(self._port.updated_at)
+
+    def chown(self, context):
+        NeutronProject.chown_db(self._admin_ctx, context, ports=[self])
+
+
+class NeutronSecurityGroupResource(base.ChownableResource):
+    def __init__(self, security_group, admin_ctx=None):
+        """A neutron security group.
+
+        The group does not depend on the ports using it, since that
+        would move every instance sharing it. Instead, it is refused
+        by NeutronProject.check_resources() if it is used by ports
+        that are not moving with it.
+        """
+        self._security_group = security_group
+        self._admin_ctx = admin_ctx or neutron_context.get_admin_context()
+
+    @property
+    def identifier(self):
+        return 'neutron:security-group:%s' % self._security_group.id
+
+    @property
+    def security_group(self):
+        return self._security_group
+
+    @property
+    def version(self):
+        return base.version_stamp(self._security_group.updated_at)
+
+    def chown(self, context):
+        NeutronProject.chown_db(self._admin_ctx, context,
+                                security_groups=[self])
+
+
+class NeutronFloatingIPResource(base.ChownableResource):
+    def __init__(self, floating_ip, admin_ctx=None):
+        """A neutron floating IP, which depends on its port if any."""
+        self._floating_ip = floating_ip
+        self._admin_ctx = admin_ctx or neutron_context.get_admin_context()
+
+    @property
+    def dependencies(self):
+        if self._floating_ip.fixed_port_id:
+            return ['neutron:%s' % self._floating_ip.fixed_port_id]
+        return []
+
+    @property
+    def identifier(self):
+        return 'neutron:floatingip:%s' % self._floating_ip.id
+
+    @property
+    def floating_ip(self):
+        return self._floating_ip
+
+    @property
+    def version(self):
+        return base.version_stamp(self._floating_ip.updated_at)
+
+    def chown(self, context):
+        NeutronProject.chown_db(self._admin_ctx, context,
+                                floating_ips=[self])
 
 
 class NeutronProject(base.ChownableProject):
+    def __init__(self):
+        super(NeutronProject, self).__init__()
+        self.conf = CONF
+
     @property
     def name(self):
         return 'neutron'
 
+    def get_admin_context(self):
+        return neutron_context.get_admin_context()
+
+    def get_engines(self):
+        return {'neutron': neutron_db.context_manager.writer.get_engine()}
+
+    def configure_databases(self, connections):
+        if 'neutron' in connections:
+            self.conf.set_override('connection', connections['neutron'],
+                                   group='database')
+
+    def check(self, context):
+        base.check_database('neutron', self.get_engines()['neutron'],
+                            NEUTRON_TABLES)
+
+    @staticmethod
+    def _split_ids(resource_ids):
+        """Split local ids into port, security group and floating IP ids."""
+        ids = {'port': [], 'security-group': [], 'floatingip': []}
+        for resource_id in resource_ids:
+            kind, _sep, local_id = resource_id.rpartition(':')
+            if kind not in ('security-group', 'floatingip'):
+                kind = 'port'
+            ids[kind].append(local_id)
+        return ids
+
+    @staticmethod
+    def _check_found(kind, ids, found):
+        missing = set(ids) - set(item.id for item in found)
+        if missing:
+            raise exception.UnableToResolveResources(
+                'Neutron %s %s not found' % (kind, ','.join(sorted(missing))))
+
+    @staticmethod
+    def _get_ports(ctx, port_ids):
+        """Fetch ports by id, along with the other ports of their instances.
+
+        One query finds every port sharing a device with the requested
+        ones, so that ports missing from an instance's info cache are
+        still moved with it.
+        """
+        devices = ctx.session.query(models_v2.Port.device_id).filter(
+            models_v2.Port.id.in_(port_ids),
+            models_v2.Port.device_owner.startswith(
+                constants.DEVICE_OWNER_COMPUTE_PREFIX))
+        query = ctx.session.query(models_v2.Port).filter(sa.or_(
+            models_v2.Port.id.in_(port_ids),
+            models_v2.Port.device_id.in_(devices.subquery())))
+        return query.all()
+
+    @staticmethod
+    def _check_ports(ctx, context, ports):
+        """Refuse ports the target project could not have created.
+
+        :raises: exception.ProjectCheckFailed for ports owned by the
+                 network itself (routers, DHCP, etc) or on networks that
+                 are neither owned by nor shared with the target project
+        """
+        network_owned = [port.id for port in ports
+                         if port.device_owner and not
+                         port.device_owner.startswith(
+                             constants.DEVICE_OWNER_COMPUTE_PREFIX)]
+        if network_owned:
+            raise exception.ProjectCheckFailed(
+                'Neutron port %s is not owned by an instance' %
+                ','.join(sorted(network_owned)))
+
+        network_ids = set(port.network_id for port in ports)
+        owners = dict(ctx.session.query(
+            models_v2.Network.id, models_v2.Network.project_id).filter(
+                models_v2.Network.id.in_(network_ids)))
+        rbac = rbac_db_models.NetworkRBAC
+        shared = set(row.object_id for row in ctx.session.query(
+            rbac.object_id).filter(
+                rbac.object_id.in_(network_ids),
+                rbac.action == 'access_as_shared',
+                rbac.target_tenant.in_(['*', context.target_project_id])))
+        private = [port.id for port in ports
+                   if port.network_id not in shared and
+                   owners.get(port.network_id) != context.target_project_id]
+        if private:
+            # NOTE: Networks, subnets and routers are not moved, so an
+            # instance on the source project's private network has to
+            # be moved onto one the target can use first.
+            raise exception.ProjectCheckFailed(
+                'Neutron port %s is on a network not shared with project %s. '
+                'Networks are not moved, so share the network with the '
+                'target (or move the instance to one of its networks) '
+                'first.' % (','.join(sorted(private)),
+                            context.target_project_id))
+
+    @staticmethod
+    def _get_bindings(ctx, port_ids):
+        """Fetch (port, security group) bindings for ports."""
+        binding = sg_models.SecurityGroupPortBinding
+        query = ctx.session.query(binding.port_id, binding.security_group_id)
+        return query.filter(binding.port_id.in_(port_ids)).all()
+
+    @staticmethod
+    def _get_default_groups(ctx, security_group_ids):
+        default = sg_models.DefaultSecurityGroup
+        query = ctx.session.query(default.security_group_id).filter(
+            default.security_group_id.in_(security_group_ids))
+        return set(row.security_group_id for row in query)
+
+    @staticmethod
+    def _get_by_id(ctx, kind, model, ids):
+        items = ctx.session.query(model).filter(model.id.in_(ids)).all()
+        NeutronProject._check_found(kind, ids, items)
+        return items
+
+    def _collect_ports(self, ctx, context, port_ids):
+        ports = self._get_ports(ctx, port_ids)
+        self._check_found('port', port_ids, ports)
+        self._check_ports(ctx, context, ports)
+        all_port_ids = [port.id for port in ports]
+
+        groups = collections.defaultdict(list)
+        for port_id, sg_id in self._get_bindings(ctx, all_port_ids):
+            groups[port_id].append(sg_id)
+        default_groups = self._get_default_groups(
+            ctx, set(sg_id for sg_ids in groups.values() for sg_id in sg_ids))
+        if default_groups:
+            self._get_target_default_group(ctx, context)
+
+        fips = collections.defaultdict(list)
+        query = ctx.session.query(l3_models.FloatingIP).filter(
+            l3_models.FloatingIP.fixed_port_id.in_(all_port_ids))
+        resources = {}
+        for fip in query:
+            fips[fip.fixed_port_id].append(fip)
+            resources['floatingip:%s' % fip.id] = NeutronFloatingIPResource(
+                fip, admin_ctx=ctx)
+
+        for port in ports:
+            resources[port.id] = NeutronPortResource(
+                port, security_groups=groups[port.id],
+                default_groups=default_groups, floating_ips=fips[port.id],
+                admin_ctx=ctx)
+        return resources
+
+    def _collect_security_groups(self, ctx, sg_ids):
+        security_groups = self._get_by_id(ctx, 'security group',
+                                          sg_models.SecurityGroup, sg_ids)
+        return {'security-group:%s' % sg.id: NeutronSecurityGroupResource(
+                    sg, admin_ctx=ctx)
+                for sg in security_groups}
+
+    @staticmethod
+    def _get_target_default_group(ctx, context):
+        """Return the id of the target project's default security group.
+
+        :raises: exception.ProjectCheckFailed if it does not have one yet
+        """
+        default = sg_models.DefaultSecurityGroup
+        row = ctx.session.query(default.security_group_id).filter(
+            default.project_id == context.target_project_id).first()
+        if row is None:
+            raise exception.ProjectCheckFailed(
+                'Project %s has no default security group to move ports to. '
+                'Listing its security groups through neutron creates one.' %
+                context.target_project_id)
+        return row.security_group_id
+
     def collect_resource_by_id(self, context, resource_id):
-        raise exception.ProjectCheckFailed(
-            'Neutron resources cannot be transferred. '
-            'Please detatch from all networks.')
+        return self.collect_resources_by_ids(context,
+                                             [resource_id])[resource_id]
+
+    def collect_resources_by_ids(self, context, resource_ids):
+        """Collect ports, security groups and floating IPs in bulk.
+
+        The floating IPs and other ports of the instances behind the
+        requested ports are returned along with them.
+        """
+        ctx = self.admin_context
+        ids = self._split_ids(set(resource_ids))
+        resources = {}
+        with neutron_db.context_manager.reader.using(ctx):
+            if ids['port']:
+                resources.update(self._collect_ports(ctx, context,
+                                                     ids['port']))
+            if ids['security-group']:
+                resources.update(self._collect_security_groups(
+                    ctx, ids['security-group']))
+            fip_ids = [fip_id for fip_id in ids['floatingip']
+                       if 'floatingip:%s' % fip_id not in resources]
+            if fip_ids:
+                resources.update(
+                    ('floatingip:%s' % fip.id,
+                     NeutronFloatingIPResource(fip, admin_ctx=ctx))
+                    for fip in self._get_by_id(ctx, 'floating IP',
+                                               l3_models.FloatingIP, fip_ids))
+        return resources
+
+    @staticmethod
+    def _split_resources(resources):
+        ports = [resource for resource in resources
+                 if isinstance(resource, NeutronPortResource)]
+        security_groups = [
+            resource for resource in resources
+            if isinstance(resource, NeutronSecurityGroupResource)]
+        floating_ips = [resource for resource in resources
+                        if isinstance(resource, NeutronFloatingIPResource)]
+        return ports, security_groups, floating_ips
+
+    @staticmethod
+    def _update(ctx, context, model, column, ids, values):
+        count = 0
+        for i in range(0, len(ids), context.batch_size):
+            query = ctx.session.query(model).filter(
+                column.in_(ids[i:i + context.batch_size]))
+            count += query.update(values, synchronize_session=False)
+        return count
+
+    @classmethod
+    def chown_db(cls, ctx, context, ports=(), security_groups=(),
+                 floating_ips=()):
+        """Change ownership of neutron resources with set-based updates.
+
+        Returns a dict of table: affected row count.
+        """
+        values = {'project_id': context.target_project_id}
+        port_ids = [res.port.id for res in ports]
+        sg_ids = [res.security_group.id for res in security_groups]
+        counts = collections.Counter()
+        with neutron_db.context_manager.writer.using(ctx):
+            counts['ports'] += cls._update(
+                ctx, context, models_v2.Port, models_v2.Port.id, port_ids,
+                values)
+
+            remapped = [res.port.id for res in ports if res.default_groups]
+            if remapped:
+                binding = sg_models.SecurityGroupPortBinding
+                target_group = cls._get_target_default_group(ctx, context)
+                old_groups = set(sg_id for res in ports
+                                 for sg_id in res.default_groups)
+                query = ctx.session.query(binding).filter(
+                    binding.port_id.in_(remapped),
+                    binding.security_group_id.in_(old_groups))
+                counts['securitygroupportbindings'] += query.update(
+                    {'security_group_id': target_group},
+                    synchronize_session=False)
+
+            counts['securitygroups'] += cls._update(
+                ctx, context, sg_models.SecurityGroup,
+                sg_models.SecurityGroup.id, sg_ids, values)
+            counts['securitygrouprules'] += cls._update(
+                ctx, context, sg_models.SecurityGroupRule,
+                sg_models.SecurityGroupRule.security_group_id, sg_ids,
+                values)
+            counts['floatingips'] += cls._update(
+                ctx, context, l3_models.FloatingIP, l3_models.FloatingIP.id,
+                [res.floating_ip.id for res in floating_ips], values)
+        return {table: count for table, count in counts.items() if count}
+
+    def check_resources(self, context, resources):
+        """Refuse security groups used by ports that are not moving.
+
+        Ports already owned by the target are fine, as are the source
+        project's own when everything it owns is being moved.
+        """
+        ports, security_groups, _floating_ips = self._split_resources(
+            resources)
+        if not security_groups:
+            return
+        moving = set(res.port.id for res in ports)
+        allowed = set([context.target_project_id, context.source_project_id])
+        binding = sg_models.SecurityGroupPortBinding
+        port = models_v2.Port
+        ctx = self.admin_context
+        shared = collections.defaultdict(list)
+        with neutron_db.context_manager.reader.using(ctx):
+            query = ctx.session.query(binding.security_group_id, port.id,
+                                      port.project_id).join(
+                port, port.id == binding.port_id).filter(
+                    binding.security_group_id.in_(
+                        [res.security_group.id for res in security_groups]))
+            for sg_id, port_id, project_id in query:
+                if port_id not in moving and project_id not in allowed:
+                    shared[sg_id].append(port_id)
+        if shared:
+            raise exception.ResourceInUse(
+                'Neutron security groups are also used by ports that are '
+                'not being moved: %s' % '; '.join(
+                    '%s (%s)' % (sg_id, ','.join(sorted(port_ids)))
+                    for sg_id, port_ids in sorted(shared.items())))
+
+    def check_project(self, context, project_id):
+        """Refuse up front what _check_ports and check_resources would.
+
+        Instance ports on networks the target cannot use, and security
+        groups also used by other projects' ports, are looked for across
+        everything the project owns.
+        """
+        ctx = self.admin_context
+        port = models_v2.Port
+        network = models_v2.Network
+        rbac = rbac_db_models.NetworkRBAC
+        binding = sg_models.SecurityGroupPortBinding
+        sg = sg_models.SecurityGroup
+        with neutron_db.context_manager.reader.using(ctx):
+            usable = ctx.session.query(rbac.object_id).filter(
+                rbac.action == 'access_as_shared',
+                rbac.target_tenant.in_(['*', context.target_project_id]))
+            owned = ctx.session.query(network.id).filter(
+                network.project_id == context.target_project_id)
+            query = self._owned_query(
+                ctx, port, project_id, port.network_id,
+                sa.func.count(port.id)).filter(
+                    ~port.network_id.in_(usable),
+                    ~port.network_id.in_(owned)).group_by(port.network_id)
+            private = sorted(query)
+
+            others = ctx.session.query(port.id).filter(
+                ~port.project_id.in_([project_id,
+                                      context.target_project_id]))
+            query = ctx.session.query(binding.security_group_id).filter(
+                binding.security_group_id.in_(
+                    self._owned_query(ctx, sg, project_id, sg.id)),
+                binding.port_id.in_(others)).distinct()
+            shared = sorted(row.security_group_id for row in query)
+
+        if private:
+            raise exception.ProjectCheckFailed(
+                'Neutron ports of project %s are on networks not shared with '
+                'project %s: %s. Networks are not moved, so share them with '
+                'the target (or move the instances to its networks) '
+                'first.' % (project_id, context.target_project_id,
+                            ', '.join('%s (%i ports)' % tuple(row)
+                                      for row in private)))
+        if shared:
+            raise exception.ResourceInUse(
+                'Neutron security groups of project %s are also used by '
+                'other projects\' ports: %s' % (project_id, ','.join(shared)))
+
+    def chown_resources(self, context, resources):
+        # NOTE: Neutron has no API for transferring resources, so these
+        # are always set-based updates, with or without --bulk.
+        ports, security_groups, floating_ips = self._split_resources(
+            resources)
+        LOG.info('Chowning %i neutron ports, %i security groups and %i '
+                 'floating IPs' % (len(ports), len(security_groups),
+                                   len(floating_ips)))
+        counts = self.chown_db(self.admin_context, context, ports=ports,
+                               security_groups=security_groups,
+                               floating_ips=floating_ips)
+        progress.PROGRESS.add_done('chown', self.name, len(resources))
+        return counts
+
+    def verify_resources(self, context, resources):
+        ctx = self.admin_context
+
+        def _query(model, *entities):
+            return ctx.session.query(*entities)
+
+        ports, security_groups, floating_ips = self._split_resources(
+            resources)
+        expected = {'project_id': context.target_project_id}
+        mismatched = {}
+        with neutron_db.context_manager.reader.using(ctx):
+            for model, ids in (
+                    (models_v2.Port, [res.port.id for res in ports]),
+                    (sg_models.SecurityGroup,
+                     [res.security_group.id for res in security_groups]),
+                    (l3_models.FloatingIP,
+                     [res.floating_ip.id for res in floating_ips])):
+                ids = base.verify_owner(_query, model, 'id', ids, expected,
+                                        context.batch_size, expect_all=True)
+                if ids:
+                    mismatched[model.__tablename__] = ids
+        return mismatched
+
+    def quota_deltas(self, context, resources):
+        """Find the quota usage rows affected by moving resources.
+
+        Neutron recounts usage marked as dirty, so the keys are just
+        (project_id, resource) pairs to mark for both projects.
+        """
+        deltas = {}
+        ports, security_groups, floating_ips = self._split_resources(
+            resources)
+        for resource, items in (
+                ('port', [res.port for res in ports]),
+                ('security_group',
+                 [res.security_group for res in security_groups]),
+                ('floatingip', [res.floating_ip for res in floating_ips])):
+            for item in items:
+                deltas[(item.project_id, resource)] = True
+                deltas[(context.target_project_id, resource)] = True
+        return deltas
+
+    def apply_quota_deltas(self, context, deltas):
+        ctx = self.admin_context
+        usage = quota_models.QuotaUsage
+        count = 0
+        with neutron_db.context_manager.writer.using(ctx):
+            for project_id, resource in sorted(deltas):
+                query = ctx.session.query(usage).filter_by(
+                    project_id=project_id, resource=resource)
+                count += query.update({'dirty': True},
+                                      synchronize_session=False)
+        return count
+
+    @staticmethod
+    def _owned_query(ctx, model, project_id, *entities):
+        """Query @entities of the @model rows to move with @project_id."""
+        query = ctx.session.query(*entities).filter(
+            model.project_id == project_id)
+        if model is models_v2.Port:
+            query = query.filter(sa.or_(
+                model.device_owner == '',
+                model.device_owner.startswith(
+                    constants.DEVICE_OWNER_COMPUTE_PREFIX)))
+        elif model is sg_models.SecurityGroup:
+            # NOTE: The default group stays behind, and ports using it
+            # are moved to the target's.
+            default = sg_models.DefaultSecurityGroup
+            query = query.filter(~model.id.in_(
+                ctx.session.query(default.security_group_id)))
+        return query
+
+    def estimate(self, context, project_id):
+        ctx = self.admin_context
+        counts = {}
+        with neutron_db.context_manager.reader.using(ctx):
+            for model in (models_v2.Port, sg_models.SecurityGroup,
+                          l3_models.FloatingIP):
+                counts[model.__tablename__] = self._owned_query(
+                    ctx, model, project_id, sa.func.count(model.id)).scalar()
+        return counts
+
+    def count_resources(self, counts):
+        return sum(counts.values())
+
+    def estimate_statements(self, context, counts):
+        # NOTE: Each page is listed, resolved with a handful of queries
+        # and chowned in one transaction, however many rows it has.
+        pages = sum(base.count_pages(count, context.page_size)
+                    for count in counts.values())
+        return len(counts) + pages * (1 + RESOLVE_STATEMENTS +
+                                      CHOWN_STATEMENTS)
+
+    def iter_resource_ids_by_owner(self, context, project_id):
+        ctx = self.admin_context
+        for model, prefix in (
+                (models_v2.Port, ''),
+                (sg_models.SecurityGroup, 'security-group:'),
+                (l3_models.FloatingIP, 'floatingip:')):
+            marker = None
+            while True:
+                with neutron_db.context_manager.reader.using(ctx):
+                    query = self._owned_query(ctx, model, project_id,
+                                              model.id)
+                    if marker is not None:
+                        query = query.filter(model.id > marker)
+                    ids = [row.id for row in
+                           query.order_by(model.id).limit(context.page_size)]
+                if ids:
+                    yield ['%s%s' % (prefix, item_id) for item_id in ids]
+                if len(ids) < context.page_size:
+                    break
+                marker = ids[-1]
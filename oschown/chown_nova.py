@@ -10,44 +10,103 @@
 #  License for the specific language governing permissions and limitations
 #  under the License.
 
+import collections
+from concurrent import futures
+import contextlib
+import json
 import logging
 import nova.conf
 from nova import config
 from nova import context as nova_context
 from nova.db.sqlalchemy import api as nova_db
+from nova.db.sqlalchemy import api_models as nova_api_models
 from nova.db.sqlalchemy import models as nova_db_models
 from nova import objects
+import sqlalchemy as sa
 
 from oschown import base
 from oschown import exception
+from oschown import progress
 
 LOG = logging.getLogger(__name__)
 
+# The tables and columns we need in each database
+NOVA_TABLES = {
+    'instances': ['uuid', 'project_id', 'user_id', 'vcpus', 'memory_mb'],
+    'instance_actions': ['instance_uuid', 'project_id', 'user_id'],
+    'instance_info_caches': ['instance_uuid', 'network_info'],
+    'block_device_mapping': ['instance_uuid', 'volume_id'],
+}
+NOVA_API_TABLES = {
+    'instance_mappings': ['instance_uuid', 'project_id', 'cell_id'],
+    'cell_mappings': ['uuid', 'database_connection'],
+}
+
+# Roughly how many statements it takes to resolve a page of instances
+# (mappings, instances, info caches and BDMs), to chown one instance
+# (excluding one per action), and to chown a batch in bulk
+RESOLVE_STATEMENTS = 4
+CHOWN_STATEMENTS = 5
+BULK_CHOWN_STATEMENTS = 3
+
+
+@contextlib.contextmanager
+def _target_cell(ctx, cell):
+    """Target @ctx at @cell, or at the configured database if it is None."""
+    if cell is None:
+        yield ctx
+    else:
+        with nova_context.target_cell(ctx, cell) as cctx:
+            yield cctx
+
+
+def _port_ids(network_info):
+    """Pull the port ids out of a raw network_info JSON blob.
+
+    This avoids building the network model objects just to read ids.
+    """
+    return [vif['id'] for vif in json.loads(network_info or 'null') or []]
+
 
 class NovaResource(base.ChownableResource):
-    def __init__(self, instance):
-        self._admin_ctx = nova_context.get_admin_context()
+    def __init__(self, instance, volume_ids=None, port_ids=None,
+                 admin_ctx=None, deps=None, cell=None):
+        """A nova instance.
+
+        If the attached @volume_ids and/or @port_ids are not provided,
+        they will be looked up for this instance alone, unless the
+        dependencies are already known and passed as @deps. If the
+        instance lives in a cell, @admin_ctx must be targeted at @cell.
+        """
+        self._admin_ctx = admin_ctx or nova_context.get_admin_context()
         self._instance = instance
+        self.cell = cell
         self._deps = []
-        self._collect_volumes()
-        self._collect_ports()
-
-    def _collect_volumes(self):
-        bdms = objects.BlockDeviceMappingList.get_by_instance_uuids(
-            self._admin_ctx, [self._instance['uuid']])
-        for bdm in bdms:
-            if bdm.is_volume:
-                LOG.info('Nova instance %s requires attached volume %s' % (
-                    self._instance['uuid'], bdm.volume_id))
-                self._deps.append('cinder:%s' % bdm.volume_id)
-
-    def _collect_ports(self):
-        info = objects.InstanceInfoCache.get_by_instance_uuid(
-            self._admin_ctx, self._instance['uuid'])
-        for port in info.network_info:
+        if deps is not None:
+            self._deps.extend(deps)
+            return
+        if volume_ids is None:
+            volume_ids = NovaProject.get_volume_ids(
+                self._admin_ctx, [self._instance['uuid']])[
+                    self._instance['uuid']]
+        if port_ids is None:
+            port_ids = NovaProject.get_port_ids(
+                self._admin_ctx, [self._instance['uuid']])[
+                    self._instance['uuid']]
+        self._collect_volumes(volume_ids)
+        self._collect_ports(port_ids)
+
+    def _collect_volumes(self, volume_ids):
+        for volume_id in volume_ids:
+            LOG.info('Nova instance %s requires attached volume %s' % (
+                self._instance['uuid'], volume_id))
+            self._deps.append('cinder:%s' % volume_id)
+
+    def _collect_ports(self, port_ids):
+        for port_id in port_ids:
             LOG.info('Nova instance %s requires port %s' % (
-                self._instance['uuid'], port['id']))
-            self._deps.append('neutron:%s' % port['id'])
+                self._instance['uuid'], port_id))
+            self._deps.append('neutron:%s' % port_id)
 
     @property
     def dependencies(self):
@@ -57,6 +116,18 @@ class NovaResource(base.ChownableResource):
     def identifier(self):
         return 'nova:%s' % self._instance['uuid']
 
+    @property
+    def instance(self):
+        return self._instance
+
+    @property
+    def instance_uuid(self):
+        return self._instance['uuid']
+
+    @property
+    def version(self):
+        return base.version_stamp(self._instance['updated_at'])
+
     def _chown_instance_record(self, ctx, context):
         nova_db.instance_update(ctx, self._instance['uuid'],
                                 {'project_id': context.target_project_id,
@@ -99,31 +170,386 @@ class NovaProject(base.ChownableProject):
         self.conf = nova.conf.CONF
         config.parse_args([])
         objects.register_all()
+        self._cells = None
 
     @property
     def name(self):
         return 'nova'
 
+    def get_admin_context(self):
+        return nova_context.get_admin_context()
+
+    def get_engines(self):
+        engines = {'nova': nova_db.get_engine(),
+                   'nova_api': nova_db.get_api_engine()}
+        # NOTE: Cell databases are only included once the cells have
+        # been looked up, so that loading the project does not query.
+        for cell in self._cells or []:
+            with _target_cell(self.admin_context, cell) as cctx:
+                engines['nova cell %s' % cell.uuid] = nova_db.get_engine(
+                    context=cctx)
+        return engines
+
+    def configure_databases(self, connections):
+        groups = {'nova': 'database', 'nova_api': 'api_database'}
+        for name, url in connections.items():
+            self.conf.set_override('connection', url, group=groups[name])
+        nova_db.configure(self.conf)
+
+    def _check_cell(self, cctx, cell):
+        name = 'nova' if cell is None else 'nova cell %s' % cell.uuid
+        base.check_database(name, nova_db.get_engine(context=cctx),
+                            NOVA_TABLES)
+
     def check(self, context):
-        objects.Instance
-        pass
-
-    def collect_resources_by_owner(self, context, user_id, project_id):
-        ctx = nova_context.RequestContext(user_id, project_id)
-        insts = nova_db.instance_get_all_by_filters_sort(ctx, {})
-        for inst in insts:
-            if inst['deleted']:
-                continue
-            resource = NovaResource(inst)
-            self._resources.append(resource)
+        base.check_database('nova_api', nova_db.get_api_engine(),
+                            NOVA_API_TABLES)
+        timeout = (context.cell_timeout if context
+                   else base.DEFAULT_CELL_TIMEOUT)
+        self._scatter_gather(timeout, self._get_cells(self.admin_context),
+                             self._check_cell)
 
-    def collect_resource_by_id(self, context, resource_id):
-        ctx = nova_context.get_admin_context()
+    @staticmethod
+    @nova_db.pick_context_manager_writer
+    def _bulk_chown_db(ctx, context, instance_uuids):
+        # NOTE: Instance action events have no ownership of their own,
+        # so they follow their actions without needing an update.
+        values = {'project_id': context.target_project_id,
+                  'user_id': context.target_user_id}
+        counts = {}
+
+        query = nova_db.model_query(ctx, nova_db_models.Instance)
+        query = query.filter(
+            nova_db_models.Instance.uuid.in_(instance_uuids))
+        counts['instances'] = query.update(values,
+                                           synchronize_session=False)
+
+        query = nova_db.model_query(ctx, nova_db_models.InstanceAction)
+        query = query.filter(
+            nova_db_models.InstanceAction.instance_uuid.in_(instance_uuids))
+        counts['instance_actions'] = query.update(values,
+                                                  synchronize_session=False)
+        return counts
+
+    @staticmethod
+    @nova_db.api_context_manager.writer
+    def _bulk_chown_mappings_db(ctx, context, instance_uuids):
+        query = ctx.session.query(nova_api_models.InstanceMapping)
+        query = query.filter(
+            nova_api_models.InstanceMapping.instance_uuid.in_(instance_uuids))
+        count = query.update({'project_id': context.target_project_id},
+                             synchronize_session=False)
+        return {'instance_mappings': count}
+
+    @staticmethod
+    @nova_db.pick_context_manager_reader
+    def _verify_cell_db(ctx, context, instance_uuids):
+        def _query(model, *entities):
+            return nova_db.model_query(ctx, model, entities)
+
+        expected = {'project_id': context.target_project_id,
+                    'user_id': context.target_user_id}
+        mismatched = {}
+        for table, model, key, expect_all in (
+                ('instances', nova_db_models.Instance, 'uuid', True),
+                ('instance_actions', nova_db_models.InstanceAction,
+                 'instance_uuid', False)):
+            mismatched[table] = base.verify_owner(
+                _query, model, key, instance_uuids, expected,
+                context.batch_size, expect_all=expect_all)
+        return mismatched
+
+    @staticmethod
+    @nova_db.api_context_manager.reader
+    def _verify_mappings_db(ctx, context, instance_uuids):
+        def _query(model, *entities):
+            return ctx.session.query(*entities)
+
+        return base.verify_owner(
+            _query, nova_api_models.InstanceMapping, 'instance_uuid',
+            instance_uuids, {'project_id': context.target_project_id},
+            context.batch_size, expect_all=True)
+
+    def verify_resources(self, context, resources):
+        ctx = self.admin_context
+        cells = {}
+        by_cell = collections.defaultdict(list)
+        for resource in resources:
+            cell_uuid = resource.cell and resource.cell.uuid
+            cells[cell_uuid] = resource.cell
+            by_cell[cell_uuid].append(resource.instance_uuid)
+
+        mismatched = collections.defaultdict(list)
+        for cell_uuid, uuids in by_cell.items():
+            with _target_cell(ctx, cells[cell_uuid]) as cctx:
+                for table, ids in self._verify_cell_db(cctx, context,
+                                                       uuids).items():
+                    mismatched[table].extend(ids)
+        mismatched['instance_mappings'] = self._verify_mappings_db(
+            ctx, context, [resource.instance_uuid for resource in resources])
+        return {table: ids for table, ids in mismatched.items() if ids}
+
+    @staticmethod
+    @nova_db.pick_context_manager_reader
+    def _estimate_cell_db(ctx, cell, project_id):
+        instance = nova_db_models.Instance
+        bdm = nova_db_models.BlockDeviceMapping
+        query = nova_db.model_query(ctx, instance, (sa.func.count(),))
+        counts = {'instances': query.filter(
+            instance.project_id == project_id).scalar()}
+
+        uuids = nova_db.model_query(ctx, instance, (instance.uuid,)).filter(
+            instance.project_id == project_id).subquery()
+        for name, model, criteria in (
+                ('instance_actions', nova_db_models.InstanceAction, []),
+                ('volume_attachments', bdm, [bdm.volume_id.isnot(None)])):
+            query = nova_db.model_query(ctx, model, (sa.func.count(),))
+            counts[name] = query.filter(model.instance_uuid.in_(uuids),
+                                        *criteria).scalar()
+        return counts
+
+    def estimate(self, context, project_id):
+        counts = collections.Counter()
+        for cell_counts in self._scatter_gather(
+                context.cell_timeout, self._get_cells(self.admin_context),
+                self._estimate_cell_db, project_id).values():
+            counts.update(cell_counts)
+        return dict(counts)
+
+    def count_resources(self, counts):
+        return counts.get('instances', 0)
+
+    def estimate_statements(self, context, counts):
+        instances = counts.get('instances', 0)
+        pages = base.count_pages(instances, context.page_size)
+        # NOTE: Listing ends with a short page from each cell.
+        statements = pages + len(self._get_cells(self.admin_context))
+        statements += pages * RESOLVE_STATEMENTS
+        if context.bulk:
+            statements += BULK_CHOWN_STATEMENTS * base.count_pages(
+                instances, min(context.page_size, context.batch_size))
+        else:
+            statements += (instances * CHOWN_STATEMENTS +
+                           counts.get('instance_actions', 0))
+        return statements
+
+    def _get_cells(self, ctx):
+        """Return all cell mappings, or [None] without cells v2."""
+        if self._cells is None:
+            self._cells = list(objects.CellMappingList.get_all(ctx))
+            base.watch_engines(self.get_engines())
+        return self._cells or [None]
+
+    def _group_by_cell(self, ctx, uuids):
+        """Group instance uuids by the cell they are mapped to.
+
+        Returns a list of (cell_mapping, uuids). Instances without a
+        cell mapping are looked for in the configured database, with a
+        cell_mapping of None.
+        """
+        cells = {}
+        by_cell = collections.defaultdict(list)
+        mappings = objects.InstanceMappingList.get_by_instance_uuids(ctx,
+                                                                     uuids)
+        for mapping in mappings:
+            if mapping.cell_mapping is not None:
+                cells[mapping.cell_mapping.uuid] = mapping.cell_mapping
+                by_cell[mapping.cell_mapping.uuid].append(
+                    mapping.instance_uuid)
+
+        grouped = [(cells[cell_uuid], cell_uuids)
+                   for cell_uuid, cell_uuids in by_cell.items()]
+        mapped = set(uuid for cell_uuids in by_cell.values()
+                     for uuid in cell_uuids)
+        unmapped = [uuid for uuid in uuids if uuid not in mapped]
+        if unmapped:
+            grouped.append((None, unmapped))
+        return grouped
+
+    def _scatter_gather(self, timeout, cells, fn, *args):
+        """Run fn(cctx, cell, *args) against each cell in parallel.
+
+        Each cell gets its own thread and admin context. Returns a dict
+        of cell: result.
+
+        :raises: exception.UnableToResolveResources if any cell does not
+                 respond within @timeout seconds
+        """
+        def _run(cell):
+            with _target_cell(self.admin_context, cell) as cctx:
+                return fn(cctx, cell, *args)
+
+        pool = futures.ThreadPoolExecutor(max_workers=len(cells))
         try:
-            inst = nova_db.instance_get_by_uuid(ctx, resource_id)
-        except nova.exception.InstanceNotFound:
+            fs = {pool.submit(_run, cell): cell for cell in cells}
+            done, not_done = futures.wait(fs, timeout=timeout)
+            if not_done:
+                raise exception.UnableToResolveResources(
+                    'Nova cells %s did not respond within %is' % (
+                        ','.join(sorted(str(fs[f] and fs[f].uuid)
+                                        for f in not_done)),
+                        timeout))
+            return {fs[f]: f.result() for f in done}
+        finally:
+            pool.shutdown(wait=False)
+
+    def chown_resources(self, context, resources):
+        if not context.bulk:
+            return super(NovaProject, self).chown_resources(context,
+                                                            resources)
+
+        ctx = self.admin_context
+        cells = {}
+        by_cell = collections.defaultdict(list)
+        for resource in resources:
+            cell_uuid = resource.cell and resource.cell.uuid
+            cells[cell_uuid] = resource.cell
+            by_cell[cell_uuid].append(resource.instance_uuid)
+
+        counts = collections.Counter()
+        for cell_uuid, uuids in by_cell.items():
+            with _target_cell(ctx, cells[cell_uuid]) as cctx:
+                for i in range(0, len(uuids), context.batch_size):
+                    batch = uuids[i:i + context.batch_size]
+                    LOG.info('Bulk chowning %i nova instances in cell %s' % (
+                        len(batch), cell_uuid))
+                    counts.update(self._bulk_chown_db(cctx, context, batch))
+                    counts.update(self._bulk_chown_mappings_db(ctx, context,
+                                                               batch))
+                    progress.PROGRESS.add_done('chown', self.name, len(batch))
+        return dict(counts)
+
+    def collect_planned_resources(self, context, planned):
+        ctx = self.admin_context
+        resources = {}
+        for cell, uuids in self._group_by_cell(ctx, list(planned)):
+            with _target_cell(ctx, cell) as cctx:
+                insts = self._get_instances(cctx, uuids, [])
+                resources.update(
+                    (uuid, NovaResource(inst, admin_ctx=cctx, cell=cell,
+                                        deps=planned[uuid][1]))
+                    for uuid, inst in insts.items())
+        base.check_plan_versions(self.name, resources, planned)
+        return resources
+
+    @staticmethod
+    def _list_instance_uuids(cctx, cell, project_id, limit, markers):
+        filters = {'project_id': project_id,
+                   'deleted': False, 'soft_deleted': True}
+        insts = nova_db.instance_get_all_by_filters_sort(
+            cctx, filters, limit=limit, marker=markers[cell],
+            columns_to_join=[],
+            sort_keys=['created_at', 'id'], sort_dirs=['asc', 'asc'])
+        return [inst['uuid'] for inst in insts]
+
+    def iter_resource_ids_by_owner(self, context, project_id):
+        # NOTE: Copy the cached cells, since finished ones are removed.
+        cells = list(self._get_cells(self.admin_context))
+        markers = {cell: None for cell in cells}
+        while cells:
+            pages = self._scatter_gather(context.cell_timeout, cells,
+                                         self._list_instance_uuids,
+                                         project_id, context.page_size,
+                                         markers)
+            for cell in list(cells):
+                page = pages[cell]
+                if page:
+                    yield page
+                    markers[cell] = page[-1]
+                if len(page) < context.page_size:
+                    cells.remove(cell)
+
+    def collect_resource_by_id(self, context, resource_id):
+        return self.collect_resources_by_ids(context,
+                                             [resource_id])[resource_id]
+
+    @staticmethod
+    def _get_instances(ctx, uuids, columns_to_join):
+        insts = nova_db.instance_get_all_by_filters_sort(
+            ctx, {'uuid': uuids, 'deleted': False, 'soft_deleted': True},
+            columns_to_join=columns_to_join)
+        insts = {inst['uuid']: inst for inst in insts}
+        missing = set(uuids) - set(insts)
+        if missing:
             raise exception.UnableToResolveResources(
-                'Nova instance %s not found' % resource_id)
-        resource = NovaResource(inst)
-        self._resources.append(resource)
-        return resource
+                'Nova instance %s not found' % ','.join(sorted(missing)))
+        return insts
+
+    @staticmethod
+    @nova_db.pick_context_manager_reader
+    def get_port_ids(ctx, uuids):
+        """Return a dict of instance uuid: [port id] from the info caches.
+
+        Only the instance uuid and raw network_info columns are fetched,
+        for all of @uuids in one query.
+        """
+        model = nova_db_models.InstanceInfoCache
+        query = nova_db.model_query(ctx, model, (model.instance_uuid,
+                                                 model.network_info))
+        query = query.filter(model.instance_uuid.in_(uuids))
+        port_ids = collections.defaultdict(list)
+        for instance_uuid, network_info in query:
+            port_ids[instance_uuid].extend(_port_ids(network_info))
+        return port_ids
+
+    @staticmethod
+    def get_volume_ids(ctx, uuids, index=None):
+        """Return a dict of instance uuid: [attached volume id].
+
+        Instances covered by the attachments.AttachmentIndex @index are
+        looked up there, and the BDMs of the rest in one query.
+        """
+        volume_ids = collections.defaultdict(list)
+        missing = uuids
+        if index is not None:
+            found, missing = index.volumes_by_instance(uuids)
+            volume_ids.update(found)
+        if missing:
+            for bdm in objects.BlockDeviceMappingList.get_by_instance_uuids(
+                    ctx, missing):
+                if bdm.is_volume:
+                    volume_ids[bdm.instance_uuid].append(bdm.volume_id)
+        return volume_ids
+
+    @staticmethod
+    @nova_db.pick_context_manager_reader
+    def _scan_attachments_db(ctx, cell, project_id):
+        instance = nova_db_models.Instance
+        bdm = nova_db_models.BlockDeviceMapping
+        query = nova_db.model_query(ctx, instance,
+                                    (instance.uuid, bdm.volume_id))
+        query = query.outerjoin(bdm, sa.and_(
+            bdm.instance_uuid == instance.uuid,
+            bdm.destination_type == 'volume',
+            bdm.deleted == 0))
+        return query.filter(instance.project_id == project_id).all()
+
+    def scan_attachments(self, context, project_id, index):
+        for rows in self._scatter_gather(
+                context.cell_timeout, self._get_cells(self.admin_context),
+                self._scan_attachments_db, project_id).values():
+            index.add_instances(rows)
+
+    def _collect_from_cell(self, context, cctx, cell, uuids):
+        insts = self._get_instances(cctx, uuids, [])
+        port_ids = self.get_port_ids(cctx, uuids)
+        volume_ids = self.get_volume_ids(cctx, uuids, context.attachments)
+
+        resources = {}
+        for uuid, inst in insts.items():
+            resource = NovaResource(
+                inst, volume_ids=volume_ids[uuid],
+                port_ids=port_ids[uuid],
+                admin_ctx=cctx, cell=cell)
+            resources[uuid] = resource
+        return resources
+
+    def collect_resources_by_ids(self, context, resource_ids):
+        ctx = self.admin_context
+        uuids = list(set(resource_ids))
+        resources = {}
+        for cell, cell_uuids in self._group_by_cell(ctx, uuids):
+            with _target_cell(ctx, cell) as cctx:
+                resources.update(self._collect_from_cell(context, cctx, cell,
+                                                         cell_uuids))
+        return resources
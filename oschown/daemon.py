@@ -0,0 +1,158 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+"""A long-running service for many small transfers.
+
+The projects are loaded (and their database connections pooled) once,
+and transfer jobs are then accepted over a Unix socket. Each request is
+one line of JSON like:
+
+    {"jobs": [{"root_resource": "nova", "root_id": "<uuid>",
+               "target_user": "bob", "target_project": "demo"}],
+     "dry_run": false}
+
+with jobs as in a manifest, and is answered with one line of JSON like:
+
+    {"results": [{"job": 0, "success": true, ...}], "time": 0.12}
+
+or {"error": "..."} if the request itself was invalid. Requests are run
+one at a time, in the order they arrive.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import time
+
+from oschown import exception
+from oschown import manifest
+
+LOG = logging.getLogger(__name__)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = self.server.handle_line(line)
+            self.wfile.write(json.dumps(reply, sort_keys=True).encode())
+            self.wfile.write(b'\n')
+            self.wfile.flush()
+
+
+def check_socket(path):
+    """Make sure nothing is using the socket at @path.
+
+    A socket left behind by a daemon that is no longer running is
+    removed.
+
+    :raises: exception.SocketInUse if @path is not a socket, or another
+             daemon is accepting connections on it
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise exception.SocketInUse('%s exists and is not a socket' % path)
+    with contextlib.closing(socket.socket(socket.AF_UNIX,
+                                          socket.SOCK_STREAM)) as sock:
+        try:
+            sock.connect(path)
+        except (IOError, OSError):
+            LOG.info('Removing stale socket %s' % path)
+            os.unlink(path)
+            return
+    raise exception.SocketInUse(
+        'Another daemon is already accepting jobs on %s' % path)
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """Serve transfer jobs on the Unix socket at @path.
+
+    @run_jobs is called with a list of jobs (as returned by
+    manifest.parse_jobs()) and whether to do a dry run, and returns a
+    list of result dicts.
+
+    :raises: exception.SocketInUse as from check_socket()
+    """
+
+    def __init__(self, path, run_jobs):
+        check_socket(path)
+        # NOTE: Anyone who can connect can change resource ownership,
+        # so only we may use the socket.
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path,
+                                                   _RequestHandler)
+        finally:
+            os.umask(umask)
+        self.path = path
+        self._run_jobs = run_jobs
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('expected an object')
+            jobs = manifest.parse_jobs(request.get('jobs') or [])
+        except (ValueError, exception.InvalidManifest) as e:
+            return {'error': 'Invalid request: %s' % e}
+
+        start = time.time()
+        try:
+            results = self._run_jobs(jobs, bool(request.get('dry_run')))
+        except Exception as e:
+            LOG.exception('Failed to run jobs')
+            return {'error': 'Failed to run jobs: %s' % e}
+        LOG.info('Ran %i jobs in %.2fs' % (len(jobs), time.time() - start))
+        return {'results': results, 'time': time.time() - start}
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(path, run_jobs):
+    """Serve jobs on @path until interrupted."""
+
+    def _terminate(signum, frame):
+        raise SystemExit(0)
+
+    server = DaemonServer(path, run_jobs)
+    signal.signal(signal.SIGTERM, _terminate)
+    LOG.warning('Accepting jobs on %s' % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def submit(path, jobs, dry_run=False):
+    """Send @jobs to the daemon at @path and return its reply."""
+
+    request = json.dumps({'jobs': jobs, 'dry_run': dry_run}).encode()
+    with contextlib.closing(socket.socket(socket.AF_UNIX,
+                                          socket.SOCK_STREAM)) as sock:
+        sock.connect(path)
+        sock.sendall(request + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline().decode('utf-8'))
@@ -25,3 +25,27 @@ class UnknownResourceType(ChownException):
 
 class UnableToResolveResources(ChownException):
     pass
+
+
+class ChownFailed(ChownException):
+    pass
+
+
+class InvalidManifest(ChownException):
+    pass
+
+
+class InvalidPlan(ChownException):
+    pass
+
+
+class PlanOutOfDate(ChownException):
+    pass
+
+
+class ResourceInUse(ChownException):
+    pass
+
+
+class SocketInUse(ChownException):
+    pass
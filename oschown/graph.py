@@ -0,0 +1,149 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import collections
+
+
+class ResourceGraph(object):
+    """A dependency graph of resource identifiers.
+
+    An edge from a resource to one of its dependencies means that the
+    dependency must be chown'ed along with it. Both directions are
+    indexed, and duplicate edges are ignored.
+    """
+
+    def __init__(self):
+        self._deps = collections.OrderedDict()
+        self._rdeps = collections.OrderedDict()
+
+    def __contains__(self, node):
+        return node in self._deps
+
+    def __len__(self):
+        return len(self._deps)
+
+    @property
+    def nodes(self):
+        return list(self._deps)
+
+    @property
+    def edge_count(self):
+        return sum(len(deps) for deps in self._deps.values())
+
+    def add_node(self, node):
+        if node not in self._deps:
+            self._deps[node] = collections.OrderedDict()
+            self._rdeps[node] = collections.OrderedDict()
+
+    def add_edge(self, node, dep):
+        """Record that @node depends on @dep.
+
+        Returns whether or not the edge is new.
+        """
+        self.add_node(node)
+        self.add_node(dep)
+        if dep in self._deps[node]:
+            return False
+        self._deps[node][dep] = None
+        self._rdeps[dep][node] = None
+        return True
+
+    def dependencies(self, node):
+        """The resources that @node depends on."""
+        return list(self._deps[node])
+
+    def dependents(self, node):
+        """The resources that depend on @node."""
+        return list(self._rdeps[node])
+
+    def connected_components(self):
+        """Split the graph into independent sets of resources.
+
+        Returns a list of lists of resource identifiers, where no
+        resource in one list depends on or is depended on by a resource
+        in another.
+        """
+        seen = set()
+        components = []
+        for root in self._deps:
+            if root in seen:
+                continue
+            seen.add(root)
+            component = []
+            queue = collections.deque([root])
+            while queue:
+                node = queue.popleft()
+                component.append(node)
+                for other in list(self._deps[node]) + list(self._rdeps[node]):
+                    if other not in seen:
+                        seen.add(other)
+                        queue.append(other)
+            components.append(component)
+        return components
+
+    def strongly_connected_components(self):
+        """Group the resources into mutually dependent sets.
+
+        Returns a list of lists of resource identifiers, ordered so that
+        each set comes after all of the sets it depends on. This is
+        Tarjan's algorithm, without recursion so that large graphs do
+        not exhaust the stack.
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        def _visit(node):
+            index[node] = lowlink[node] = len(index)
+            stack.append(node)
+            on_stack.add(node)
+            return node, iter(self._deps[node])
+
+        for root in self._deps:
+            if root in index:
+                continue
+            work = [_visit(root)]
+            while work:
+                node, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        work.append(_visit(dep))
+                        break
+                    elif dep in on_stack:
+                        lowlink[node] = min(lowlink[node], index[dep])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        return components
+
+    def topological_order(self):
+        """Return all resources, each after the ones it depends on.
+
+        Resources that depend on each other (such as an instance and
+        its attached volume) have no such order, and are returned
+        together in an arbitrary order.
+        """
+        return [node for component in self.strongly_connected_components()
+                for node in component]
@@ -0,0 +1,129 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import json
+import logging
+import os
+import time
+
+import keystoneauth1.exceptions.http
+from keystoneauth1.identity import v3 as keystone_v3
+from keystoneauth1 import session as keystone_session
+from keystoneclient.v3 import client as keystone_client
+
+from oschown import exception
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache',
+                                  'oschown', 'identity.json')
+DEFAULT_CACHE_TTL = 3600
+
+
+class IdentityResolver(object):
+    """Verify or normalize keystone project and user ids/names.
+
+    Assumes standard OS_ environment variables for credentials. The
+    keystone session is created on first use and reused for every
+    lookup made through this resolver. Results are cached on disk (per
+    auth URL) for @cache_ttl seconds, unless @use_cache is False.
+    """
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE,
+                 cache_ttl=DEFAULT_CACHE_TTL, use_cache=True):
+        self._auth_url = os.getenv('OS_AUTH_URL', '') + '/v3'
+        self._cache_file = cache_file
+        self._cache_ttl = cache_ttl
+        self._use_cache = use_cache
+        self._cache = None
+        self._keystone = None
+
+    @property
+    def keystone(self):
+        if self._keystone is None:
+            auth = keystone_v3.Password(
+                auth_url=self._auth_url,
+                username=os.getenv('OS_USERNAME'),
+                password=os.getenv('OS_PASSWORD'),
+                project_name=os.getenv('OS_PROJECT_NAME'),
+                user_domain_id=os.getenv('OS_USER_DOMAIN_ID'),
+                project_domain_id=os.getenv('OS_PROJECT_DOMAIN_ID'))
+            sess = keystone_session.Session(auth=auth)
+            self._keystone = keystone_client.Client(session=sess)
+        return self._keystone
+
+    def _load_cache(self):
+        if self._cache is None:
+            try:
+                with open(self._cache_file) as f:
+                    self._cache = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._cache = {}
+        return self._cache.setdefault(self._auth_url, {})
+
+    def _save_cache(self):
+        cache_dir = os.path.dirname(self._cache_file)
+        tmp_file = '%s.%i' % (self._cache_file, os.getpid())
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            with open(tmp_file, 'w') as f:
+                os.chmod(tmp_file, 0o600)
+                json.dump(self._cache, f)
+            os.rename(tmp_file, self._cache_file)
+        except (IOError, OSError) as e:
+            LOG.warning('Unable to save identity cache %s: %s' % (
+                self._cache_file, e))
+
+    def _find(self, kind, manager, name_or_id):
+        if not self._use_cache:
+            return self._find_keystone(manager, name_or_id)
+
+        cache = self._load_cache().setdefault(kind, {})
+        cached = cache.get(name_or_id)
+        if cached and time.time() - cached[1] < self._cache_ttl:
+            LOG.info('Using cached id %s for %s %s' % (
+                cached[0], kind, name_or_id))
+            return cached[0]
+
+        found_id = self._find_keystone(manager, name_or_id)
+        cache[name_or_id] = [found_id, time.time()]
+        self._save_cache()
+        return found_id
+
+    @staticmethod
+    def _find_keystone(manager, name_or_id):
+        try:
+            found = manager.find(name=name_or_id)
+        except keystoneauth1.exceptions.http.NotFound:
+            found = manager.find(id=name_or_id)
+        return found.id
+
+    def check(self):
+        """Check that we can authenticate against keystone.
+
+        :raises: exception.ProjectCheckFailed if not
+        """
+        try:
+            self.keystone.session.get_token()
+        except keystoneauth1.exceptions.ClientException as e:
+            raise exception.ProjectCheckFailed(
+                'Unable to authenticate to keystone at %s: %s' % (
+                    self._auth_url, e))
+
+    def resolve_project(self, name_or_id):
+        """Return the id of the project with the given name or id."""
+        return self._find('projects', self.keystone.projects, name_or_id)
+
+    def resolve_user(self, name_or_id):
+        """Return the id of the user with the given name or id."""
+        return self._find('users', self.keystone.users, name_or_id)
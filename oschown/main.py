@@ -11,16 +11,21 @@
 #  under the License.
 
 import argparse
+import cProfile
+import json
 import logging
-import os
-
-import keystoneauth1.exceptions.http
-from keystoneauth1.identity import v3 as keystone_v3
-from keystoneauth1 import session as keystone_session
-from keystoneclient.v3 import client as keystone_client
+import sys
 
 from oschown import base
+from oschown import exception
+from oschown import identity
+from oschown import manifest
+from oschown import preflight
+from oschown import progress
+from oschown import stats
+from oschown import throttle
 
+LOG = logging.getLogger(__name__)
 
 WORKFLOW_TYPES = {}
 
@@ -49,52 +54,215 @@ def _get_arg_parser():
                         help='Resource id')
     parser.add_argument('--all-resources-for-project', metavar='PROJECT',
                         help='Move all resources in this project')
-    parser.add_argument('--target-project', required=True, metavar='PROJECT',
+    parser.add_argument('--estimate', action='store_true', default=False,
+                        help='With --all-resources-for-project, only count '
+                        'the resources that would be moved and estimate '
+                        'how long it would take')
+    parser.add_argument('--page-size', type=int, metavar='N',
+                        default=base.DEFAULT_PAGE_SIZE,
+                        help='Number of resources to list and chown at a '
+                        'time with --all-resources-for-project')
+    parser.add_argument('--bulk', action='store_true',
+                        default=False,
+                        help='Change ownership with set-based database '
+                        'updates where supported, instead of one resource '
+                        'at a time')
+    parser.add_argument('--batch-size', type=int, metavar='N',
+                        default=base.DEFAULT_BATCH_SIZE,
+                        help='Number of resources to update per transaction '
+                        'with --bulk')
+    parser.add_argument('--resolve-workers', type=int, metavar='N',
+                        default=1,
+                        help='Number of threads to look up resources with '
+                        'in parallel')
+    parser.add_argument('--chown-workers', type=int, metavar='N',
+                        default=1,
+                        help='Number of processes to chown independent '
+                        'groups of resources with in parallel')
+    parser.add_argument('--max-db-writers', type=int, metavar='N',
+                        help='Maximum number of --chown-workers changing '
+                        'ownership at the same time (default: all of them)')
+    parser.add_argument('--cell-timeout', type=int, metavar='SECONDS',
+                        default=base.DEFAULT_CELL_TIMEOUT,
+                        help='How long to wait for each nova cell database '
+                        'to answer when listing a whole project')
+    parser.add_argument('--verify', action='store_true', default=False,
+                        help='Check that every resolved resource belongs to '
+                        'the target project and user after the chown')
+    parser.add_argument('--save-plan', metavar='FILE',
+                        help='Save the resolved resources to this file, to '
+                        'be applied later with --apply-plan')
+    parser.add_argument('--apply-plan', metavar='FILE',
+                        help='Change ownership of the resources in a plan '
+                        'saved with --save-plan, if none have changed')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='Run all of the jobs in this CSV or JSON lines '
+                        'file of root_resource,root_id,target_user,'
+                        'target_project')
+    parser.add_argument('--daemon', metavar='SOCKET',
+                        help='Load all projects once and then run jobs sent '
+                        'as JSON lines to this Unix socket')
+    parser.add_argument('--target-project', metavar='PROJECT',
                         help='Change ownership of resources to this project')
-    parser.add_argument('--target-user', required=True, metavar='USER',
+    parser.add_argument('--target-user', metavar='USER',
                         help='Change ownership of resources to this user')
     parser.add_argument('--no-validate', action='store_true',
                         default=False,
                         help='Do not validate/normalize target '
                         'user and project')
+    parser.add_argument('--no-identity-cache', action='store_true',
+                        default=False,
+                        help='Always look up users and projects in keystone '
+                        'instead of using cached results')
+    parser.add_argument('--identity-cache-ttl', type=int, metavar='SECONDS',
+                        default=identity.DEFAULT_CACHE_TTL,
+                        help='How long to cache user and project lookups')
+    parser.add_argument('--max-qps', type=float, metavar='N',
+                        help='Limit the statements per second run against '
+                        'each database')
+    parser.add_argument('--max-tps', type=float, metavar='N',
+                        help='Limit the transactions per second started '
+                        'against each database')
+    parser.add_argument('--max-writes', type=int, metavar='N',
+                        help='Limit the number of transactions writing to '
+                        'each database at once')
+    parser.add_argument('--latency-threshold', type=float, metavar='MS',
+                        help='Slow down while the average statement latency '
+                        'on a database is above this many milliseconds')
+    parser.add_argument('--skip-preflight', action='store_true',
+                        default=False,
+                        help='Do not check that every project database and '
+                        'keystone are usable before starting')
+    parser.add_argument('--preflight-ttl', type=int, metavar='SECONDS',
+                        default=preflight.DEFAULT_CACHE_TTL,
+                        help='How long passed pre-flight checks are trusted '
+                        'for in batch mode')
+    parser.add_argument('--progress', metavar='FILE',
+                        help='Write JSON lines with the progress of the run '
+                        'to this file (or - for stderr)')
+    parser.add_argument('--progress-interval', type=float, metavar='SECONDS',
+                        default=progress.DEFAULT_INTERVAL,
+                        help='How often to write progress')
+    parser.add_argument('--stats', action='store_true',
+                        default=False,
+                        help='Print a JSON summary of the time spent in each '
+                        'phase and the SQL statements run against each '
+                        'database to stderr')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write cProfile data for the run to this file')
     return parser
 
 
-def _resolve_project(user_id, project_id):
-    """Attempt to verify or normalize project and user id/names.
+def _populate_workflows():
+    from oschown import workflows
+
+    WORKFLOW_TYPES.update({
+        'nova': workflows.workflow_nova,
+        'cinder': workflows.workflow_cinder,
+    })
+
 
-    Assumes standard OS_ environment variables for credentials.
+def _get_context(args, resolver, target_user, target_project):
+    # NOTE: An estimate does not need to know the target.
+    if args.no_validate or args.estimate:
+        user_id = target_user
+        project_id = target_project
+    else:
+        with stats.STATS.phase('keystone'):
+            user_id = resolver.resolve_user(target_user)
+            project_id = resolver.resolve_project(target_project)
+
+    return base.ChownContext(user_id, project_id,
+                             args.dry_run,
+                             page_size=args.page_size,
+                             bulk=args.bulk,
+                             batch_size=args.batch_size,
+                             resolve_workers=args.resolve_workers,
+                             chown_workers=args.chown_workers,
+                             max_db_writers=args.max_db_writers,
+                             save_plan=args.save_plan,
+                             cell_timeout=args.cell_timeout,
+                             verify=args.verify)
+
+
+def _run_jobs(args, resolver, jobs):
+    """Run a list of manifest-style jobs in one batch.
+
+    Returns a list of result dicts, one per job in order.
     """
-    auth = keystone_v3.Password(
-        auth_url=os.getenv('OS_AUTH_URL') + '/v3',
-        username=os.getenv('OS_USERNAME'),
-        password=os.getenv('OS_PASSWORD'),
-        project_name=os.getenv('OS_PROJECT_NAME'),
-        user_domain_id=os.getenv('OS_USER_DOMAIN_ID'),
-        project_domain_id=os.getenv('OS_PROJECT_DOMAIN_ID'))
-    sess = keystone_session.Session(auth=auth)
-    keystone = keystone_client.Client(session=sess)
+    from oschown import workflows
+
+    contexts = {}
+    batch = []
+    results = []
+    for index, job in enumerate(jobs):
+        resource_id = '%s:%s' % (job['root_resource'], job['root_id'])
+        target = (job['target_user'] or args.target_user,
+                  job['target_project'] or args.target_project)
+        error = None
+        if job['root_resource'] not in WORKFLOW_TYPES:
+            error = 'No workflow for %s' % job['root_resource']
+        elif None in target:
+            error = 'No target user or project'
+        elif target not in contexts:
+            try:
+                contexts[target] = _get_context(args, resolver, *target)
+            except Exception as e:
+                error = 'Unable to resolve target: %s' % e
+        if error:
+            results.append({'job': index, 'resource': resource_id,
+                            'success': False, 'error': error})
+        else:
+            batch.append((index, contexts[target], resource_id))
+
+    results.extend(workflows.workflow_batch(batch))
+    return sorted(results, key=lambda r: r['job'])
 
-    try:
-        project = keystone.projects.find(name=project_id)
-    except keystoneauth1.exceptions.http.NotFound:
-        project = keystone.projects.find(id=project_id)
 
+def _run_manifest(args, resolver):
     try:
-        user = keystone.users.find(name=user_id)
-    except keystoneauth1.exceptions.http.NotFound:
-        user = keystone.users.find(id=user_id)
+        jobs = manifest.load_manifest(args.manifest)
+    except (IOError, exception.InvalidManifest) as e:
+        print('Unable to load manifest %s: %s' % (args.manifest, e))
+        return 1
 
-    return user.id, project.id
+    results = _run_jobs(args, resolver, jobs)
+    for result in results:
+        print(json.dumps(result, sort_keys=True))
+    return 0 if all(r['success'] for r in results) else 1
 
 
-def _populate_workflows():
-    from oschown import workflows
+def _run_daemon(args, resolver):
+    from oschown import daemon
+    from oschown import projects
 
-    WORKFLOW_TYPES.update({
-        'nova': workflows.workflow_nova,
-        'cinder': workflows.workflow_cinder,
-    })
+    # NOTE: Check before loading anything, which can take a while.
+    try:
+        daemon.check_socket(args.daemon)
+    except exception.SocketInUse as e:
+        print('Unable to start daemon: %s' % e)
+        return 1
+
+    # NOTE: Load everything now, so that the first job does not pay
+    # for it. Projects that cannot be loaded fail only the jobs that
+    # need them.
+    for name in projects.PROJECTS.names:
+        try:
+            projects.PROJECTS[name]
+        except Exception as e:
+            LOG.warning('Unable to load project %s: %s' % (name, e))
+
+    def _run(jobs, dry_run):
+        job_args = argparse.Namespace(**vars(args))
+        job_args.dry_run = args.dry_run or dry_run
+        return _run_jobs(job_args, resolver, jobs)
+
+    try:
+        daemon.serve(args.daemon, _run)
+    except exception.SocketInUse as e:
+        print('Unable to start daemon: %s' % e)
+        return 1
+    return 0
 
 
 def main():
@@ -106,29 +274,115 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.INFO)
 
-    if args.no_validate:
-        user_id = args.target_user
-        project_id = args.target_project
-    else:
-        user_id, project_id = _resolve_project(
-            args.target_user, args.target_project)
+    stats.STATS.enabled = args.stats
+    throttle.THROTTLE.configure(
+        max_qps=args.max_qps, max_tps=args.max_tps,
+        max_writes=args.max_writes,
+        latency_threshold=(args.latency_threshold and
+                           args.latency_threshold / 1000.0))
+    if args.progress:
+        if args.progress == '-':
+            progress_file = sys.stderr
+        else:
+            progress_file = open(args.progress, 'a')
+        progress.PROGRESS.start(progress_file, args.progress_interval)
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return _main(parser, args)
+    finally:
+        if args.progress:
+            progress.PROGRESS.stop()
+            if progress_file is not sys.stderr:
+                progress_file.close()
+        if args.profile:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.stats:
+            print(json.dumps(stats.STATS.summary(), indent=2,
+                             sort_keys=True), file=sys.stderr)
+
+
+def _preflight_projects(args):
+    """Return the projects to check before starting, or None for all.
 
-    context = base.ChownContext(user_id, project_id,
-                                args.dry_run)
+    Only the root resource's project is checked up front, and the
+    projects of its dependencies as resolution reaches them. Manifest
+    jobs and plans are checked the same way once they are loaded.
+    """
+    if args.all_resources_for_project:
+        return None
+    if args.root_resource in WORKFLOW_TYPES:
+        return [args.root_resource]
+    return []
+
+
+def _main(parser, args):
+    resolver = identity.IdentityResolver(
+        cache_ttl=args.identity_cache_ttl,
+        use_cache=not args.no_identity_cache)
+
+    if args.save_plan and (args.manifest or args.daemon or args.apply_plan or
+                           args.all_resources_for_project):
+        parser.error('--save-plan can only be used with --root-resource')
+
+    if args.estimate and not args.all_resources_for_project:
+        parser.error('--estimate can only be used with '
+                     '--all-resources-for-project')
+
+    if (not (args.manifest or args.daemon or args.estimate) and
+            not (args.target_user and args.target_project)):
+        parser.error('--target-user and --target-project are required')
 
-    if args.root_resource and args.root_id:
+    preflight.PREFLIGHT.enabled = not args.skip_preflight
+    preflight.PREFLIGHT.cache_ttl = args.preflight_ttl
+    try:
+        preflight.PREFLIGHT.run(
+            resolver=None if args.no_validate else resolver,
+            project_names=_preflight_projects(args))
+    except exception.ProjectCheckFailed as e:
+        print(e)
+        return 1
+
+    if args.daemon:
+        return _run_daemon(args, resolver)
+    if args.manifest:
+        return _run_manifest(args, resolver)
+
+    context = _get_context(args, resolver,
+                           args.target_user, args.target_project)
+
+    if args.apply_plan:
+        from oschown import workflows
+
+        return 0 if workflows.workflow_plan(context, args.apply_plan) else 1
+    elif args.root_resource and args.root_id:
         workflow = WORKFLOW_TYPES.get(args.root_resource)
         if not workflow:
             print('No workflow for %s' % args.root_resource)
             return 1
-        workflow(context, args.root_id)
+        return 0 if workflow(context, args.root_id) else 1
     elif args.all_resources_for_project:
-        # FIXME(danms): Go through all the workflows, collecting
-        # resources by project id
-        print('Not implemented')
+        from oschown import workflows
+
+        source_project_id = args.all_resources_for_project
+        if not args.no_validate:
+            with stats.STATS.phase('keystone'):
+                source_project_id = resolver.resolve_project(
+                    source_project_id)
+        if args.estimate:
+            print(json.dumps(workflows.workflow_estimate(context,
+                                                         source_project_id),
+                             indent=2, sort_keys=True))
+            return 0
+        if workflows.workflow_project(context, source_project_id):
+            return 0
+        return 1
     else:
-        print('Use either --root-resource and --root-id or '
-              '--all_resources_for_project')
+        print('Use either --root-resource and --root-id, '
+              '--all_resources_for_project, --apply-plan or --manifest')
+        return 1
 
 
 if __name__ == '__main__':
@@ -0,0 +1,84 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import csv
+import json
+
+from oschown import exception
+
+FIELDS = ('root_resource', 'root_id', 'target_user', 'target_project')
+
+
+def _parse_json_lines(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError as e:
+            raise exception.InvalidManifest('Line %i: %s' % (number, e))
+        if not isinstance(entry, dict):
+            raise exception.InvalidManifest(
+                'Line %i: expected an object' % number)
+        yield entry
+
+
+def _parse_csv(lines):
+    rows = [row for row in csv.reader(lines) if row]
+    if rows and rows[0][0].strip() == FIELDS[0]:
+        header = [field.strip() for field in rows.pop(0)]
+    else:
+        header = FIELDS
+    for row in rows:
+        yield dict(zip(header, [value.strip() for value in row]))
+
+
+def load_manifest(path):
+    """Load a manifest of transfer jobs from @path.
+
+    The manifest is either JSON lines (one object per line) or CSV
+    (with an optional header row). Each job has a root_resource and
+    root_id, and optionally a target_user and target_project which
+    default to None.
+
+    Returns a list of dicts with the keys in FIELDS.
+    """
+
+    with open(path) as f:
+        lines = f.readlines()
+
+    first = ''.join(lines).lstrip()[:1]
+    if first == '{':
+        entries = _parse_json_lines(lines)
+    else:
+        entries = _parse_csv(lines)
+
+    return parse_jobs(entries)
+
+
+def parse_jobs(entries):
+    """Normalize an iterable of job dicts, as in a manifest.
+
+    Returns a list of dicts with the keys in FIELDS.
+    """
+
+    jobs = []
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise exception.InvalidManifest(
+                'Job %i: expected an object' % number)
+        job = {field: entry.get(field) or None for field in FIELDS}
+        if not job['root_resource'] or not job['root_id']:
+            raise exception.InvalidManifest(
+                'Job %i: root_resource and root_id are required' % number)
+        jobs.append(job)
+    return jobs
@@ -0,0 +1,67 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+"""Saved transfer plans.
+
+A plan is a JSON file recording the outcome of resolving a graph: the
+target, and for each resource its identifier, its dependencies and a
+version stamp (such as its updated_at) which is used to check that
+it has not changed before the plan is applied.
+"""
+
+import collections
+import json
+
+from oschown import exception
+
+PLAN_FORMAT = 1
+
+
+def save_plan(path, context, collection):
+    """Write the resolved resources in @collection to @path."""
+
+    resources = [[resource.identifier, resource.version,
+                  list(collections.OrderedDict.fromkeys(
+                      resource.dependencies))]
+                 for resource in collection.resolved_resources]
+    plan = {'format': PLAN_FORMAT,
+            'target_user_id': context.target_user_id,
+            'target_project_id': context.target_project_id,
+            'resources': resources}
+    with open(path, 'w') as f:
+        json.dump(plan, f, separators=(',', ':'))
+
+
+def load_plan(path, context):
+    """Load a plan from @path for use with @context.
+
+    Returns a dict of resource identifier: (version, dependencies).
+
+    :raises: exception.InvalidPlan if the plan cannot be used
+    """
+
+    try:
+        with open(path) as f:
+            plan = json.load(f)
+    except (IOError, ValueError) as e:
+        raise exception.InvalidPlan('Unable to load plan %s: %s' % (path, e))
+
+    if not isinstance(plan, dict) or plan.get('format') != PLAN_FORMAT:
+        raise exception.InvalidPlan('Plan %s has an unknown format' % path)
+    target = (plan['target_user_id'], plan['target_project_id'])
+    if target != (context.target_user_id, context.target_project_id):
+        raise exception.InvalidPlan(
+            'Plan %s is for a different target user/project (%s/%s)' % (
+                path, target[0], target[1]))
+
+    return {identifier: (version, deps)
+            for identifier, version, deps in plan['resources']}
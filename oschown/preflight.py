@@ -0,0 +1,113 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+from concurrent import futures
+import functools
+import logging
+import threading
+import time
+
+from oschown import exception
+from oschown import projects
+from oschown import stats
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CACHE_TTL = 60
+
+
+class Preflight(object):
+    """Checks that the projects (and keystone) are usable before a run.
+
+    All checks run at the same time, so a run with a bad database
+    password or an unreachable keystone fails in seconds, before any
+    resources are resolved. Projects reached only as dependencies are
+    checked when resolution first gets to them. Passing checks are
+    remembered for @cache_ttl seconds, so that batches run shortly
+    after each other do not repeat them.
+    """
+
+    def __init__(self, cache_ttl=DEFAULT_CACHE_TTL):
+        self.cache_ttl = cache_ttl
+        self.enabled = True
+        self._passed = {}
+        self._lock = threading.Lock()
+
+    def _is_cached(self, name):
+        with self._lock:
+            passed = self._passed.get(name)
+        return passed is not None and time.time() - passed < self.cache_ttl
+
+    def _run_checks(self, checks, failures):
+        with stats.STATS.phase('preflight'):
+            with futures.ThreadPoolExecutor(max_workers=len(checks)) as pool:
+                fs = {pool.submit(check): name
+                      for name, check in checks.items()}
+                for future in futures.as_completed(fs):
+                    name = fs[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        LOG.error('Pre-flight check for %s failed: %s' % (
+                            name, e))
+                        failures.append('%s: %s' % (name, e))
+                    else:
+                        LOG.info('Pre-flight check for %s passed' % name)
+                        with self._lock:
+                            self._passed[name] = time.time()
+
+    def run(self, context=None, resolver=None, project_names=None):
+        """Run the checks for @project_names (or all known projects).
+
+        Only the projects a run can touch should be named, so that the
+        rest are not loaded. Without @project_names, projects that
+        cannot be loaded are skipped with a warning rather than failing
+        the checks. Keystone is checked too if an identity @resolver is
+        given.
+
+        :raises: exception.ProjectCheckFailed listing every failed check
+        """
+        if not self.enabled:
+            return
+
+        required = project_names is not None
+        if not required:
+            project_names = projects.PROJECTS.names
+        checks = {}
+        failures = []
+        for name in project_names:
+            if self._is_cached(name):
+                continue
+            # NOTE: Load the project here, since loading it in a worker
+            # would patch the global config under the others.
+            try:
+                project = projects.PROJECTS[name]
+            except Exception as e:
+                if not required:
+                    LOG.warning('Skipping checks for project %s, which '
+                                'cannot be loaded: %s' % (name, e))
+                    continue
+                LOG.error('Unable to load project %s: %s' % (name, e))
+                failures.append('%s: %s' % (name, e))
+                continue
+            checks[name] = functools.partial(project.check, context)
+        if resolver is not None and not self._is_cached('keystone'):
+            checks['keystone'] = resolver.check
+        if checks:
+            self._run_checks(checks, failures)
+
+        if failures:
+            raise exception.ProjectCheckFailed(
+                'Pre-flight checks failed: %s' % '; '.join(sorted(failures)))
+
+
+PREFLIGHT = Preflight()
@@ -0,0 +1,168 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import collections
+import json
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 5.0
+
+
+class Progress(object):
+    """Progress of the resolve and chown phases, reported periodically.
+
+    The workflows report the resources waiting in each phase with
+    set_queue() and those done with add_done(). Once start() is called,
+    a background thread writes a JSON event line with the totals, the
+    rate over the last interval, the queue depth per project and an
+    estimated time to completion every @interval seconds, rather than
+    once per resource. Nothing is recorded until then.
+
+    When moving a whole project, set_totals() gives the number of
+    resources expected in the run. The queue is then what is left of
+    those rather than of the current collection, and the estimated
+    time to completion is taken from how fast the chown has gone so
+    far over the whole run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stream = None
+        self._phase = None
+        self._queue = {}
+        self._done = collections.OrderedDict()
+        self._started = None
+        self._last_event = None
+        self._recent = collections.Counter()
+        self._totals = {}
+        self._totals_started = None
+        self._totals_base = {}
+
+    @property
+    def active(self):
+        return self._thread is not None
+
+    def set_queue(self, phase, queue):
+        """Make @phase current, with a dict of project: resources waiting."""
+        if not self.active:
+            return
+        with self._lock:
+            self._phase = phase
+            self._queue = dict(queue)
+            self._done.setdefault(phase, collections.Counter())
+
+    def set_totals(self, totals):
+        """Expect a dict of project: resources in the whole run.
+
+        An empty dict goes back to reporting on each collection.
+        """
+        if not self.active:
+            return
+        with self._lock:
+            self._totals = dict(totals)
+            self._totals_started = time.time()
+            self._totals_base = {phase: collections.Counter(counts)
+                                 for phase, counts in self._done.items()}
+
+    def _done_in_run(self, phase):
+        return (self._done.get(phase, collections.Counter()) -
+                self._totals_base.get(phase, collections.Counter()))
+
+    def add_done(self, phase, project, count=1):
+        """Count @count resources of @project as done with @phase."""
+        if not self.active:
+            return
+        with self._lock:
+            self._done.setdefault(phase, collections.Counter())[
+                project] += count
+            self._recent[phase] += count
+            if phase == self._phase:
+                if project in self._queue:
+                    self._queue[project] = max(0,
+                                               self._queue[project] - count)
+
+    def event(self):
+        """Return the current progress as a dict."""
+        with self._lock:
+            now = time.time()
+            rate = self._recent[self._phase] / max(now - self._last_event,
+                                                   1e-6)
+            self._last_event = now
+            self._recent.clear()
+            queue = dict(self._queue)
+            if self._totals:
+                done = self._done_in_run(self._phase)
+                queue.update({project: max(0, total - done.get(project, 0))
+                              for project, total in self._totals.items()})
+                eta = self._eta(now)
+            else:
+                queued = sum(queue.values())
+                eta = queued / rate if rate else None
+            return {
+                'time': now,
+                'elapsed': now - self._started,
+                'phase': self._phase,
+                'done': {phase: dict(counts)
+                         for phase, counts in self._done.items()},
+                'queue': queue,
+                'rate': rate,
+                'eta': eta,
+            }
+
+    def _eta(self, now):
+        chowned = self._done_in_run('chown')
+        done = sum(min(chowned[project], total)
+                   for project, total in self._totals.items())
+        if not done:
+            return None
+        remaining = sum(self._totals.values()) - done
+        return (now - self._totals_started) * remaining / done
+
+    def _emit(self):
+        try:
+            self._stream.write(json.dumps(self.event(), sort_keys=True))
+            self._stream.write('\n')
+            self._stream.flush()
+        except (IOError, OSError, ValueError) as e:
+            LOG.warning('Unable to write progress: %s' % e)
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self._emit()
+
+    def start(self, stream, interval=DEFAULT_INTERVAL):
+        """Write progress events to the file object @stream."""
+        self._stream = stream
+        self._started = self._last_event = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        name='oschown-progress')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop reporting, after writing one last event."""
+        if not self.active:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._emit()
+        self._thread = None
+
+
+PROGRESS = Progress()
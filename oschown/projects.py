@@ -0,0 +1,128 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import importlib
+import logging
+import threading
+import time
+
+import mock
+import oslo_config.cfg
+
+from oschown import base
+from oschown import exception
+from oschown import stats
+
+LOG = logging.getLogger(__name__)
+
+ENTRY_POINT_NAMESPACE = 'oschown.projects'
+
+# NOTE: These are also registered as entry points, but are listed here
+# so that the in-tree projects can be found without scanning the
+# installed distributions (which is slow) or installing oschown.
+BUILTIN_PROJECTS = {
+    'cinder': 'oschown.chown_cinder:CinderProject',
+    'nova': 'oschown.chown_nova:NovaProject',
+    'neutron': 'oschown.chown_neutron:NeutronProject',
+}
+
+
+def _find_entry_points():
+    import pkg_resources
+
+    return {ep.name: '%s:%s' % (ep.module_name, '.'.join(ep.attrs))
+            for ep in pkg_resources.iter_entry_points(ENTRY_POINT_NAMESPACE)}
+
+
+class ProjectRegistry(object):
+    """A lazily-loaded set of chown'able projects, by name.
+
+    The module for a project is only imported (and the project
+    instantiated) the first time it is looked up. Since these modules
+    pull in all of nova, cinder, etc, this means we only pay that cost
+    for the projects that a given graph actually touches.
+    """
+
+    def __init__(self):
+        self._specs = dict(BUILTIN_PROJECTS)
+        self._scanned = False
+        self._projects = {}
+        self._lock = threading.Lock()
+        self.load_times = {}
+        self.connections = {}
+
+    def _scan(self):
+        if not self._scanned:
+            for name, spec in _find_entry_points().items():
+                self._specs.setdefault(name, spec)
+            self._scanned = True
+
+    @property
+    def names(self):
+        """All known project names."""
+        self._scan()
+        return sorted(self._specs)
+
+    @property
+    def loaded(self):
+        """A dict of the projects that have been loaded so far."""
+        return dict(self._projects)
+
+    def __contains__(self, name):
+        if name not in self._specs:
+            self._scan()
+        return name in self._specs
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise exception.UnknownResourceType(name)
+        with self._lock:
+            if name not in self._projects:
+                self._projects[name] = self._load(name)
+        return self._projects[name]
+
+    def configure_databases(self, name, connections):
+        """Point project @name at other databases, and remember that.
+
+        @connections is as for ChownableProject.configure_databases().
+        The overrides are kept in @connections, so that they can be
+        applied in other processes as the project is loaded there.
+        """
+        self.connections[name] = dict(connections)
+        self[name].configure_databases(connections)
+
+    def items(self):
+        return [(name, self[name]) for name in self.names]
+
+    def _load(self, name):
+        module_name, class_name = self._specs[name].split(':', 1)
+        start = time.time()
+        # NOTE(danms): This is a crazy hack to import these project
+        # modules but with separated global oslo.config objects.
+        # Hopefully I can replace this with something that isn't quite
+        # as crazy (and at least doesn't use mock), but this works for
+        # testing.
+        conf = oslo_config.cfg.ConfigOpts()
+        with mock.patch('oslo_config.cfg.CONF', new=conf):
+            module = importlib.import_module(module_name)
+            project = getattr(module, class_name)()
+            if name in self.connections:
+                project.configure_databases(self.connections[name])
+        self.load_times[name] = time.time() - start
+        LOG.info('Loaded %s project in %.2fs' % (
+            name, self.load_times[name]))
+        stats.STATS.add_phase('load:%s' % name, self.load_times[name])
+        base.watch_engines(project.get_engines())
+        return project
+
+
+PROJECTS = ProjectRegistry()
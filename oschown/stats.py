@@ -0,0 +1,109 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+_QUERY_START = 'oschown_query_start'
+
+
+class Stats(object):
+    """Wall time per phase and SQL statements per database for a run.
+
+    Phases are always timed, since that is cheap. Statements are only
+    counted once @enabled is set, for the engines passed to
+    watch_engines() after that.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._phases = collections.OrderedDict()
+        self._queries = collections.OrderedDict()
+        self._engines = set()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._phases.clear()
+            self._queries.clear()
+
+    def _add(self, table, name, elapsed):
+        with self._lock:
+            entry = table.setdefault(name, {'count': 0, 'time': 0.0})
+            entry['count'] += 1
+            entry['time'] += elapsed
+
+    def add_phase(self, name, elapsed):
+        self._add(self._phases, name, elapsed)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the wrapped block as (another run of) phase @name."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.time() - start)
+
+    def watch_engines(self, engines):
+        """Count statements run by a dict of name: SQLAlchemy engine."""
+        if not self.enabled:
+            return
+
+        from sqlalchemy import event
+
+        for name, engine in engines.items():
+            if id(engine) in self._engines:
+                continue
+            self._engines.add(id(engine))
+            LOG.debug('Counting statements for %s database' % name)
+
+            def before(conn, cursor, statement, parameters, context,
+                       executemany):
+                conn.info.setdefault(_QUERY_START, []).append(time.time())
+
+            def after(conn, cursor, statement, parameters, context,
+                      executemany, name=name):
+                start = conn.info[_QUERY_START].pop()
+                self._add(self._queries, name, time.time() - start)
+
+            event.listen(engine, 'before_cursor_execute', before)
+            event.listen(engine, 'after_cursor_execute', after)
+
+    def merge(self, summary):
+        """Add the counts and times from another Stats' summary()."""
+        for table, entries in ((self._phases, summary['phases']),
+                               (self._queries, summary['queries'])):
+            with self._lock:
+                for name, other in entries.items():
+                    entry = table.setdefault(name, {'count': 0, 'time': 0.0})
+                    entry['count'] += other['count']
+                    entry['time'] += other['time']
+
+    def summary(self):
+        """Return a dict summary suitable for dumping as JSON."""
+        with self._lock:
+            return {
+                'phases': {name: dict(entry)
+                           for name, entry in self._phases.items()},
+                'queries': {name: dict(entry)
+                            for name, entry in self._queries.items()},
+            }
+
+
+STATS = Stats()
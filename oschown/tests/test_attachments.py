@@ -0,0 +1,53 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import unittest
+
+from oschown import attachments
+
+
+class TestAttachmentIndex(unittest.TestCase):
+    def setUp(self):
+        super(TestAttachmentIndex, self).setUp()
+        self.index = attachments.AttachmentIndex()
+
+    def test_empty(self):
+        self.assertEqual(0, len(self.index))
+        self.assertEqual(({}, ['i1']), self.index.volumes_by_instance(['i1']))
+        self.assertEqual(({}, ['v1']), self.index.instances_by_volume(['v1']))
+
+    def test_instances(self):
+        self.index.add_instances([('i1', 'v2'), ('i1', 'v1'), ('i2', None)])
+        self.assertEqual(2, len(self.index))
+        self.assertEqual(({'i1': ['v1', 'v2'], 'i2': []}, ['i3']),
+                         self.index.volumes_by_instance(['i1', 'i2', 'i3']))
+        # NOTE: The volumes themselves were not scanned, so other
+        # instances may be attached to them.
+        self.assertEqual(({}, ['v1']), self.index.instances_by_volume(['v1']))
+
+    def test_volumes(self):
+        self.index.add_volumes([('v1', 'i1'), ('v1', 'i2'), ('v2', None)])
+        self.assertEqual(({'v1': ['i1', 'i2'], 'v2': []}, []),
+                         self.index.instances_by_volume(['v1', 'v2']))
+        self.assertEqual(({}, ['i1']), self.index.volumes_by_instance(['i1']))
+
+    def test_both_sides(self):
+        # NOTE: A volume of another project attached to one of ours is
+        # only seen from the instance side, and vice versa.
+        self.index.add_instances([('i1', 'v1'), ('i1', 'v-other')])
+        self.index.add_volumes([('v1', 'i1'), ('v2', 'i-other')])
+        self.assertEqual(3, len(self.index))
+        self.assertEqual(({'i1': ['v-other', 'v1']}, ['i-other']),
+                         self.index.volumes_by_instance(['i1', 'i-other']))
+        self.assertEqual(({'v1': ['i1'], 'v2': ['i-other']}, ['v-other']),
+                         self.index.instances_by_volume(
+                             ['v1', 'v2', 'v-other']))
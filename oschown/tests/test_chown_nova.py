@@ -0,0 +1,72 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import unittest
+
+import mock
+
+from oschown import base
+from oschown import chown_nova
+
+
+class TestPortIds(unittest.TestCase):
+    def test_port_ids(self):
+        self.assertEqual(['port1', 'port2'], chown_nova._port_ids(
+            '[{"id": "port1", "address": "fa:16:3e:00:00:01"}, '
+            '{"id": "port2"}]'))
+
+    def test_port_ids_empty(self):
+        for network_info in (None, '', '[]', 'null'):
+            self.assertEqual([], chown_nova._port_ids(network_info))
+
+
+class TestNovaProject(unittest.TestCase):
+    def setUp(self):
+        super(TestNovaProject, self).setUp()
+        # NOTE: Skip NovaProject.__init__, which parses nova's config.
+        self.project = chown_nova.NovaProject.__new__(chown_nova.NovaProject)
+        base.ChownableProject.__init__(self.project)
+        self.project._local.admin_context = mock.sentinel.admin_context
+        self.cells = [mock.Mock(uuid='cell1'), mock.Mock(uuid='cell2')]
+        self.project._cells = list(self.cells)
+        self.instances = {self.cells[0]: ['a', 'b', 'c'],
+                          self.cells[1]: ['d']}
+
+        def _scatter_gather(timeout, cells, fn, *args):
+            return {cell: fn(mock.sentinel.cctx, cell, *args)
+                    for cell in cells}
+
+        def _list_instance_uuids(cctx, cell, project_id, limit, markers):
+            uuids = self.instances[cell]
+            start = 0
+            if markers[cell] is not None:
+                start = uuids.index(markers[cell]) + 1
+            return uuids[start:start + limit]
+
+        self.project._scatter_gather = _scatter_gather
+        self.project._list_instance_uuids = _list_instance_uuids
+
+    def test_iter_resource_ids_by_owner(self):
+        context = base.ChownContext('user', 'project', page_size=2)
+        pages = list(self.project.iter_resource_ids_by_owner(context,
+                                                             'source'))
+        self.assertEqual([['a', 'b'], ['d'], ['c']], pages)
+
+    def test_iter_resource_ids_by_owner_twice(self):
+        context = base.ChownContext('user', 'project', page_size=2)
+        first = list(self.project.iter_resource_ids_by_owner(context,
+                                                             'source'))
+        second = list(self.project.iter_resource_ids_by_owner(context,
+                                                              'source'))
+        self.assertEqual(first, second)
+        self.assertEqual(self.cells,
+                         self.project._get_cells(mock.sentinel.ctx))
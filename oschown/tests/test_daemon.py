@@ -0,0 +1,80 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from oschown import daemon
+from oschown import exception
+
+
+class TestDaemonServer(unittest.TestCase):
+    def setUp(self):
+        super(TestDaemonServer, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'oschown.sock')
+
+    def _run_jobs(self, jobs, dry_run):
+        return [{'job': index, 'dry_run': dry_run}
+                for index, job in enumerate(jobs)]
+
+    def _start(self):
+        server = daemon.DaemonServer(self.path, self._run_jobs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def _stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+        self.addCleanup(_stop)
+        return server
+
+    def test_submit(self):
+        self._start()
+        reply = daemon.submit(self.path, [{'root_resource': 'nova',
+                                           'root_id': 'i1'}], dry_run=True)
+        self.assertEqual([{'job': 0, 'dry_run': True}], reply['results'])
+
+    def test_invalid_request(self):
+        self._start()
+        reply = daemon.submit(self.path, [{'root_resource': 'nova'}])
+        self.assertIn('Invalid request', reply['error'])
+
+    def test_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        self._start()
+        reply = daemon.submit(self.path, [])
+        self.assertEqual([], reply['results'])
+
+    def test_running(self):
+        self._start()
+        self.assertRaisesRegex(exception.SocketInUse, 'already accepting',
+                               daemon.DaemonServer, self.path,
+                               self._run_jobs)
+        # NOTE: The first daemon still has its socket.
+        self.assertEqual([], daemon.submit(self.path, [])['results'])
+
+    def test_not_socket(self):
+        with open(self.path, 'w') as f:
+            f.write('keep me')
+        self.assertRaisesRegex(exception.SocketInUse, 'not a socket',
+                               daemon.check_socket, self.path)
+        self.assertTrue(os.path.exists(self.path))
@@ -0,0 +1,92 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import unittest
+
+from oschown import graph
+
+
+def _make_graph(edges, nodes=()):
+    resource_graph = graph.ResourceGraph()
+    for node in nodes:
+        resource_graph.add_node(node)
+    for node, dep in edges:
+        resource_graph.add_edge(node, dep)
+    return resource_graph
+
+
+class TestResourceGraph(unittest.TestCase):
+    def test_add_edge(self):
+        resource_graph = graph.ResourceGraph()
+        self.assertTrue(resource_graph.add_edge('a', 'b'))
+        self.assertFalse(resource_graph.add_edge('a', 'b'))
+        self.assertEqual(['a', 'b'], resource_graph.nodes)
+        self.assertEqual(1, resource_graph.edge_count)
+        self.assertEqual(['b'], resource_graph.dependencies('a'))
+        self.assertEqual(['a'], resource_graph.dependents('b'))
+        self.assertIn('b', resource_graph)
+        self.assertNotIn('c', resource_graph)
+
+    def test_connected_components(self):
+        resource_graph = _make_graph([('a', 'b'), ('c', 'b'), ('d', 'e')],
+                                     nodes=['f'])
+        self.assertEqual([['f'], ['a', 'b', 'c'], ['d', 'e']],
+                         resource_graph.connected_components())
+
+    def test_scc_acyclic(self):
+        resource_graph = _make_graph([('a', 'b'), ('b', 'c'), ('a', 'c')])
+        self.assertEqual([['c'], ['b'], ['a']],
+                         resource_graph.strongly_connected_components())
+
+    def test_scc_cycle(self):
+        # NOTE: An instance and its attached volume depend on each other,
+        # and both depend on the volume's snapshot.
+        resource_graph = _make_graph([('nova:i', 'cinder:v'),
+                                      ('cinder:v', 'nova:i'),
+                                      ('cinder:v', 'cinder:s')])
+        components = resource_graph.strongly_connected_components()
+        self.assertEqual([['cinder:s'], ['cinder:v', 'nova:i']],
+                         [sorted(component) for component in components])
+
+    def test_scc_nested_cycles(self):
+        resource_graph = _make_graph([('a', 'b'), ('b', 'c'), ('c', 'a'),
+                                      ('c', 'd'), ('d', 'e'), ('e', 'd'),
+                                      ('f', 'a')])
+        components = resource_graph.strongly_connected_components()
+        self.assertEqual([['d', 'e'], ['a', 'b', 'c'], ['f']],
+                         [sorted(component) for component in components])
+
+    def test_scc_self_loop(self):
+        resource_graph = _make_graph([('a', 'a'), ('a', 'b')])
+        self.assertEqual([['b'], ['a']],
+                         resource_graph.strongly_connected_components())
+
+    def test_scc_deep(self):
+        # NOTE: Deeper than the default recursion limit.
+        edges = [(i, i + 1) for i in range(5000)] + [(5000, 0)]
+        resource_graph = _make_graph(edges)
+        components = resource_graph.strongly_connected_components()
+        self.assertEqual(1, len(components))
+        self.assertEqual(list(range(5001)), sorted(components[0]))
+
+    def test_topological_order(self):
+        resource_graph = _make_graph([('a', 'b'), ('b', 'c'), ('c', 'b'),
+                                      ('c', 'd'), ('e', 'a')])
+        order = resource_graph.topological_order()
+        self.assertEqual(sorted(resource_graph.nodes), sorted(order))
+        for node in resource_graph.nodes:
+            for dep in resource_graph.dependencies(node):
+                if node not in resource_graph.dependencies(dep):
+                    self.assertLess(order.index(dep), order.index(node))
+        self.assertEqual('d', order[0])
+        self.assertEqual(['b', 'c'], sorted(order[1:3]))
+        self.assertEqual(['a', 'e'], order[3:])
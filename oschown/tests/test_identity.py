@@ -0,0 +1,95 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import keystoneauth1.exceptions.http
+import mock
+
+from oschown import identity
+
+
+@mock.patch('time.time', return_value=1000.0)
+class TestIdentityResolver(unittest.TestCase):
+    def setUp(self):
+        super(TestIdentityResolver, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cache_file = os.path.join(self.tmpdir, 'cache', 'identity.json')
+        self.manager = mock.Mock()
+        self.manager.find.return_value = mock.Mock(id='project-id')
+
+    def _resolver(self, **kwargs):
+        resolver = identity.IdentityResolver(cache_file=self.cache_file,
+                                             cache_ttl=60, **kwargs)
+        resolver._keystone = mock.Mock(projects=self.manager)
+        return resolver
+
+    def test_by_name(self, mock_time):
+        self.assertEqual('project-id',
+                         self._resolver().resolve_project('demo'))
+        self.manager.find.assert_called_once_with(name='demo')
+
+    def test_by_id(self, mock_time):
+        self.manager.find.side_effect = [
+            keystoneauth1.exceptions.http.NotFound(),
+            mock.Mock(id='project-id')]
+        self.assertEqual('project-id',
+                         self._resolver().resolve_project('project-id'))
+        self.manager.find.assert_called_with(id='project-id')
+
+    def test_cached(self, mock_time):
+        self._resolver().resolve_project('demo')
+        mock_time.return_value = 1059.0
+        # NOTE: A new resolver reads the cache saved by the first.
+        self.assertEqual('project-id',
+                         self._resolver().resolve_project('demo'))
+        self.assertEqual(1, self.manager.find.call_count)
+        self.assertEqual(0o600, os.stat(self.cache_file).st_mode & 0o777)
+
+    def test_expired(self, mock_time):
+        self._resolver().resolve_project('demo')
+        mock_time.return_value = 1060.0
+        self.manager.find.return_value = mock.Mock(id='new-id')
+        self.assertEqual('new-id', self._resolver().resolve_project('demo'))
+        self.assertEqual(2, self.manager.find.call_count)
+
+    def test_bypass(self, mock_time):
+        self._resolver().resolve_project('demo')
+        self.manager.find.return_value = mock.Mock(id='new-id')
+        resolver = self._resolver(use_cache=False)
+        self.assertEqual('new-id', resolver.resolve_project('demo'))
+        self.assertEqual(2, self.manager.find.call_count)
+        # NOTE: Bypassing the cache does not update it either.
+        with open(self.cache_file) as f:
+            cache = json.load(f)
+        self.assertEqual([['project-id', 1000.0]],
+                         [entry for url in cache.values()
+                          for entry in url['projects'].values()])
+
+    def test_per_auth_url(self, mock_time):
+        with mock.patch.dict(os.environ, {'OS_AUTH_URL': 'http://a'}):
+            self._resolver().resolve_project('demo')
+        with mock.patch.dict(os.environ, {'OS_AUTH_URL': 'http://b'}):
+            self._resolver().resolve_project('demo')
+        self.assertEqual(2, self.manager.find.call_count)
+
+    def test_unwritable_cache(self, mock_time):
+        self.cache_file = os.path.join(self.tmpdir, 'file', 'identity.json')
+        with open(os.path.join(self.tmpdir, 'file'), 'w'):
+            pass
+        self.assertEqual('project-id',
+                         self._resolver().resolve_project('demo'))
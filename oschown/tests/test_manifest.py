@@ -0,0 +1,109 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from oschown import exception
+from oschown import manifest
+
+
+class TestLoadManifest(unittest.TestCase):
+    def setUp(self):
+        super(TestLoadManifest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _load(self, content):
+        path = os.path.join(self.tmpdir, 'manifest')
+        with open(path, 'w') as f:
+            f.write(content)
+        return manifest.load_manifest(path)
+
+    def test_json_lines(self):
+        jobs = self._load(
+            '{"root_resource": "nova", "root_id": "i1", '
+            '"target_user": "u", "target_project": "p"}\n'
+            '\n'
+            '{"root_resource": "cinder", "root_id": "v1"}\n')
+        self.assertEqual([
+            {'root_resource': 'nova', 'root_id': 'i1',
+             'target_user': 'u', 'target_project': 'p'},
+            {'root_resource': 'cinder', 'root_id': 'v1',
+             'target_user': None, 'target_project': None},
+        ], jobs)
+
+    def test_json_lines_invalid(self):
+        self.assertRaisesRegex(
+            exception.InvalidManifest, 'Line 2',
+            self._load,
+            '{"root_resource": "nova", "root_id": "i1"}\n'
+            '{"root_resource": \n')
+
+    def test_json_lines_not_object(self):
+        self.assertRaisesRegex(
+            exception.InvalidManifest, 'Line 2: expected an object',
+            self._load,
+            '{"root_resource": "nova", "root_id": "i1"}\n'
+            '["nova", "i2"]\n')
+
+    def test_json_lines_missing_id(self):
+        self.assertRaisesRegex(
+            exception.InvalidManifest,
+            'Job 2: root_resource and root_id are required',
+            self._load,
+            '{"root_resource": "nova", "root_id": "i1"}\n'
+            '{"root_resource": "nova", "root_id": ""}\n')
+
+    def test_csv(self):
+        jobs = self._load('nova, i1, u, p\n'
+                          '\n'
+                          'cinder,v1\n')
+        self.assertEqual([
+            {'root_resource': 'nova', 'root_id': 'i1',
+             'target_user': 'u', 'target_project': 'p'},
+            {'root_resource': 'cinder', 'root_id': 'v1',
+             'target_user': None, 'target_project': None},
+        ], jobs)
+
+    def test_csv_header(self):
+        jobs = self._load('root_resource,target_project,root_id\n'
+                          'nova,p,i1\n')
+        self.assertEqual([
+            {'root_resource': 'nova', 'root_id': 'i1',
+             'target_user': None, 'target_project': 'p'},
+        ], jobs)
+
+    def test_csv_missing_id(self):
+        self.assertRaisesRegex(
+            exception.InvalidManifest,
+            'Job 2: root_resource and root_id are required',
+            self._load, 'nova,i1\ncinder\n')
+
+    def test_empty(self):
+        self.assertEqual([], self._load(''))
+
+
+class TestParseJobs(unittest.TestCase):
+    def test_parse_jobs(self):
+        self.assertEqual(
+            [{'root_resource': 'nova', 'root_id': 'i1',
+              'target_user': None, 'target_project': None}],
+            manifest.parse_jobs([{'root_resource': 'nova', 'root_id': 'i1',
+                                  'unknown': 'ignored'}]))
+
+    def test_parse_jobs_not_object(self):
+        self.assertRaisesRegex(
+            exception.InvalidManifest, 'Job 1: expected an object',
+            manifest.parse_jobs, ['nova:i1'])
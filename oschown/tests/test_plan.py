@@ -0,0 +1,151 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from oschown import base
+from oschown import exception
+from oschown import plan
+from oschown import preflight
+from oschown import workflows
+
+
+class FakeResource(base.ChownableResource):
+    def __init__(self, identifier, version, dependencies=()):
+        self._identifier = identifier
+        self._version = version
+        self._dependencies = list(dependencies)
+
+    @property
+    def identifier(self):
+        return self._identifier
+
+    @property
+    def dependencies(self):
+        return self._dependencies
+
+    @property
+    def version(self):
+        return self._version
+
+
+class FakeProject(base.ChownableProject):
+    def __init__(self, versions, extra=()):
+        super(FakeProject, self).__init__()
+        self.versions = versions
+        self.extra = list(extra)
+
+    def collect_resources_by_ids(self, context, resource_ids):
+        return {resource_id: FakeResource('fake:%s' % resource_id,
+                                          self.versions[resource_id])
+                for resource_id in list(resource_ids) + self.extra}
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        super(TestPlan, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'plan.json')
+        self.context = base.ChownContext('user', 'project')
+        self.collection = mock.Mock(resolved_resources=[
+            FakeResource('fake:a', 'v1', ['fake:b', 'fake:b']),
+            FakeResource('fake:b', None),
+        ])
+
+    def _write(self, content):
+        with open(self.path, 'w') as f:
+            json.dump(content, f)
+
+    def test_round_trip(self):
+        plan.save_plan(self.path, self.context, self.collection)
+        self.assertEqual({'fake:a': ('v1', ['fake:b']),
+                          'fake:b': (None, [])},
+                         plan.load_plan(self.path, self.context))
+
+    def test_other_target(self):
+        plan.save_plan(self.path, self.context, self.collection)
+        context = base.ChownContext('user', 'other')
+        self.assertRaisesRegex(exception.InvalidPlan,
+                               'different target user/project',
+                               plan.load_plan, self.path, context)
+
+    def test_unknown_format(self):
+        self._write({'format': plan.PLAN_FORMAT + 1,
+                     'target_user_id': 'user',
+                     'target_project_id': 'project',
+                     'resources': []})
+        self.assertRaisesRegex(exception.InvalidPlan, 'unknown format',
+                               plan.load_plan, self.path, self.context)
+
+    def test_not_json(self):
+        with open(self.path, 'w') as f:
+            f.write('{"format": ')
+        self.assertRaisesRegex(exception.InvalidPlan, 'Unable to load plan',
+                               plan.load_plan, self.path, self.context)
+
+    def test_missing_file(self):
+        self.assertRaisesRegex(exception.InvalidPlan, 'Unable to load plan',
+                               plan.load_plan,
+                               os.path.join(self.tmpdir, 'missing.json'),
+                               self.context)
+
+
+@mock.patch.object(preflight.PREFLIGHT, 'enabled', False)
+class TestResolvePlannedResources(unittest.TestCase):
+    def setUp(self):
+        super(TestResolvePlannedResources, self).setUp()
+        self.project = FakeProject({'a': 'v1', 'b': 'v2'})
+        patcher = mock.patch.object(workflows.ResourceCollection,
+                                    'RESOURCE_TYPES',
+                                    {'fake': self.project})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.collection = workflows.ResourceCollection(
+            base.ChownContext('user', 'project'))
+
+    def test_resolve(self):
+        self.collection.resolve_planned_resources({
+            'fake:a': ('v1', ['fake:b']),
+            'fake:b': ('v2', [])})
+        self.assertTrue(self.collection.have_all_resources)
+        self.assertEqual(['fake:a', 'fake:b'], sorted(
+            r.identifier for r in self.collection.resolved_resources))
+        self.assertEqual(['fake:b'],
+                         self.collection.graph.dependencies('fake:a'))
+
+    def test_changed(self):
+        self.assertRaisesRegex(exception.PlanOutOfDate,
+                               'resources a have changed',
+                               self.collection.resolve_planned_resources,
+                               {'fake:a': ('v0', ['fake:b']),
+                                'fake:b': ('v2', [])})
+
+    def test_missing_dependency(self):
+        self.assertRaisesRegex(exception.InvalidPlan,
+                               'missing resources fake:b',
+                               self.collection.resolve_planned_resources,
+                               {'fake:a': ('v1', ['fake:b'])})
+
+    def test_appeared(self):
+        # NOTE: Like a floating IP associated with a planned port.
+        self.project.extra = ['b']
+        self.assertRaisesRegex(exception.PlanOutOfDate,
+                               'resources b have appeared',
+                               self.collection.resolve_planned_resources,
+                               {'fake:a': ('v1', [])})
@@ -0,0 +1,78 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import io
+import unittest
+
+import mock
+
+from oschown import progress
+
+
+@mock.patch('time.time')
+class TestProgress(unittest.TestCase):
+    def setUp(self):
+        super(TestProgress, self).setUp()
+        self.progress = progress.Progress()
+        # NOTE: Report as if started, without the background thread.
+        self.progress._thread = mock.Mock()
+        self.progress._stream = io.StringIO()
+        self.progress._started = self.progress._last_event = 100.0
+
+    def test_queue(self, mock_time):
+        mock_time.return_value = 110.0
+        self.progress.set_queue('resolve', {'nova': 5})
+        self.progress.add_done('resolve', 'nova', 3)
+        event = self.progress.event()
+        self.assertEqual('resolve', event['phase'])
+        self.assertEqual({'nova': 2}, event['queue'])
+        self.assertEqual(0.3, event['rate'])
+        self.assertAlmostEqual(2 / 0.3, event['eta'])
+
+    def test_rate_across_phases(self, mock_time):
+        mock_time.return_value = 110.0
+        self.progress.set_queue('resolve', {'nova': 5})
+        self.progress.add_done('resolve', 'nova', 5)
+        self.progress.set_queue('chown', {'nova': 5})
+        self.progress.add_done('chown', 'nova', 5)
+        self.progress.set_queue('resolve', {'nova': 5})
+        self.progress.add_done('resolve', 'nova', 5)
+        self.assertEqual(1.0, self.progress.event()['rate'])
+
+    def test_totals(self, mock_time):
+        mock_time.return_value = 100.0
+        self.progress.set_totals({'nova': 10, 'cinder': 10})
+        mock_time.return_value = 110.0
+        self.progress.set_queue('resolve', {'nova': 4})
+        self.progress.add_done('resolve', 'nova', 4)
+        self.progress.set_queue('chown', {'nova': 4})
+        self.progress.add_done('chown', 'nova', 4)
+        event = self.progress.event()
+        self.assertEqual({'nova': 6, 'cinder': 10}, event['queue'])
+        # NOTE: 4 of 20 chown'ed in 10 seconds leaves 16 for 40 more.
+        self.assertEqual(40.0, event['eta'])
+
+    def test_totals_ignore_earlier_runs(self, mock_time):
+        mock_time.return_value = 100.0
+        self.progress.set_queue('chown', {'nova': 4})
+        self.progress.add_done('chown', 'nova', 4)
+        self.progress.set_totals({'nova': 10})
+        event = self.progress.event()
+        self.assertEqual({'nova': 10}, event['queue'])
+        self.assertIsNone(event['eta'])
+
+    def test_inactive(self, mock_time):
+        self.progress._thread = None
+        self.progress.set_totals({'nova': 10})
+        self.progress.add_done('chown', 'nova')
+        self.assertEqual({}, self.progress._totals)
+        self.assertEqual({}, dict(self.progress._done))
@@ -0,0 +1,138 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import unittest
+
+import mock
+
+from oschown import throttle
+
+
+class TestDatabaseThrottle(unittest.TestCase):
+    def setUp(self):
+        super(TestDatabaseThrottle, self).setUp()
+        patcher = mock.patch('time.time', return_value=1000.0)
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _assert_slept(self, mock_sleep, seconds):
+        self.assertEqual(1, mock_sleep.call_count)
+        self.assertAlmostEqual(seconds, mock_sleep.call_args[0][0])
+
+    def _throttle(self, **limits):
+        values = dict.fromkeys(throttle.Limits._fields)
+        values.update(limits)
+        return throttle._DatabaseThrottle('nova', throttle.Limits(**values))
+
+    def test_backoff(self):
+        db = self._throttle(latency_threshold=0.1)
+        db.after_statement(1.0)
+        self.assertEqual(0.5, db.scale)
+        # NOTE: Only once per ADJUST_INTERVAL.
+        db.after_statement(1.0)
+        self.assertEqual(0.5, db.scale)
+        self.mock_time.return_value += throttle.ADJUST_INTERVAL
+        db.after_statement(1.0)
+        self.assertEqual(0.25, db.scale)
+
+    def test_backoff_limit(self):
+        db = self._throttle(latency_threshold=0.1)
+        for i in range(10):
+            self.mock_time.return_value += throttle.ADJUST_INTERVAL
+            db.after_statement(10.0)
+        self.assertEqual(throttle.MIN_SCALE, db.scale)
+
+    def test_recover(self):
+        db = self._throttle(latency_threshold=0.1)
+        db.scale = 0.5
+        db.latency = 0.0
+        db.after_statement(0.01)
+        self.assertEqual(0.625, db.scale)
+        for i in range(10):
+            self.mock_time.return_value += throttle.ADJUST_INTERVAL
+            db.after_statement(0.01)
+        self.assertEqual(1.0, db.scale)
+
+    def test_steady(self):
+        # NOTE: Between half the threshold and the threshold, the scale
+        # is left alone.
+        db = self._throttle(latency_threshold=0.1)
+        db.scale = 0.5
+        db.latency = 0.075
+        db.after_statement(0.075)
+        self.assertEqual(0.5, db.scale)
+
+    def test_no_threshold(self):
+        db = self._throttle(max_qps=10)
+        db.after_statement(10.0)
+        self.assertEqual(1.0, db.scale)
+        self.assertEqual(0.0, db.latency)
+
+    @mock.patch('time.sleep')
+    def test_pacing(self, mock_sleep):
+        db = self._throttle(max_qps=10)
+        conn = mock.Mock(info={})
+        db.before_statement(conn, False)
+        self.assertFalse(mock_sleep.called)
+        db.before_statement(conn, False)
+        self._assert_slept(mock_sleep, 0.1)
+
+    @mock.patch('time.sleep')
+    def test_pacing_scaled(self, mock_sleep):
+        db = self._throttle(max_tps=10)
+        db.scale = 0.5
+        db.begin()
+        db.begin()
+        self._assert_slept(mock_sleep, 0.2)
+
+    @mock.patch('time.sleep')
+    def test_idle_backoff(self, mock_sleep):
+        db = self._throttle(latency_threshold=0.1)
+        db.scale = 0.25
+        db.latency = 0.2
+        db.begin()
+        self._assert_slept(mock_sleep, 0.6)
+
+    def test_writes(self):
+        db = self._throttle(max_writes=1)
+        first = mock.Mock(info={})
+        second = mock.Mock(info={})
+        db.before_statement(first, True)
+        # NOTE: The same thread may write on a second connection
+        # without waiting for its own first one.
+        db.before_statement(second, True)
+        db.end(second)
+        self.assertFalse(db._writes.acquire(blocking=False))
+        db.end(first)
+        self.assertTrue(db._writes.acquire(blocking=False))
+
+    def test_reads_do_not_take_slot(self):
+        db = self._throttle(max_writes=1)
+        db.before_statement(mock.Mock(info={}), False)
+        self.assertTrue(db._writes.acquire(blocking=False))
+
+
+class TestThrottle(unittest.TestCase):
+    def test_divided(self):
+        limits = throttle.Throttle()
+        limits.configure(max_qps=100, max_tps=10, max_writes=3,
+                         latency_threshold=0.5)
+        self.assertEqual(throttle.Limits(25.0, 2.5, 1, 0.5),
+                         limits.divided(4))
+
+    def test_disabled(self):
+        limits = throttle.Throttle()
+        self.assertFalse(limits.enabled)
+        self.assertEqual(throttle.Limits(None, None, None, None),
+                         limits.divided(4))
+        limits.watch_engines({'nova': mock.sentinel.engine})
+        self.assertEqual({}, limits.scales())
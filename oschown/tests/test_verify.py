@@ -0,0 +1,75 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import unittest
+
+import mock
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from oschown import base
+
+
+class TestVerifyOwner(unittest.TestCase):
+    def setUp(self):
+        super(TestVerifyOwner, self).setUp()
+        metadata = sa.MetaData()
+        self.table = sa.Table(
+            'instances', metadata,
+            sa.Column('uuid', sa.String(36), primary_key=True),
+            sa.Column('project_id', sa.String(255)),
+            sa.Column('user_id', sa.String(255)))
+        engine = sa.create_engine('sqlite://')
+        metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(self.table.insert(), [
+                {'uuid': 'i1', 'project_id': 'p', 'user_id': 'u'},
+                {'uuid': 'i2', 'project_id': 'p', 'user_id': 'u'},
+                {'uuid': 'i3', 'project_id': 'old', 'user_id': 'u'},
+                {'uuid': 'i4', 'project_id': 'p', 'user_id': None},
+            ])
+        self.session = orm.Session(bind=engine)
+        self.addCleanup(self.session.close)
+        self.query = mock.Mock(side_effect=self._query)
+        self.expected = {'project_id': 'p', 'user_id': 'u'}
+
+    def _query(self, model, *entities):
+        return self.session.query(*entities)
+
+    def _verify(self, ids, batch_size=100, expect_all=False):
+        # NOTE: A table's columns are looked up by name like a model's.
+        return base.verify_owner(self.query, self.table.c, 'uuid', ids,
+                                 self.expected, batch_size,
+                                 expect_all=expect_all)
+
+    def test_all_chowned(self):
+        self.assertEqual([], self._verify(['i1', 'i2']))
+        # NOTE: Only the COUNT query is needed when nothing is wrong.
+        self.assertEqual(1, self.query.call_count)
+
+    def test_mismatched(self):
+        self.assertEqual(['i3', 'i4'], self._verify(['i1', 'i3', 'i4']))
+
+    def test_batches(self):
+        self.assertEqual(['i3'], self._verify(['i1', 'i2', 'i3'],
+                                              batch_size=2))
+        # NOTE: One COUNT per batch, and one lookup for the bad batch.
+        self.assertEqual(3, self.query.call_count)
+
+    def test_missing(self):
+        self.assertEqual([], self._verify(['i1', 'gone']))
+        self.assertEqual(['gone'], self._verify(['i1', 'gone'],
+                                                expect_all=True))
+
+    def test_empty(self):
+        self.assertEqual([], self._verify([], expect_all=True))
+        self.assertFalse(self.query.called)
@@ -0,0 +1,194 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import collections
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+_QUERY_START = 'oschown_throttle_start'
+_WRITING = 'oschown_throttle_writing'
+_WRITE_VERBS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# How far latency backoff may slow things down, and how often it may
+# change its mind
+MIN_SCALE = 1.0 / 64
+ADJUST_INTERVAL = 1.0
+
+Limits = collections.namedtuple('Limits', ['max_qps', 'max_tps',
+                                           'max_writes',
+                                           'latency_threshold'])
+
+
+class _Pacer(object):
+    """Space out events to at most @rate per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, scale):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + 1.0 / (self.rate * scale)
+        if start > now:
+            time.sleep(start - now)
+
+
+class _DatabaseThrottle(object):
+    """The limits and measured latency for one database."""
+
+    def __init__(self, name, limits):
+        self.name = name
+        self.limits = limits
+        self.scale = 1.0
+        self.latency = 0.0
+        self._adjusted = 0.0
+        self._queries = limits.max_qps and _Pacer(limits.max_qps)
+        self._transactions = limits.max_tps and _Pacer(limits.max_tps)
+        self._writes = (limits.max_writes and
+                        threading.BoundedSemaphore(limits.max_writes))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def before_statement(self, conn, is_write):
+        if self._writes and is_write and not conn.info.get(_WRITING):
+            # NOTE: A thread may hold several connections to the same
+            # database at once, so only its first write takes a slot.
+            depth = getattr(self._local, 'writing', 0)
+            if not depth:
+                self._writes.acquire()
+            self._local.writing = depth + 1
+            conn.info[_WRITING] = True
+
+        if self._queries:
+            self._queries.wait(self.scale)
+
+    def after_statement(self, elapsed):
+        threshold = self.limits.latency_threshold
+        if not threshold:
+            return
+        with self._lock:
+            self.latency = 0.8 * self.latency + 0.2 * elapsed
+            now = time.time()
+            if now - self._adjusted < ADJUST_INTERVAL:
+                return
+            if self.latency > threshold and self.scale > MIN_SCALE:
+                self.scale = max(MIN_SCALE, self.scale / 2)
+            elif self.latency < threshold / 2 and self.scale < 1.0:
+                self.scale = min(1.0, self.scale * 1.25)
+            else:
+                return
+            self._adjusted = now
+            LOG.info('Statement latency on %s database is %.3fs, '
+                     'throttling to %.0f%%' % (self.name, self.latency,
+                                               self.scale * 100))
+
+    def begin(self):
+        if self._transactions:
+            self._transactions.wait(self.scale)
+        elif self.scale < 1.0:
+            # NOTE: Without a rate to scale down, back off by leaving
+            # the database idle for a multiple of its recent latency
+            # between transactions, rather than holding locks longer.
+            time.sleep(self.latency * (1.0 / self.scale - 1.0))
+
+    def end(self, conn):
+        if conn.info.pop(_WRITING, False):
+            self._local.writing -= 1
+            if not self._local.writing:
+                self._writes.release()
+
+
+class Throttle(object):
+    """Limits on the statements run against each database.
+
+    Queries and transactions per second are capped for each database,
+    as is the number of transactions writing to it at once. If a
+    latency threshold is set, these are scaled down while the average
+    statement latency on a database stays above it, and back up once
+    it recovers. Only engines passed to watch_engines() after
+    configure() are throttled.
+    """
+
+    def __init__(self):
+        self.limits = Limits(None, None, None, None)
+        self._databases = {}
+
+    @property
+    def enabled(self):
+        return any(self.limits)
+
+    def configure(self, max_qps=None, max_tps=None, max_writes=None,
+                  latency_threshold=None):
+        """Set the limits for each database.
+
+        @latency_threshold is in seconds. Any limit left as None is not
+        enforced.
+        """
+        self.limits = Limits(max_qps, max_tps, max_writes, latency_threshold)
+
+    def divided(self, ways):
+        """Return our limits split evenly between @ways processes."""
+        return Limits(
+            self.limits.max_qps and float(self.limits.max_qps) / ways,
+            self.limits.max_tps and float(self.limits.max_tps) / ways,
+            self.limits.max_writes and max(1, self.limits.max_writes // ways),
+            self.limits.latency_threshold)
+
+    def scales(self):
+        """Return a dict of database name: current rate scale."""
+        return {name: db.scale for name, db in self._databases.items()}
+
+    def watch_engines(self, engines):
+        """Throttle statements run by a dict of name: SQLAlchemy engine."""
+        if not self.enabled:
+            return
+
+        from sqlalchemy import event
+
+        for name, engine in engines.items():
+            if name in self._databases:
+                continue
+            db = self._databases[name] = _DatabaseThrottle(name, self.limits)
+            LOG.debug('Throttling statements for %s database' % name)
+
+            def before(conn, cursor, statement, parameters, context,
+                       executemany, db=db):
+                is_write = statement.lstrip()[:7].upper().startswith(
+                    _WRITE_VERBS)
+                db.before_statement(conn, is_write)
+                conn.info.setdefault(_QUERY_START, []).append(time.time())
+
+            def after(conn, cursor, statement, parameters, context,
+                      executemany, db=db):
+                start = conn.info[_QUERY_START].pop()
+                db.after_statement(time.time() - start)
+
+            def begin(conn, db=db):
+                db.begin()
+
+            def end(conn, db=db):
+                db.end(conn)
+
+            event.listen(engine, 'before_cursor_execute', before)
+            event.listen(engine, 'after_cursor_execute', after)
+            event.listen(engine, 'begin', begin)
+            event.listen(engine, 'commit', end)
+            event.listen(engine, 'rollback', end)
+
+
+THROTTLE = Throttle()
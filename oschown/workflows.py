@@ -10,30 +10,29 @@
 #  License for the specific language governing permissions and limitations
 #  under the License.
 
+import collections
+from concurrent import futures
+import contextlib
+import copy
 import logging
-import mock
-import oslo_config.cfg
-
-nova_conf = oslo_config.cfg.ConfigOpts()
-cinder_conf = oslo_config.cfg.ConfigOpts()
-
-
-# NOTE(danms): This is a crazy hack to import these project modules
-# but with separated global oslo.config objects. Hopefully I can
-# replace this with something that isn't quite as crazy (and at least
-# doesn't use mock), but this works for testing.
-with mock.patch('oslo_config.cfg.CONF', new=cinder_conf):
-    from oschown import chown_cinder
-
-with mock.patch('oslo_config.cfg.CONF', new=nova_conf):
-    from oschown import chown_nova
-
-from oschown import chown_neutron
+import multiprocessing
 
+from oschown import attachments
+from oschown import base
 from oschown import exception
+from oschown import graph
+from oschown import plan
+from oschown import preflight
+from oschown import progress
+from oschown import projects
+from oschown import stats
+from oschown import throttle
 
 LOG = logging.getLogger(__name__)
 
+# The semaphore limiting concurrent chowns in a worker process
+_WRITERS = None
+
 
 def parse_resource_id(resource_id):
     return resource_id.split(':', 1)
@@ -45,14 +44,12 @@ class ResourceCollection(object):
     Collects resources that must be resolved and chown'ed together.
     """
 
-    RESOURCE_TYPES = {
-        'cinder': chown_cinder.CinderProject(),
-        'nova': chown_nova.NovaProject(),
-        'neutron': chown_neutron.NeutronProject(),
-    }
+    RESOURCE_TYPES = projects.PROJECTS
 
     def __init__(self, context):
         self._collected_resources = {}
+        self._unresolved = collections.OrderedDict()
+        self._graph = graph.ResourceGraph()
         self._context = context
 
     def need_resource(self, resource_id):
@@ -64,6 +61,14 @@ class ResourceCollection(object):
 
         if resource_id not in self._collected_resources:
             self._collected_resources[resource_id] = None
+            self._unresolved[resource_id] = None
+            self._graph.add_node(resource_id)
+
+    @property
+    def graph(self):
+        """The graph.ResourceGraph of all known resource identifiers."""
+
+        return self._graph
 
     @property
     def resolved_resources(self):
@@ -76,80 +81,526 @@ class ResourceCollection(object):
     def unresolved_resources(self):
         """A list of resource identifiers that are yet unresolved."""
 
-        return [r_id for r_id, r_res in self._collected_resources.items()
-                if r_res is None]
+        return list(self._unresolved)
 
     @property
     def have_all_resources(self):
         """Return whether or not all known resources have been resolved."""
 
-        return len(self.unresolved_resources) == 0
+        return not self._unresolved
 
-    def resolve_missing_resources_one(self):
-        """One pass of resource resolution.
+    def _update_progress(self):
+        if progress.PROGRESS.active:
+            progress.PROGRESS.set_queue('resolve', collections.Counter(
+                parse_resource_id(r_id)[0] for r_id in self._unresolved))
 
-        Make one pass through the list of unresolved resources and try
-        to resolve them (collecting any additional dependencies.
-        """
+    def _add_resolved(self, resource_id, resource):
+        progress.PROGRESS.add_done('resolve',
+                                   parse_resource_id(resource_id)[0])
+        self._collected_resources[resource_id] = resource
+        self._unresolved.pop(resource_id, None)
+        for dep in resource.dependencies:
+            self.need_resource(dep)
+            self._graph.add_edge(resource_id, dep)
+
+    def _group_by_project(self, resource_ids):
+        """Group resource ids by project, checking any new projects.
 
-        for resource_id in self.unresolved_resources:
+        The pre-flight checks for a project are run (unless they passed
+        recently) the first time resolution reaches it, so that only
+        the projects a run actually touches are loaded.
+        """
+        by_project = collections.defaultdict(list)
+        for resource_id in resource_ids:
             project_id, local_id = parse_resource_id(resource_id)
             if project_id not in self.RESOURCE_TYPES:
                 raise exception.UnknownResourceType()
+            by_project[project_id].append(local_id)
+        preflight.PREFLIGHT.run(self._context,
+                                project_names=sorted(by_project))
+        return by_project
+
+    def _collect(self, project_id, local_ids):
+        project = self.RESOURCE_TYPES[project_id]
+        with stats.STATS.phase('collect:%s' % project_id):
+            resources = project.collect_resources_by_ids(self._context,
+                                                         local_ids)
+        missing = set(local_ids) - set(resources)
+        if missing:
+            raise exception.UnableToResolveResources(
+                'Unable to resolve %s resources %s' % (
+                    project_id, ','.join(sorted(missing))))
+        return resources
 
-            project = self.RESOURCE_TYPES[project_id]
-            resource = project.collect_resource_by_id(self._context,
-                                                      local_id)
-            self._collected_resources[resource_id] = resource
-            for dep in resource.dependencies:
-                self.need_resource(dep)
+    def resolve_missing_resources_one(self):
+        """One pass of resource resolution.
+
+        Make one pass through the current frontier of unresolved
+        resources and try to resolve them (collecting any additional
+        dependencies into the next frontier). The unresolved ids are
+        grouped by project so that each project can fetch its whole
+        set in bulk.
+
+        Returns the number of resources resolved.
+        """
+
+        by_project = self._group_by_project(self.unresolved_resources)
+
+        resolved = 0
+        for project_id, local_ids in by_project.items():
+            resources = self._collect(project_id, local_ids)
+            for local_id, resource in resources.items():
+                self._add_resolved('%s:%s' % (project_id, local_id),
+                                   resource)
+                resolved += 1
+            self._update_progress()
+        return resolved
+
+    def _resolve_concurrently(self):
+        """Resolve all resources with a pool of worker threads.
+
+        The frontier is split by project (and into chunks of at most
+        context.page_size ids) and each chunk is resolved by a worker
+        with its own admin context and database session, so lookups
+        against different databases overlap. As each chunk comes back,
+        its new dependencies are dispatched without waiting for the
+        other chunks in flight.
+        """
+
+        in_flight = {}
+        pending_ids = set()
+        chunk_size = self._context.page_size
+
+        def _dispatch(pool):
+            frontier = [r_id for r_id in self._unresolved
+                        if r_id not in pending_ids]
+            by_project = self._group_by_project(frontier)
+            for project_id, local_ids in by_project.items():
+                # NOTE: Load the project here, since loading it in a
+                # worker would patch the global config under the
+                # others.
+                self.RESOURCE_TYPES[project_id]
+                for i in range(0, len(local_ids), chunk_size):
+                    chunk = local_ids[i:i + chunk_size]
+                    future = pool.submit(self._collect, project_id, chunk)
+                    in_flight[future] = project_id
+                    pending_ids.update('%s:%s' % (project_id, local_id)
+                                       for local_id in chunk)
+
+        with futures.ThreadPoolExecutor(
+                max_workers=self._context.resolve_workers) as pool:
+            try:
+                _dispatch(pool)
+                while in_flight:
+                    done, _not_done = futures.wait(
+                        in_flight, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        project_id = in_flight.pop(future)
+                        for local_id, resource in future.result().items():
+                            resource_id = '%s:%s' % (project_id, local_id)
+                            pending_ids.discard(resource_id)
+                            self._add_resolved(resource_id, resource)
+                    self._update_progress()
+                    _dispatch(pool)
+            finally:
+                for future in in_flight:
+                    future.cancel()
 
     def resolve_missing_resources(self):
         """Resolve all resources.
 
         Attempt to repeatedly resolve all resources in the list of
         needed ones. This runs until we have resolved all resources or
-        we stop making progress.
+        we stop making progress. If context.resolve_workers is more than
+        one, the lookups are made concurrently.
 
         :raises: exception.UnableToResolveResources if some resources are not
                  resolvable
         """
 
-        last_unresolved = None
+        self._update_progress()
+        if self._context.resolve_workers > 1:
+            with stats.STATS.phase('resolve_concurrent'):
+                self._resolve_concurrently()
+
         while not self.have_all_resources:
-            self.resolve_missing_resources_one()
-            now_unresolved = self.unresolved_resources
-            if now_unresolved == last_unresolved:
+            with stats.STATS.phase('resolve_pass'):
+                resolved = self.resolve_missing_resources_one()
+            if not resolved:
                 raise exception.UnableToResolveResources()
-            last_unresolved = now_unresolved
 
-    def chown_resources(self):
+    def resolve_exact_resources(self, resource_ids):
+        """Resolve exactly @resource_ids, without their dependencies.
+
+        This is for when the full set of resources is already known,
+        such as one component of an already resolved graph.
+        """
+
+        for resource_id in resource_ids:
+            self.need_resource(resource_id)
+        by_project = self._group_by_project(resource_ids)
+        for project_id, local_ids in by_project.items():
+            resources = self._collect(project_id, local_ids)
+            for local_id, resource in resources.items():
+                resource_id = '%s:%s' % (project_id, local_id)
+                self._collected_resources[resource_id] = resource
+                self._unresolved.pop(resource_id, None)
+
+    def resolve_planned_resources(self, planned):
+        """Resolve the resources of a saved plan without discovery.
+
+        @planned is a dict of resource identifier: (version, dependencies)
+        as returned by plan.load_plan(). The versions are checked in
+        bulk by each project, and the dependencies are taken from the
+        plan instead of being looked up again.
+
+        :raises: exception.PlanOutOfDate if any resource has changed
+        :raises: exception.InvalidPlan if any planned dependency is not
+                 in the plan itself
+        """
+
+        missing = set(dep for _version, deps in planned.values()
+                      for dep in deps) - set(planned)
+        if missing:
+            raise exception.InvalidPlan(
+                'Plan is missing resources %s' % ','.join(sorted(missing)))
+
+        by_project = self._group_by_project(planned)
+        for project_id, local_ids in by_project.items():
+            project = self.RESOURCE_TYPES[project_id]
+            project_planned = {
+                local_id: planned['%s:%s' % (project_id, local_id)]
+                for local_id in local_ids}
+            with stats.STATS.phase('collect_planned:%s' % project_id):
+                resources = project.collect_planned_resources(
+                    self._context, project_planned)
+            for local_id, resource in resources.items():
+                resource_id = '%s:%s' % (project_id, local_id)
+                self.need_resource(resource_id)
+                self._collected_resources[resource_id] = resource
+                self._unresolved.pop(resource_id, None)
+                for dep in planned[resource_id][1]:
+                    self._graph.add_edge(resource_id, dep)
+
+    @staticmethod
+    def _resources_by_project(resources):
+        by_project = collections.defaultdict(list)
+        for resource in resources:
+            project_id, _local_id = parse_resource_id(resource.identifier)
+            by_project[project_id].append(resource)
+        return by_project
+
+    def _quota_deltas(self, resources):
+        """Add up the quota usage changes for @resources per project."""
+
+        deltas = {}
+        for project_id, resources in self._resources_by_project(
+                resources).items():
+            project = self.RESOURCE_TYPES[project_id]
+            project_deltas = project.quota_deltas(self._context, resources)
+            if project_deltas:
+                deltas[project_id] = project_deltas
+        return deltas
+
+    def chown_resources(self, exclude=None, quota_deltas=None, pool=None):
         """Actually change ownership of all resources in the collection.
 
         Does not actually change ownership if the context indicates a dry run
-        should be performed.
+        should be performed. Resources whose identifiers are in @exclude
+        are skipped. If context.chown_workers is more than one, each
+        connected component of the graph is chown'ed in a separate
+        worker process. Afterwards, quota usage is adjusted at once for
+        all of the resources that were chown'ed, even if some failed.
+        If a @quota_deltas dict is given, the changes are added to it
+        instead, to be applied later with reconcile_quotas(). A @pool
+        from chown_pool() is used for the workers if given, instead of
+        starting one just for this collection.
+
+        :raises: exception.ChownFailed if any component failed when
+                 using worker processes
         """
 
-        for resource in self.resolved_resources:
-            if self._context.dry_run:
+        exclude = exclude or set()
+        resources = [resource for resource in self.resolved_resources
+                     if resource.identifier not in exclude]
+
+        if self._context.dry_run:
+            for resource in resources:
                 LOG.info('Would chown resource %s' % resource.identifier)
+            return
+
+        by_project = self._resources_by_project(resources)
+        # NOTE: Projects report chown progress under their own name.
+        progress.PROGRESS.set_queue('chown', {
+            self.RESOURCE_TYPES[project_id].name: len(project_resources)
+            for project_id, project_resources in by_project.items()})
+
+        chowned = {}
+        try:
+            if self._context.chown_workers > 1:
+                with contextlib.ExitStack() as stack:
+                    if pool is None:
+                        pool = stack.enter_context(chown_pool(self._context))
+                    self._chown_components(exclude, chowned, pool)
             else:
-                LOG.info('Chowning resource %s' % resource.identifier)
-                resource.chown(self._context)
+                self._chown_serially(by_project, chowned)
+        finally:
+            if quota_deltas is None:
+                reconcile_quotas(self._context, chowned)
+            else:
+                add_quota_deltas(quota_deltas, chowned)
 
+    def _chown_serially(self, by_project, chowned):
+        """Chown each project's resources in turn in this process.
 
-def _workflow_main(context, collection):
-    try:
-        collection.resolve_missing_resources()
-    except exception.ChownException as e:
-        LOG.error('Unable to resolve resources: %s' % e)
+        The quota deltas of each project are added to @chowned once
+        its resources have been chown'ed.
+        """
+
+        deltas = self._quota_deltas(
+            [resource for resources in by_project.values()
+             for resource in resources])
+        for project_id, resources in by_project.items():
+            project = self.RESOURCE_TYPES[project_id]
+            with stats.STATS.phase('chown:%s' % project_id):
+                counts = project.chown_resources(self._context, resources)
+            for table, count in sorted(counts.items()):
+                LOG.info('Changed ownership of %i %s %s rows' % (
+                    count, project_id, table))
+            if project_id in deltas:
+                add_quota_deltas(chowned, {project_id: deltas[project_id]})
+
+    def check_resources(self, exclude=None):
+        """Check that the collection can be chown'ed, before any of it is.
+
+        Each project checks its resources (except those in @exclude).
+
+        :raises: exception.ResourceInUse if some are shared with
+                 resources outside the collection
+        """
+
+        exclude = exclude or set()
+        resources = [resource for resource in self.resolved_resources
+                     if resource.identifier not in exclude]
+        for project_id, resources in self._resources_by_project(
+                resources).items():
+            project = self.RESOURCE_TYPES[project_id]
+            with stats.STATS.phase('check:%s' % project_id):
+                project.check_resources(self._context, resources)
+
+    def verify_resources(self, exclude=None):
+        """Check that all resources in the collection have been chown'ed.
+
+        Each project checks its resources (except those in @exclude)
+        with a few set-based queries. Returns a dict of project:
+        {table: [mismatched id]} for any rows that were not chown'ed.
+        """
+
+        exclude = exclude or set()
+        resources = [resource for resource in self.resolved_resources
+                     if resource.identifier not in exclude]
+        mismatched = {}
+        for project_id, resources in self._resources_by_project(
+                resources).items():
+            project = self.RESOURCE_TYPES[project_id]
+            with stats.STATS.phase('verify:%s' % project_id):
+                tables = project.verify_resources(self._context, resources)
+            for table, ids in sorted(tables.items()):
+                LOG.error('%i %s %s rows were not chowned: %s' % (
+                    len(ids), project_id, table, ','.join(ids)))
+            if tables:
+                mismatched[project_id] = tables
+        return mismatched
+
+    def _chown_components(self, exclude, chowned, pool):
+        resolved = set(r_id for r_id, res in self._collected_resources.items()
+                       if res is not None and res.identifier not in exclude)
+        components = [[r_id for r_id in component if r_id in resolved]
+                      for component in self._graph.connected_components()]
+        components = [component for component in components if component]
+
+        LOG.info('Chowning %i components with %i worker processes' % (
+            len(components), self._context.chown_workers))
+        worker_context = copy.copy(self._context)
+        worker_context.chown_workers = 1
+        worker_context.resolve_workers = 1
+        # NOTE: Workers only resolve what they are given, so they have
+        # no use for the (possibly large) attachment index.
+        worker_context.attachments = None
+
+        with stats.STATS.phase('chown_components'):
+            fs = [pool.submit(_chown_component, worker_context, component)
+                  for component in components]
+            for future in futures.as_completed(fs):
+                result = future.result()
+                stats.STATS.merge(result.pop('stats'))
+                if result['success']:
+                    for r_id in result['resources']:
+                        project_id = parse_resource_id(r_id)[0]
+                        progress.PROGRESS.add_done(
+                            'chown', self.RESOURCE_TYPES[project_id].name)
+            results = [future.result() for future in fs]
+
+        # NOTE: The workers leave quota usage alone, so that it is
+        # adjusted once for all the components that made it.
+        add_quota_deltas(chowned, self._quota_deltas(
+            [self._collected_resources[r_id] for result in results
+             if result['success'] for r_id in result['resources']]))
+
+        failed = [result for result in results if not result['success']]
+        for result in failed:
+            LOG.error('Failed to chown %s: %s' % (
+                ','.join(result['resources']), result['error']))
+        if failed:
+            raise exception.ChownFailed(
+                '%i of %i components failed' % (len(failed), len(results)))
+
+
+@contextlib.contextmanager
+def chown_pool(context):
+    """Start a pool of context.chown_workers worker processes.
+
+    Yields the pool, or None if @context does not use workers. Starting
+    a worker loads and configures each project it needs again, so a
+    pool should be reused by every collection chown'ed in a run.
+    """
+
+    if context.chown_workers <= 1 or context.dry_run:
+        yield None
         return
 
-    LOG.info('Resolved %i resources to be chowned: %s' % (
-        len(collection.resolved_resources),
-        ','.join([r.identifier for r in collection.resolved_resources])))
+    # NOTE: Spawn rather than fork the workers, so that each one
+    # loads the projects and their config for itself instead of
+    # inheriting our database connections.
+    mp_context = multiprocessing.get_context('spawn')
+    writers = mp_context.BoundedSemaphore(context.max_db_writers)
+    with futures.ProcessPoolExecutor(
+            max_workers=context.chown_workers,
+            mp_context=mp_context,
+            initializer=_init_chown_worker,
+            initargs=(writers, _get_log_levels(),
+                      throttle.THROTTLE.divided(context.chown_workers),
+                      stats.STATS.enabled,
+                      projects.PROJECTS.connections)) as pool:
+        yield pool
+
+
+def add_quota_deltas(total, deltas):
+    """Add a dict of project: {key: delta} to another like it."""
+
+    for project_id, project_deltas in deltas.items():
+        project_total = total.setdefault(project_id, {})
+        for key, delta in project_deltas.items():
+            project_total[key] = project_total.get(key, 0) + delta
+
+
+def reconcile_quotas(context, deltas):
+    """Apply a dict of project: {key: delta} once per project."""
+
+    for project_id, project_deltas in sorted(deltas.items()):
+        project = ResourceCollection.RESOURCE_TYPES[project_id]
+        project_deltas = {key: delta
+                          for key, delta in project_deltas.items() if delta}
+        if not project_deltas:
+            continue
+        with stats.STATS.phase('quota:%s' % project_id):
+            count = project.apply_quota_deltas(context, project_deltas)
+        LOG.info('Adjusted %i %s quota usage rows' % (count, project_id))
+
+
+def _get_log_levels():
+    """Return a dict of logger name: level for every level that is set."""
+    levels = {name: logger.level
+              for name, logger in logging.root.manager.loggerDict.items()
+              if isinstance(logger, logging.Logger) and logger.level}
+    levels[None] = logging.getLogger().level
+    return levels
+
+
+def _init_chown_worker(writers, log_levels, limits, stats_enabled,
+                       connections):
+    """Set up a worker process like the one that started it.
+
+    Spawned workers start from scratch, so the logging levels, throttle
+    limits, statistics and database overrides are passed along.
+    """
+    global _WRITERS
+    _WRITERS = writers
+    # NOTE: The projects were checked before the graph was resolved.
+    preflight.PREFLIGHT.enabled = False
+    throttle.THROTTLE.configure(*limits)
+    stats.STATS.enabled = stats_enabled
+    projects.PROJECTS.connections.update(connections)
+    logging.basicConfig(format='%(levelname)s:%(message)s')
+    for name, level in log_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def _chown_component(context, resource_ids):
+    """Chown one connected component of a graph in a worker process.
+
+    Returns a result dict for the component, including the statistics
+    recorded for it.
+    """
 
-    collection.chown_resources()
+    stats.STATS.reset()
+    result = {'resources': resource_ids, 'success': False}
+    try:
+        collection = ResourceCollection(context)
+        collection.resolve_exact_resources(resource_ids)
+        with _WRITERS:
+            collection.chown_resources(quota_deltas={})
+        result['success'] = True
+    except Exception as e:
+        LOG.exception('Failed to chown %s' % ','.join(resource_ids))
+        result['error'] = str(e) or e.__class__.__name__
+    result['stats'] = stats.STATS.summary()
+    return result
+
+
+def _chown_and_verify(context, collection, exclude=None, quota_deltas=None,
+                      pool=None):
+    """Chown a resolved collection, and verify it if context.verify.
+
+    @quota_deltas and @pool are as for ResourceCollection.chown_resources().
+    Returns a dict of mismatched ids as from verify_resources().
+    """
+
+    collection.check_resources(exclude=exclude)
+    collection.chown_resources(exclude=exclude, quota_deltas=quota_deltas,
+                               pool=pool)
+    if not context.verify or context.dry_run:
+        return {}
+    mismatched = collection.verify_resources(exclude=exclude)
+    if not mismatched:
+        LOG.info('Verified ownership of %i resources' % (
+            len(collection.resolved_resources) - len(exclude or ())))
+    return mismatched
+
+
+def _workflow_main(context, collection, quota_deltas=None, pool=None):
+    with stats.STATS.phase('workflow'):
+        try:
+            collection.resolve_missing_resources()
+        except exception.ChownException as e:
+            LOG.error('Unable to resolve resources: %s' % e)
+            return False
+
+        LOG.info('Resolved %i resources to be chowned: %s' % (
+            len(collection.resolved_resources),
+            ','.join([r.identifier for r in collection.resolved_resources])))
+
+        if context.save_plan:
+            plan.save_plan(context.save_plan, context, collection)
+            LOG.info('Saved plan to %s' % context.save_plan)
+
+        try:
+            return not _chown_and_verify(context, collection,
+                                         quota_deltas=quota_deltas,
+                                         pool=pool)
+        except exception.ChownException as e:
+            LOG.error('Unable to chown resources: %s' % e)
+            return False
 
 
 def workflow_nova(context, instance_id):
@@ -157,7 +608,7 @@ def workflow_nova(context, instance_id):
 
     collection = ResourceCollection(context)
     collection.need_resource('nova:%s' % instance_id)
-    _workflow_main(context, collection)
+    return _workflow_main(context, collection)
 
 
 def workflow_cinder(context, volume_id):
@@ -165,4 +616,264 @@ def workflow_cinder(context, volume_id):
 
     collection = ResourceCollection(context)
     collection.need_resource('cinder:%s' % volume_id)
-    _workflow_main(context, collection)
+    return _workflow_main(context, collection)
+
+
+def workflow_plan(context, plan_path):
+    """Change ownership of the resources in a saved plan.
+
+    Instead of discovering the resources again, only check that none
+    of them have changed since the plan was saved.
+    """
+
+    collection = ResourceCollection(context)
+    try:
+        planned = plan.load_plan(plan_path, context)
+        collection.resolve_planned_resources(planned)
+    except exception.ChownException as e:
+        LOG.error('Unable to apply plan: %s' % e)
+        return False
+
+    LOG.info('Loaded %i resources to be chowned from plan %s' % (
+        len(collection.resolved_resources), plan_path))
+    try:
+        return not _chown_and_verify(context, collection)
+    except exception.ChownException as e:
+        LOG.error('Unable to chown resources: %s' % e)
+        return False
+
+
+def _iter_projects(project_names):
+    if project_names is None:
+        return ResourceCollection.RESOURCE_TYPES.items()
+    return [(name, ResourceCollection.RESOURCE_TYPES[name])
+            for name in project_names]
+
+
+def iter_project_pages(context, project_id, project_names=None):
+    """Generate pages of resource identifiers owned by @project_id.
+
+    Each chown'able project (or only those in @project_names) is listed
+    in turn, one page of at most context.page_size resources at a time.
+    """
+
+    for name, project in _iter_projects(project_names):
+        for page in project.iter_resource_ids_by_owner(context, project_id):
+            yield ['%s:%s' % (name, local_id) for local_id in page]
+
+
+def build_attachment_index(context, project_id, project_names=None):
+    """Scan the attachments of everything owned by @project_id.
+
+    Each project (or only those in @project_names) scans its side of
+    the attachments once, and the result is an
+    attachments.AttachmentIndex.
+    """
+
+    index = attachments.AttachmentIndex()
+    with stats.STATS.phase('attachment_index'):
+        for name, project in _iter_projects(project_names):
+            project.scan_attachments(context, project_id, index)
+    LOG.info('Indexed %i attachments for project %s' % (len(index),
+                                                        project_id))
+    return index
+
+
+def count_project_resources(context, project_id):
+    """Count the resources owned by @project_id, for reporting progress.
+
+    Returns a dict of project name: resources, from each project's
+    estimate() queries. Projects that cannot count are left out.
+    """
+
+    totals = {}
+    with stats.STATS.phase('count_resources'):
+        for name, project in ResourceCollection.RESOURCE_TYPES.items():
+            count = project.count_resources(
+                project.estimate(context, project_id))
+            if count is not None:
+                totals[project.name] = count
+    return totals
+
+
+def workflow_project(context, project_id):
+    """Resolve and change ownership of all resources owned by a project.
+
+    Each page of listed resources is resolved and chown'ed as its own
+    collection before the next one is fetched, so only one page (plus
+    its dependencies) is held in memory at a time. Resources already
+    handled as a dependency of an earlier page are skipped. The
+    attachments of the whole project are indexed up front, so that
+    resolving each page does not have to query them from both sides.
+    Quota usage is adjusted once after the last page, or after the
+    page that failed, for everything that was chown'ed. With workers,
+    one pool of them is used for every page. If progress is being
+    reported, the resources are counted first so that it covers the
+    whole move rather than each page. Each project checks up front
+    that nothing it owns would be refused, so that a move which cannot
+    finish fails before anything is chown'ed.
+    """
+
+    context = copy.copy(context)
+    context.source_project_id = project_id
+    try:
+        context.attachments = build_attachment_index(context, project_id)
+    except exception.ChownException as e:
+        LOG.error('Unable to index attachments: %s' % e)
+        return False
+    try:
+        with stats.STATS.phase('check_project'):
+            for name, project in ResourceCollection.RESOURCE_TYPES.items():
+                project.check_project(context, project_id)
+    except exception.ChownException as e:
+        LOG.error('Unable to move project %s: %s' % (project_id, e))
+        return False
+
+    if progress.PROGRESS.active:
+        try:
+            progress.PROGRESS.set_totals(
+                count_project_resources(context, project_id))
+        except exception.ChownException as e:
+            LOG.warning('Unable to count resources, progress will only '
+                        'cover each page: %s' % e)
+
+    handled = set()
+    quota_deltas = {}
+    try:
+        with chown_pool(context) as pool:
+            for page in iter_project_pages(context, project_id):
+                collection = ResourceCollection(context)
+                for resource_id in page:
+                    if resource_id not in handled:
+                        collection.need_resource(resource_id)
+                if collection.have_all_resources:
+                    continue
+                if not _workflow_main(context, collection, quota_deltas,
+                                      pool):
+                    return False
+                handled.update(
+                    r.identifier for r in collection.resolved_resources)
+    finally:
+        reconcile_quotas(context, quota_deltas)
+        progress.PROGRESS.set_totals({})
+    return True
+
+
+def workflow_estimate(context, project_id):
+    """Estimate the work of moving all resources owned by a project.
+
+    Each project counts what it would touch with aggregate queries and
+    projects the statements needed to list, resolve and chown that with
+    the options in @context, without building any resources. These are
+    timed at the round trip latency of its slowest database, or at the
+    --max-qps limit if that is slower, for a run without workers.
+
+    Returns a dict of the counts, statements and seconds per project,
+    and the total seconds.
+    """
+
+    estimate = {'projects': {}, 'seconds': 0.0}
+    max_qps = throttle.THROTTLE.limits.max_qps
+    for name, project in ResourceCollection.RESOURCE_TYPES.items():
+        with stats.STATS.phase('estimate:%s' % name):
+            counts = project.estimate(context, project_id)
+            latency = max([base.measure_latency(engine) for engine in
+                           project.get_engines().values()] or [0.0])
+        statements = project.estimate_statements(context, counts)
+        seconds = statements * latency
+        if max_qps:
+            seconds = max(seconds, statements / float(max_qps))
+        LOG.info('Moving %s resources would take about %i statements' % (
+            name, statements))
+        estimate['projects'][name] = {
+            'counts': counts,
+            'statements': statements,
+            'latency': latency,
+            'seconds': seconds,
+        }
+        estimate['seconds'] += seconds
+    return estimate
+
+
+def workflow_batch(jobs):
+    """Resolve and change ownership for a batch of root resources.
+
+    @jobs is a list of (job_id, context, resource_id), which are run in
+    order in this process, sharing the loaded projects and their
+    database connections. A job whose graph overlaps with that of an
+    earlier job is merged with it: resources already chown'ed to the
+    same target are skipped, and the job fails if any of them were
+    moved to a different target.
+
+    The pre-flight checks for the root resources' projects are run
+    first (unless they passed recently), and every job fails if they
+    do. Projects reached as dependencies are checked as they are
+    reached.
+
+    Returns a list with a result dict for each job, in order.
+    """
+
+    try:
+        preflight.PREFLIGHT.run(
+            jobs[0][1] if jobs else None,
+            project_names=sorted(set(parse_resource_id(resource_id)[0]
+                                     for _index, _context, resource_id
+                                     in jobs)))
+    except exception.ProjectCheckFailed as e:
+        return [{'job': index, 'resource': resource_id,
+                 'target_user': context.target_user_id,
+                 'target_project': context.target_project_id,
+                 'success': False, 'error': str(e)}
+                for index, context, resource_id in jobs]
+
+    owners = {}
+    results = []
+    for index, context, resource_id in jobs:
+        target = (context.target_user_id, context.target_project_id)
+        result = {'job': index, 'resource': resource_id,
+                  'target_user': target[0], 'target_project': target[1],
+                  'success': False}
+        results.append(result)
+
+        collection = ResourceCollection(context)
+        collection.need_resource(resource_id)
+        try:
+            collection.resolve_missing_resources()
+        except exception.ChownException as e:
+            LOG.error('Job %i: unable to resolve resources: %s' % (index, e))
+            result['error'] = 'Unable to resolve resources: %s' % e
+            continue
+
+        identifiers = [r.identifier for r in collection.resolved_resources]
+        merged = [i for i in identifiers if i in owners]
+        conflicts = ['%s (job %i)' % (i, owners[i][0])
+                     for i in merged if owners[i][1] != target]
+        result['resources'] = identifiers
+        result['merged'] = merged
+        if conflicts:
+            LOG.error('Job %i: resources already moved to a different '
+                      'target: %s' % (index, ','.join(conflicts)))
+            result['error'] = ('Resources already moved to a different '
+                               'target: %s' % ','.join(conflicts))
+            continue
+
+        LOG.info('Job %i: resolved %i resources to be chowned (%i merged '
+                 'with earlier jobs)' % (
+                     index, len(identifiers), len(merged)))
+        try:
+            mismatched = _chown_and_verify(context, collection,
+                                           exclude=set(merged))
+        except Exception as e:
+            LOG.exception('Job %i: failed to chown resources' % index)
+            result['error'] = 'Failed to chown resources: %s' % e
+            continue
+
+        for identifier in identifiers:
+            owners.setdefault(identifier, (index, target))
+        if mismatched:
+            result['mismatched'] = mismatched
+            result['error'] = 'Some resources were not chowned'
+        else:
+            result['success'] = True
+
+    return results
@@ -17,6 +17,11 @@ setuptools.setup(
     license='Apache-2',
     entry_points={
         'console_scripts': ['oschown=oschown.main:main'],
+        'oschown.projects': [
+            'cinder=oschown.chown_cinder:CinderProject',
+            'nova=oschown.chown_nova:NovaProject',
+            'neutron=oschown.chown_neutron:NeutronProject',
+        ],
     },
     packages=['oschown'],
 )